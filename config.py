@@ -18,6 +18,16 @@ config_data = attrdict({
         "station" : "PWS:<pws station id>",
     },
     
+    "xbee_gateway" : {
+        # where metrics are served as JSON; a (host, port) tuple or the
+        # path of a Unix socket.  not served unless set
+        # "metrics_address" : ("127.0.0.1", 9998),
+        
+        # seconds within which a repeated frame from a device is dropped as
+        # a duplicate.  every frame is published unless set
+        # "dedup_window" : 0.5,
+    },
+    
     "xmlrpc_server" : {
         "host" : "xmlrpc_server_host",
         "port" : 9999,
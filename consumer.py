@@ -13,12 +13,24 @@ import pika
 
 import logging
 import threading
-import Queue
 import uuid
 
 import time
+import resource
 
 from support import serializer_utils
+from support import tx_scheduler
+from support import xbee_addr
+from support import broker_connections
+from support import rpc_pool
+from support import pipeline
+from support.confirm_publisher import ConfirmPublisher
+from support.deadline_heap import DeadlineTimer, monotonic
+
+# priority classes for _send_data and _send_remote_at
+PRIORITY_CONTROL = tx_scheduler.PRIORITY_CONTROL
+PRIORITY_DEFAULT = tx_scheduler.PRIORITY_DEFAULT
+PRIORITY_TELEMETRY = tx_scheduler.PRIORITY_TELEMETRY
 
 class InvalidDestination(Exception):
     pass
@@ -33,7 +45,7 @@ class XBeeRequest(object):
     """Encapsulation of state data for transmitting outbound XBee frames"""
     
     # {{{ __init__
-    def __init__(self, dest, msg_body, async, timeout = None):
+    def __init__(self, dest, msg_body, async, timeout = None, owner = None):
         super(XBeeRequest, self).__init__()
         
         self.ticket = str(uuid.uuid4())
@@ -43,11 +55,15 @@ class XBeeRequest(object):
         self.msg_body = msg_body
         self.async = async
         
+        # the consumer that sent the request, which handles its replies
+        self.owner = owner
+        
         if timeout == None:
             timeout = 120
         
-        # request expires in 2 minutes
-        self.__expiration = time.time() + timeout
+        # request expires in 2 minutes, by default
+        self.timeout = timeout
+        self.deadline = monotonic() + timeout
         
         self.response = None
     
@@ -55,7 +71,35 @@ class XBeeRequest(object):
     
     # {{{ is_expired
     def is_expired(self):
-         return time.time() > self.__expiration
+         return monotonic() >= self.deadline
+    
+    # }}}
+    
+    # {{{ done
+    def done(self):
+        """returns True once a reply has been received or the request has expired"""
+        
+        return self.event.is_set()
+    
+    # }}}
+    
+    # {{{ result
+    def result(self, timeout = None):
+        """
+        Waits for the reply, by default until the request expires, and
+        returns it; raises NoResponse if there isn't one.  Mustn't be called
+        from the thread consuming replies.
+        """
+        
+        if timeout is None:
+            timeout = max(self.deadline - monotonic(), 0) + 1
+        
+        self.event.wait(timeout)
+        
+        if self.response is None:
+            raise NoResponse("no reply received for %r" % self)
+        
+        return self.response
     
     # }}}
     
@@ -78,7 +122,9 @@ class RPCRequest(object):
         content_type = None,
         reply_to = None,
         callback = None,
-        args = None
+        args = None,
+        queue = None,
+        deadline = None
     ):
         
         super(RPCRequest, self).__init__()
@@ -88,6 +134,10 @@ class RPCRequest(object):
         self.reply_to       = reply_to
         self.callback       = callback
         self.args           = args
+        self.queue          = queue
+        
+        # monotonic() time after which the caller won't be waiting, if known
+        self.deadline       = deadline
         
         self.response = None
     
@@ -102,19 +152,19 @@ class RPCRequest(object):
 # }}}}
 
 # {{{{ class RPCWorker
-class RPCWorker(threading.Thread):
-    """Threaded worker class for handling RPC invocations"""
+class RPCWorker(rpc_pool.RPCWorkerPool):
+    """
+    Pool of worker threads for handling RPC invocations; requests from
+    each RPC queue run one at a time unless the queue's limit is raised
+    """
     
     # {{{ __init__
-    def __init__(self, conn_params):
-        super(RPCWorker, self).__init__(target = self.__runner)
-        
-        self._logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+    def __init__(self, connections, size = 4):
+        super(RPCWorker, self).__init__(size = size, name = "rpc_worker")
         
-        self.__connection_params = conn_params
-        
-        self.__pending_requests = Queue.Queue()
-        self.__shutdown_event = threading.Event()
+        # replies are published over the process's shared connection
+        self.__chan = connections.publishing_channel()
+        self.__chan.add_on_return_callback(self.__on_returned_msg)
     
     # }}}
     
@@ -122,16 +172,7 @@ class RPCWorker(threading.Thread):
     def add_request(self, req):
         """Enqueues an RPCRequest"""
         
-        self.__pending_requests.put(req)
-    
-    # }}}
-    
-    # {{{ shutdown
-    def shutdown(self):
-        """Initiates an orderly shutdown of this thread"""
-        
-        self._logger.debug("shutdown requested")
-        self.__shutdown_event.set()
+        self.submit(req.queue, req.deadline, self.__invoke, req)
     
     # }}}
     
@@ -141,49 +182,36 @@ class RPCWorker(threading.Thread):
     
     # }}}
     
-    # {{{ __runner
-    def __runner(self):
-        """
-        The thread target; handles RPC invocations and publishes the result
-        """
+    # {{{ __invoke
+    def __invoke(self, req):
+        """handles an RPC invocation and publishes the result"""
         
-        conn = pika.BlockingConnection(self.__connection_params)
-        chan = conn.channel()
+        self._logger.debug("invoking %r", req)
         
-        chan.add_on_return_callback(self.__on_returned_msg)
+        response = {}
         
-        while not self.__shutdown_event.is_set():
-            try:
-                req = self.__pending_requests.get(True, 5)
-                
-                self._logger.debug("invoking %r", req)
-                
-                response = {}
-                
-                try:
-                    response['result'] = req.callback(*req.args)
-                except:
-                    self._logger.warn("exception invoking %r", req, exc_info = True)
-                    
-                    # the exception value
-                    response['exception'] = sys.exc_info()[1]
-                
-                resp_body = serializer_utils.serialize(response, req.content_type)
-
-                chan.basic_publish(
-                    exchange='',
-                    routing_key = req.reply_to,
-                    properties = pika.BasicProperties(
-                        correlation_id = req.correlation_id,
-                        content_type = req.content_type,
-                    ),
-                    body = resp_body
-                )
-            except Queue.Empty:
-                pass
+        try:
+            response['result'] = req.callback(*req.args)
+        except:
+            self._logger.warn("exception invoking %r", req, exc_info = True)
             
+            # the exception value
+            response['exception'] = sys.exc_info()[1]
         
-        conn.close()
+        resp_body = serializer_utils.serialize(response, req.content_type)
+        
+        try:
+            self.__chan.basic_publish(
+                exchange='',
+                routing_key = req.reply_to,
+                properties = pika.BasicProperties(
+                    correlation_id = req.correlation_id,
+                    content_type = req.content_type,
+                ),
+                body = resp_body
+            )
+        except broker_connections.CONNECTION_ERRORS:
+            self._logger.error("unable to publish reply to %r", req, exc_info = True)
     
     # }}}
 
@@ -195,6 +223,23 @@ class BaseConsumer(object):
     classes will only need to implement handle_packet().
     """
     
+    # seconds between attempts to reconnect after the consuming
+    # connection is lost
+    RECONNECT_INTERVAL = 5
+    
+    # threads handling RPC requests; see _limit_rpc_queue
+    RPC_WORKERS = 4
+    
+    # sensor data and events waiting to be published, beyond which more
+    # are dropped; and seconds to wait for them at shutdown
+    PUBLISH_QUEUE_SIZE = 1000
+    PUBLISH_FLUSH_TIMEOUT = 10
+    
+    # conversion between raw and formatted addresses, interned in a table
+    # shared with the rest of the process
+    _format_addr = staticmethod(xbee_addr.format_addr)
+    _parse_addr = staticmethod(xbee_addr.parse_addr)
+    
     # {{{ __init__
     # @param addrs tuple of addresses to receive frames for, or "ALL" to receive all
     def __init__(self, addrs = ('#')):
@@ -216,39 +261,95 @@ class BaseConsumer(object):
             host = config.message_broker.host
         )
         
+        # connections are shared by everything in the process using the
+        # same broker; consuming channels belong to the thread that opens
+        # them, publishing channels may be used from any thread
+        self._connections = broker_connections.get_manager(self._connection_params)
+        
         self.__queue_name = None
         
-        self.__publisher_conn = None
-        self.__publisher_chan = None
+        # channel for transmitting XBee frames
+        self.__rpc_chan = self._connections.publishing_channel()
         
-        self.__rpc_conn = None
-        self.__rpc_chan = None
+        # publishes sensor data and events with confirms, on a thread and
+        # connection of its own, so publishing never blocks handle_packet;
+        # see __get_publisher
+        self.__publisher = None
         
-        self.__xb_frame_conn = None
+        # opened by __run_thread
         self.__xb_frame_chan = None
         self.__rpc_receive_chan = None
         
-        self.__rpc_worker = RPCWorker(self._connection_params)
+        # started by __run_thread if there are RPC functions to serve; the
+        # limits set by _limit_rpc_queue until then
+        self.__rpc_worker = None
+        self.__rpc_limits = {}
         
         # queue for response frames that aren't explicitly handled in
         # handle_packet, so that __send_xb_frame can get to them.
         self.__pending_xb_requests = {}
         self.__pending_xb_requests_lock = threading.RLock()
         
+        # expires pending requests, by ticket, waking anyone waiting on
+        # them; see __get_request_expiry
+        self.__xb_request_expiry = None
+        
+        # guards creating the publisher and request expiry when first
+        # needed, which attached consumers never do for themselves
+        self.__lazy_lock = threading.Lock()
+        
         # map used for configuring rpc methods. map contains a map of 
         #   queue => [function]
         self.__rpc_queue_map = {}
         
         # default; will be set again in process_forever
         self.__main_thread_name = threading.currentThread().name
+        
+        # the consumer whose queue replies to our requests are sent to;
+        # another one if we're attached to a host
+        self.__transport = self
+    
+    # }}}
+    
+    # {{{ _attach_to
+    def _attach_to(self, host):
+        """
+        Makes this consumer send and receive through host, another
+        BaseConsumer, rather than running process_forever itself.  Replies
+        to our XBee requests come back on host's queue and are handed back
+        to us, our RPC functions are served by host's worker, and what we
+        publish goes out on host's publisher; we start no threads of our
+        own.  Call before host is started, and before we send or publish
+        anything; routing frames to us is up to host.
+        """
+        
+        assert host.__xb_frame_chan is None, "call before host is started"
+        assert (self.__publisher is None) and (self.__xb_request_expiry is None), \
+            "call before sending or publishing"
+        
+        self.__transport = host
+        
+        self.__pending_xb_requests = host.__pending_xb_requests
+        self.__pending_xb_requests_lock = host.__pending_xb_requests_lock
+        
+        host.__rpc_limits.update(self.__rpc_limits)
+        self.__rpc_limits = host.__rpc_limits
+        
+        for queue, funcs in self.__rpc_queue_map.items():
+            assert queue not in host.__rpc_queue_map, "RPC queue %s already served" % queue
+            
+            host.__rpc_queue_map[queue] = funcs
     
     # }}}
     
     # {{{ _create_broker_connection
     def _create_broker_connection(self):
-        """returns a new broker connection"""
+        """
+        returns a new broker connection, for a subclass consuming on a
+        thread of its own
+        """
         
-        return pika.BlockingConnection(self._connection_params)
+        return self._connections.connect()
     
     # }}}
     
@@ -273,6 +374,21 @@ class BaseConsumer(object):
     
     # }}}
     
+    # {{{ _limit_rpc_queue
+    def _limit_rpc_queue(self, queue, limit):
+        """
+        Allows limit requests from queue to be handled at once; by default
+        they're handled one at a time, so RPC functions needn't be
+        thread-safe.
+        """
+        
+        self.__rpc_limits[queue] = limit
+        
+        if self.__transport.__rpc_worker is not None:
+            self.__transport.__rpc_worker.set_limit(queue, limit)
+    
+    # }}}
+    
     # {{{ check_frame_status
     def _check_remote_at_frame_status(self, frame):
         # frame id should be remote_at_response
@@ -309,84 +425,190 @@ class BaseConsumer(object):
     # if async is true, let the main message handler deal with the responses.
     # this is to facilitate commands which might return multiple responses, 
     # like the ND (node discover) remote AT command
-    def __send_xb_frame(self, dest, msg_body, async = False, timeout = None):
+    #
+    # the gateway sends higher priority frames first; frames sent while
+    # handling an RPC request are control commands unless told otherwise.
+    # a queued frame is replaced by a newer one with the same dest and
+    # coalesce key, and its sender gets a reply with id 'superseded'.
+    #
+    # returns at once; the XBeeRequest's result() waits for the reply.
+    def __send_xb_frame(self, dest, msg_body, async = False, timeout = None,
+                        priority = None, coalesce = None):
         """dest is a formatted address"""
         
-        assert self.__main_thread_name != threading.currentThread().name, \
-            "DEADLOCK: spawn a new thread"
+        transport = self.__transport
         
         if (not self.__allow_all_addrs) and (dest not in self._xbee_addresses):
             raise InvalidDestination("destination address %s is not configured for this consumer" % dest)
         
-        req = XBeeRequest(dest, msg_body, async, timeout)
+        if (timeout is None) and (not async):
+            # that's as long as we'll wait
+            timeout = 30
+        
+        req = XBeeRequest(dest, msg_body, async, timeout, owner = self)
+        
+        if priority is None:
+            rpc_worker = transport.__rpc_worker
+            
+            if (rpc_worker is not None) and rpc_worker.in_worker():
+                priority = PRIORITY_CONTROL
+            else:
+                priority = PRIORITY_DEFAULT
+        
+        # keep_alive tells the remote end to keep the request around for 
+        # multiple replies
+        headers = dict(keep_alive = str(async), priority = priority)
+        
+        if coalesce is not None:
+            headers['coalesce'] = coalesce
         
         with self.__pending_xb_requests_lock:
             self.__pending_xb_requests[req.ticket] = req
+            self.__get_request_expiry().add(req.ticket, req.deadline)
+        
+        self.__rpc_chan.basic_publish(
+            exchange = '',
+            routing_key = 'xbee_tx',
+            properties = pika.BasicProperties(
+                reply_to = transport.__queue_name,
+                correlation_id = req.ticket,
+                content_type = serializer_utils.CONTENT_TYPE_BINARY,
+                headers = headers
+            ),
+            immediate = True,
+            mandatory = True,
+            body = serializer_utils.serialize(req.msg_body, serializer_utils.CONTENT_TYPE_BINARY)
+        )
         
-        with self.__rpc_chan_lock:
-            # keep_alive tells the remote end to keep the request around for 
-            # multiple replies
-            self.__rpc_chan.basic_publish(
-                exchange = '',
-                routing_key = 'xbee_tx',
-                properties = pika.BasicProperties(
-                    reply_to = self.__queue_name,
-                    correlation_id = req.ticket,
-                    content_type = serializer_utils.CONTENT_TYPE_BINARY,
-                    headers = dict(keep_alive = str(async))
-                ),
-                immediate = True,
-                mandatory = True,
-                body = serializer_utils.serialize(req.msg_body, serializer_utils.CONTENT_TYPE_BINARY)
-            )
+        return req
+    
+    # }}}
+    
+    # {{{ __assert_may_block
+    def __assert_may_block(self):
+        """replies are received on the consuming thread, so it mustn't wait for them"""
         
-        if not async:
-            # wait 30s for the reply to our call to be received
-            req.event.wait(30)
-            
-            if not req.event.is_set():
-                raise NoResponse("no reply received for %r" % req)
-            
-            return req.response
-        else:
-            return req
+        assert self.__transport.__main_thread_name != threading.currentThread().name, \
+            "DEADLOCK: spawn a new thread"
     
     # }}}
     
-    # {{{ _send_remote_at
-    def _send_remote_at(self, dest, command, param_val = None, async = False, timeout = None):
-        # if async is true, retVal is a request ticket, otherwise it's the 
-        # XBeeRequest instance
+    # {{{ __wait_for
+    def __wait_for(self, req):
+        self.__assert_may_block()
+        
+        # the request's event is also set when it expires
+        return req.result(req.timeout + 1)
+    
+    # }}}
+    
+    # {{{ __remote_at_body
+    def __remote_at_body(self, dest, command, param_val):
+        return {
+            'method' : 'send_remote_at',
+            'dest' : dest,
+            'command' : command,
+            'param_val' : param_val,
+        }
+    
+    # }}}
+    
+    # {{{ _submit_remote_at
+    def _submit_remote_at(self, dest, command, param_val = None, timeout = None,
+                          priority = None):
+        """
+        Sends a remote AT command without waiting for the reply; returns an
+        XBeeRequest, whose result() waits for the remote_at_response frame.
+        """
+        
         return self.__send_xb_frame(
             dest,
-            {
-                'method' : 'send_remote_at',
-                'dest' : dest,
-                'command' : command,
-                'param_val' : param_val,
-            },
-            async,
-            timeout
+            self.__remote_at_body(dest, command, param_val),
+            False,
+            timeout,
+            priority
         )
     
     # }}}
     
-    # {{{ _send_data
-    def _send_data(self, dest, data):
-        frame = self.__send_xb_frame(
+    # {{{ _send_remote_at
+    def _send_remote_at(self, dest, command, param_val = None, async = False, timeout = None,
+                        priority = None):
+        # if async is true, retVal is the XBeeRequest instance, whose replies
+        # are passed to handle_async_reply; otherwise it's the reply frame
+        if async:
+            return self.__send_xb_frame(
+                dest,
+                self.__remote_at_body(dest, command, param_val),
+                True,
+                timeout,
+                priority
+            )
+        
+        return self.__wait_for(self._submit_remote_at(dest, command, param_val, timeout, priority))
+    
+    # }}}
+    
+    # {{{ _send_remote_at_many
+    def _send_remote_at_many(self, dest, commands, timeout = None, priority = None,
+                             window = 4):
+        """
+        Sends each (command, param_val) in commands to dest, with up to
+        window in flight at once, and returns the reply frames in order.
+        Commands may take effect in any order, so one that must follow the
+        others, like AC or WR, should be sent afterwards.  Raises NoResponse
+        if a command isn't answered.
+        """
+        
+        self.__assert_may_block()
+        
+        def submit(command):
+            return self._submit_remote_at(dest, command[0], command[1], timeout, priority)
+        
+        return pipeline.pipelined(submit, commands, window)
+    
+    # }}}
+    
+    # {{{ _submit_data
+    def _submit_data(self, dest, data, priority = None, coalesce = None):
+        """
+        Sends data without waiting for it to be delivered; returns an
+        XBeeRequest, whose result() waits for the zb_tx_status frame, or a
+        frame with id 'superseded'.  See _check_data_frame_status.
+        """
+        
+        return self.__send_xb_frame(
             dest,
             {
                 'method' : 'send_data',
                 'dest' : dest,
                 'data' : data,
-            }
+            },
+            priority = priority,
+            coalesce = coalesce
         )
-        
+    
+    # }}}
+    
+    # {{{ _send_data
+    def _send_data(self, dest, data, priority = None, coalesce = None):
+        return self._check_data_frame_status(
+            self.__wait_for(self._submit_data(dest, data, priority, coalesce))
+        )
+    
+    # }}}
+    
+    # {{{ _check_data_frame_status
+    def _check_data_frame_status(self, frame):
         success = False
         
-        # frame is guaranteed to have id == zb_tx_status
+        # frame is guaranteed to have id == zb_tx_status, unless a newer
+        # frame replaced this one before it was sent
         
-        if frame['delivery_status'] == '\x00':
+        if frame['id'] == 'superseded':
+            self._logger.debug("data superseded before it was sent")
+        
+        elif frame['delivery_status'] == '\x00':
             # success!
             success = True
             self._logger.debug("sent data with %d retries", ord(frame['retries']))
@@ -412,74 +634,107 @@ class BaseConsumer(object):
     
     # }}}
     
+    # {{{ __open_channels
+    def __open_channels(self):
+        """
+        opens the consuming channels, declaring and binding our queues; run
+        on the consuming thread, again each time it reconnects
+        """
+        
+        # channel for working with raw packets
+        self.__xb_frame_chan = self._connections.consumer_channel()
+        
+        self.__xb_frame_chan.add_on_return_callback(self.__on_returned_packet)
+        self.__xb_frame_chan.add_on_close_callback(self.__on_channel_close)
+        
+        # create new queue exclusively for us (channel is arbitrary)
+        self.__queue_name = self.__xb_frame_chan.queue_declare(exclusive = True).method.queue
+        
+        # configure callback for all packets
+        self.__xb_frame_chan.basic_consume(self.__on_receive_packet,
+                                           queue = self.__queue_name,
+                                           no_ack = True)
+        
+        # bind routing keys to queue
+        for addr in self._xbee_addresses:
+            self.__xb_frame_chan.queue_bind(exchange = 'raw_xbee_frames',
+                                            queue = self.__queue_name,
+                                            routing_key = '*.' + addr.lower())
+        
+        
+        if self.__rpc_queue_map:
+            # need a separate channel for RPC requests so that they can be ack'd
+            self._logger.debug("creating channel for RPC requests")
+            
+            self.__rpc_receive_chan = self._connections.consumer_channel()
+            
+            self.__rpc_receive_chan.basic_qos(prefetch_count=1)
+            
+            # declare all RPC queues configured via _register_rpc_function.
+            # do this on __rpc_receive_chan to direct all incoming messags to 
+            # __on_receive_rpc_request
+            for queue in self.__rpc_queue_map:
+                self._logger.debug("creating RPC queue %s", queue)
+                
+                self.__rpc_receive_chan.queue_declare(
+                    queue = queue,
+                    exclusive = True
+                )
+                
+                self.__rpc_receive_chan.basic_consume(
+                    self.__on_receive_rpc_request,
+                    queue = queue
+                )
+    
+    # }}}
+    
     # {{{ __run_thread
     def __run_thread(self):
         try:
             self.__main_thread_name = threading.currentThread().name
             
-            # connection/channel for working with raw packets
-            self.__xb_frame_conn = self._create_broker_connection()
-            self.__xb_frame_chan = self.__xb_frame_conn.channel()
-            
-            self.__xb_frame_chan.add_on_return_callback(self.__on_returned_packet)
-            self.__xb_frame_chan.add_on_close_callback(self.__on_channel_close)
-            
-            # channel for transmitting XBee frames
-            self.__rpc_conn = self._create_broker_connection()
-            self.__rpc_chan = self.__rpc_conn.channel()
-            self.__rpc_chan_lock = threading.RLock()
-            
-            
-            # channel and connection for publishing sensor data and events
-            self.__publisher_conn = self._create_broker_connection()
-            self.__publisher_chan = self.__xb_frame_conn.channel()
-            self.__publisher_chan_lock = threading.RLock()
-            
-            # create new queue exclusively for us (channel is arbitrary)
-            self.__queue_name = self.__xb_frame_chan.queue_declare(exclusive = True).method.queue
-            
-            # configure callback for all packets
-            self.__xb_frame_chan.basic_consume(self.__on_receive_packet,
-                                               queue = self.__queue_name,
-                                               no_ack = True)
-            
-            # bind routing keys to queue
-            for addr in self._xbee_addresses:
-                self.__xb_frame_chan.queue_bind(exchange = 'raw_xbee_frames',
-                                                queue = self.__queue_name,
-                                                routing_key = '*.' + addr.lower())
-            
-            
             if self.__rpc_queue_map:
-                self.__rpc_worker.start()
-                
-                # need a separate channel for RPC requests so that they can be ack'd
-                self._logger.debug("creating channel for RPC requests")
+                self.__rpc_worker = RPCWorker(self._connections, self.RPC_WORKERS)
                 
-                self.__rpc_receive_chan = self.__xb_frame_conn.channel()
+                for queue, limit in self.__rpc_limits.items():
+                    self.__rpc_worker.set_limit(queue, limit)
                 
-                self.__rpc_receive_chan.basic_qos(prefetch_count=1)
-                
-                # declare all RPC queues configured via _register_rpc_function.
-                # do this on __rpc_receive_chan to direct all incoming messags to 
-                # __on_receive_rpc_request
-                for queue in self.__rpc_queue_map:
-                    self._logger.debug("creating RPC queue %s", queue)
+                self.__rpc_worker.start()
+            
+            while not self.__shutdown_event.is_set():
+                try:
+                    self.__open_channels()
                     
-                    self.__rpc_receive_chan.queue_declare(
-                        queue = queue,
-                        exclusive = True
-                    )
+                    if not self.ready_event.is_set():
+                        # peak RSS is in kilobytes on Linux
+                        self._logger.info(
+                            "ready after %.2fs, max RSS %dKB; %r",
+                            time.time() - self.__start_time,
+                            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                            self._connections.stats()
+                        )
+                        
+                        self.ready_event.set()
+                    
+                    self.__xb_frame_chan.start_consuming()
+                    
+                    # stop_consuming was called
+                    break
+                    
+                except broker_connections.CONNECTION_ERRORS:
+                    if self.__shutdown_event.is_set():
+                        break
                     
-                    self.__rpc_receive_chan.basic_consume(
-                        self.__on_receive_rpc_request,
-                        queue = queue
+                    # requests awaiting replies on the old queue will expire
+                    self._logger.error(
+                        "lost consuming connection: %s; reconnecting in %ds",
+                        sys.exc_info()[1], self.RECONNECT_INTERVAL
                     )
+                    
+                    self._connections.drop_consumer_connection()
+                    self.__shutdown_event.wait(self.RECONNECT_INTERVAL)
+                
             
-            
-            self.ready_event.set()
-            
-            self.__xb_frame_chan.start_consuming()
         except:
             self._logger.critical("unhandled exception in __run_thread", exc_info = True)
             # thread will exit
@@ -491,21 +746,18 @@ class BaseConsumer(object):
     def process_forever(self):
         self._logger.info("starting up")
         
+        self.__start_time = time.time()
         self.__shutdown_event = threading.Event()
         
+        self.__get_publisher().start()
+        
+        self._startup()
+        
         proc_4evr = threading.Thread(target = self.__run_thread, name = "proc_4evr")
         # t.daemon = True
         proc_4evr.start()
         
-        def reaper():
-            while True:
-                self.__reap_unfinished_requests()
-                time.sleep(2)
-            
-        
-        reaper_thread = threading.Thread(target = reaper, name = "reaper")
-        reaper_thread.daemon = True
-        reaper_thread.start()
+        self.__get_request_expiry().start()
         
         while True:
             if not proc_4evr.is_alive():
@@ -523,20 +775,48 @@ class BaseConsumer(object):
                 
             
         
-        with self.__publisher_chan_lock:
-            # shut down the RPC worker first, so we don't get hung if any of
-            # the following fails
-            if self.__rpc_worker.is_alive():
-                self.__rpc_worker.shutdown()
-                self.__rpc_worker.join()
-            
+        # shut down the RPC worker first, so we don't get hung if any of
+        # the following fails
+        if (self.__rpc_worker is not None) and self.__rpc_worker.is_alive():
+            self.__rpc_worker.shutdown()
+            self.__rpc_worker.join()
+        
+        self.__get_request_expiry().stop()
+        
+        self.__shutdown_event.set()
+        
+        if self.__xb_frame_chan is not None:
             self.__xb_frame_chan.stop_consuming()
-            self.__xb_frame_conn.close()
-            
-            self.__rpc_conn.close()
-            self.__publisher_conn.close()
-            
-            
+        
+        self._teardown()
+        
+        # publish what's queued before the connections go
+        self.__publisher.stop(self.PUBLISH_FLUSH_TIMEOUT)
+        
+        self._logger.info("publisher: %r", self.__publisher.stats())
+        
+        self._connections.close()
+        
+        self._logger.info("broker connections: %r", self._connections.stats())
+    
+    # }}}
+    
+    # {{{ _startup
+    def _startup(self):
+        """
+        called by process_forever before consuming starts; subclasses may
+        start threads of their own here
+        """
+        
+        pass
+    
+    # }}}
+    
+    # {{{ _teardown
+    def _teardown(self):
+        """called by process_forever once consuming has stopped"""
+        
+        pass
     
     # }}}
     
@@ -565,6 +845,11 @@ class BaseConsumer(object):
         # hand off the RPC request to the RPCWorker
         req_body = serializer_utils.deserialize(body, props.content_type)
         
+        # the caller's deadline, in milliseconds since the epoch
+        deadline = None
+        if props.headers and ('deadline' in props.headers):
+            deadline = monotonic() + (props.headers['deadline'] / 1000.0 - time.time())
+        
         callback = None
         if req_body['command'] in self.__rpc_queue_map[method.routing_key]:
             callback = self.__rpc_queue_map[method.routing_key][req_body['command']]
@@ -575,7 +860,9 @@ class BaseConsumer(object):
                     content_type = props.content_type,
                     reply_to = props.reply_to,
                     callback = callback,
-                    args = req_body['args']
+                    args = req_body['args'],
+                    queue = method.routing_key,
+                    deadline = deadline
                 )
             )
         else:
@@ -590,6 +877,8 @@ class BaseConsumer(object):
         self._logger.debug("received packet from exchange '%s' with routing key %s and correlation_id %s",
                            method.exchange, method.routing_key, props.correlation_id)
 
+        # frames sent by the gateway as application/x-xbee-frame are lazy
+        # FrameRecords, which only decode the fields that are read
         frame = serializer_utils.deserialize(body, props.content_type)
         
         # the following frames are handled here:
@@ -608,22 +897,22 @@ class BaseConsumer(object):
                 if props.correlation_id in self.__pending_xb_requests:
                     req = self.__pending_xb_requests[props.correlation_id]
                     
-                    if not req.async:
-                        self.finish_async_request(req, frame)
-                    else:
-                        self.handle_async_reply(req, frame)
+                    try:
+                        if not req.async:
+                            req.owner.finish_async_request(req, frame)
+                        else:
+                            req.owner.handle_async_reply(req, frame)
+                    except:
+                        self._logger.critical("exception handling reply", exc_info = True)
                     
                 else:
                     self._logger.error("got %s reply for unknown correlation %s: %s",
                                        frame['id'], props.correlation_id, frame)
             
-            # this needs to get called every now and then
-            self.__reap_unfinished_requests()
-            
         else:
             # standard raw packet; guaranteed  to have a routing_key of the form
             # <frame id>.<address>, where the address is one we're subscribed to
-            formatted_addr = method.routing_key.split('.')[1]
+            formatted_addr = xbee_addr.routing_key_addr(method.routing_key)
             
             try:
                 self.handle_packet(formatted_addr, frame)
@@ -648,17 +937,64 @@ class BaseConsumer(object):
         req.event.set()
         
         del self.__pending_xb_requests[req.ticket]
+        self.__get_request_expiry().cancel(req.ticket)
+    
+    # }}}
+    
+    # {{{ __get_request_expiry
+    def __get_request_expiry(self):
+        """
+        returns the timer expiring our transport's pending requests,
+        creating it when first needed
+        """
+        
+        transport = self.__transport
+        
+        if transport.__xb_request_expiry is None:
+            with transport.__lazy_lock:
+                if transport.__xb_request_expiry is None:
+                    transport.__xb_request_expiry = DeadlineTimer(
+                        transport.__expire_xb_request,
+                        name = "reaper"
+                    )
+        
+        return transport.__xb_request_expiry
     
     # }}}
     
-    # {{{ __reap_unfinished_requests
-    def __reap_unfinished_requests(self):
+    # {{{ __get_publisher
+    def __get_publisher(self):
+        """
+        returns our transport's publisher, creating it when first needed;
+        messages submitted before process_forever wait for it to start
+        """
+        
+        transport = self.__transport
+        
+        if transport.__publisher is None:
+            with transport.__lazy_lock:
+                if transport.__publisher is None:
+                    transport.__publisher = ConfirmPublisher(
+                        transport._connections.connect,
+                        max_pending = transport.PUBLISH_QUEUE_SIZE,
+                        name = "publisher"
+                    )
+        
+        return transport.__publisher
+    
+    # }}}
+    
+    # {{{ __expire_xb_request
+    def __expire_xb_request(self, ticket):
+        """called by __xb_request_expiry when a request's deadline passes"""
+        
         with self.__pending_xb_requests_lock:
-            for req in self.__pending_xb_requests.values():
-                if req.is_expired():
-                    self._logger.debug("expiring %r", req)
-                    
-                    self.finish_async_request(req)
+            req = self.__pending_xb_requests.get(ticket)
+            
+            if (req is not None) and req.is_expired():
+                self._logger.debug("expiring %r", req)
+                
+                req.owner.finish_async_request(req)
     
     # }}}
     
@@ -669,37 +1005,46 @@ class BaseConsumer(object):
     
     # }}}
     
+    # {{{ __publish
+    def __publish(self, exchange, routing_key, body):
+        """queues body for the publisher thread, returning straight away"""
+        
+        publisher = self.__get_publisher()
+        
+        queued = publisher.submit((
+            exchange,
+            routing_key,
+            pika.BasicProperties(
+                content_type = serializer_utils.CONTENT_TYPE_JSON
+            ),
+            serializer_utils.serialize(body, serializer_utils.CONTENT_TYPE_JSON)
+        ))
+        
+        # every hundredth message dropped, rather than every one
+        if (not queued) and (publisher.overflowed % 100 == 1):
+            self._logger.warn(
+                "publisher queue full; %d messages dropped so far",
+                publisher.overflowed
+            )
+    
+    # }}}
+    
     # {{{ publish_sensor_data
     def publish_sensor_data(self, routing_key, body):
-        with self.__publisher_chan_lock:
-            self.__publisher_chan.basic_publish(
-                exchange = 'sensor_data',
-                routing_key = routing_key,
-                properties = pika.BasicProperties(
-                    content_type = serializer_utils.CONTENT_TYPE_JSON
-                ),
-                body = serializer_utils.serialize(body, serializer_utils.CONTENT_TYPE_JSON)
-            )
+        self.__publish('sensor_data', routing_key, body)
     
     # }}}
     
     # {{{ publish_event
     def publish_event(self, routing_key, event, **kwargs):
-        with self.__publisher_chan_lock:
-            self.__publisher_chan.basic_publish(
-                exchange = 'events',
-                routing_key = routing_key,
-                properties = pika.BasicProperties(
-                    content_type = serializer_utils.CONTENT_TYPE_JSON
-                ),
-                body = serializer_utils.serialize(
-                    {
-                        'name' : event,
-                        'data' : kwargs,
-                    },
-                    serializer_utils.CONTENT_TYPE_JSON
-                )
-            )
+        self.__publish(
+            'events',
+            routing_key,
+            {
+                'name' : event,
+                'data' : kwargs,
+            }
+        )
     
     # }}}
     
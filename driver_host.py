@@ -0,0 +1,169 @@
+#!/usr/bin/env python2.6
+# encoding: utf-8
+"""
+driver_host.py
+
+Runs several device drivers, which are BaseConsumer subclasses, in one
+process.
+
+Each driver can still be run as a daemon of its own, but each of those
+is an interpreter with its own threads and broker connections, handling a
+few frames a second. A DriverHost consumes frames for all of its drivers'
+addresses from one queue, and hands each one to the drivers of its
+address, found with a dict lookup. An exception in one driver is logged
+and counted against it and doesn't affect the others. Drivers send
+frames, publish data and serve RPC requests as they would on their own,
+over the host's connections.
+
+usage: driver_host.py [<driver> ...]
+
+where <driver> is a name from DRIVERS; all of them by default.
+"""
+
+import sys, os
+import collections
+
+import consumer
+
+# (name, (module, class, constructor arguments)), as each module's main()
+# creates them
+DRIVERS = (
+    ('environmental_node', ('environmental_node_consumer', 'EnvironmentalNodeConsumer',
+                            (('00:11:22:33:44:55:66:dc', '00:11:22:33:44:55:66:22'),))),
+    ('furnace', ('furnace_consumer', 'FurnaceConsumer', ('00:11:22:33:44:55:66:4d',))),
+    ('power', ('power_consumer', 'PowerConsumer', ('00:11:22:33:44:55:66:0a',))),
+    ('xbee_lt', ('xbee_lt_sensor', 'LightTempConsumerRabbit',
+                 (('00:11:22:33:44:55:66:a5', '00:11:22:33:44:55:66:7d'),))),
+    ('oil_tank', ('fuel_oil_tank_consumer', 'FuelOilTankConsumer', (['00:11:22:33:44:55:66:cf'],))),
+    ('sprinkler', ('sprinkler_driver', 'SprinklerConsumer', ('00:11:22:33:44:55:66:1d',))),
+    ('voltometer', ('voltometer_driver', 'VoltometerDriver', ('00:11:22:33:44:55:66:e2',))),
+)
+
+class DriverHost(consumer.BaseConsumer):
+    # {{{ __init__
+    def __init__(self, drivers):
+        # address -> drivers receiving its frames
+        routes = collections.defaultdict(list)
+        
+        for driver in drivers:
+            if '#' in driver._xbee_addresses:
+                raise ValueError("%s receives every address, so can't be hosted" %
+                                 driver.__class__.__name__)
+            
+            for addr in driver._xbee_addresses:
+                routes[addr.lower()].append(driver)
+        
+        super(DriverHost, self).__init__(routes.keys())
+        
+        self.drivers = list(drivers)
+        
+        self.__routes = dict((addr, tuple(d)) for addr, d in routes.items())
+        
+        # exceptions raised by each driver
+        self.errors = collections.defaultdict(int)
+        
+        for driver in self.drivers:
+            driver._attach_to(self)
+    
+    # }}}
+    
+    # {{{ handle_packet
+    def handle_packet(self, formatted_addr, packet):
+        for driver in self.__routes.get(formatted_addr, ()):
+            try:
+                driver.handle_packet(formatted_addr, packet)
+            except:
+                self.errors[driver.__class__.__name__] += 1
+                
+                self._logger.critical(
+                    "exception in %s handling packet from %s",
+                    driver.__class__.__name__, formatted_addr, exc_info = True
+                )
+    
+    # }}}
+    
+    # {{{ __each_driver
+    def __each_driver(self, method):
+        for driver in self.drivers:
+            try:
+                getattr(driver, method)()
+            except:
+                self.errors[driver.__class__.__name__] += 1
+                
+                self._logger.critical(
+                    "exception in %s.%s", driver.__class__.__name__, method,
+                    exc_info = True
+                )
+    
+    # }}}
+    
+    # {{{ _startup
+    def _startup(self):
+        self.__each_driver('_startup')
+    
+    # }}}
+    
+    # {{{ _teardown
+    def _teardown(self):
+        self.__each_driver('_teardown')
+        
+        self._logger.info("driver errors: %r", dict(self.errors))
+    
+    # }}}
+
+
+
+# {{{ create_drivers
+def create_drivers(names):
+    """instantiates the named DRIVERS"""
+    
+    specs = dict(DRIVERS)
+    drivers = []
+    
+    for name in names:
+        module, cls, args = specs[name]
+        
+        drivers.append(getattr(__import__(module), cls)(*args))
+    
+    return drivers
+
+# }}}
+
+
+def main():
+    from support import daemonizer, log_config
+    import signal
+    import logging
+    
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    
+    known = [name for name, spec in DRIVERS]
+    names = sys.argv[1:] or known
+    
+    for name in names:
+        if name not in known:
+            sys.exit("unknown driver %s; choose from %s" % (name, ", ".join(known)))
+    
+    daemonizer.createDaemon()
+    log_config.init_logging(basedir + "/logs/driver_host.log")
+    
+    # log_config.init_logging_stdout()
+    
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    
+    host = DriverHost(create_drivers(names))
+    
+    try:
+        host.process_forever()
+    except KeyboardInterrupt:
+        pass
+    except:
+        logging.error("unhandled exception", exc_info=True)
+    finally:
+        host.shutdown()
+        log_config.shutdown()
+
+
+
+if __name__ == '__main__':
+    main()
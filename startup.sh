@@ -5,10 +5,6 @@ cd $(dirname $0)
 ./xbee_network_monitor.py
 ./xmlrpc_server.py
 ./db_logging_receiver.py
-./environmental_node_consumer.py
-./furnace_consumer.py
-./power_consumer.py
-./xbee_lt_sensor.py
-./fuel_oil_tank_consumer.py
-./sprinkler_driver.py
-./voltometer_driver.py
+
+# the device drivers, in one process; each can also be run on its own
+./driver_host.py
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+batch_publisher.py
+
+Decouples producers of broker messages from the broker connection.
+
+Producers, such as the XBee reader thread in the gateway, hand messages
+to submit(), which never blocks; a BatchPublisher thread takes them from
+a bounded queue in batches and passes each to a publish function. A
+slow or reconnecting broker therefore only fills the queue, and once it
+is full further messages are discarded and counted rather than stalling
+the producer.
+"""
+
+import time
+import threading
+import Queue
+import logging
+
+class BatchPublisher(threading.Thread):
+    """
+    Publishes queued messages in batches on a dedicated thread
+
+    A batch is published once batch_size messages are waiting, or
+    flush_interval seconds after its first message was queued. publish
+    is called for each message in turn; messages for which it raises
+    are counted in dropped, and messages which did not fit in the queue
+    are counted in overflowed.  If given, idle is called from the same
+    thread whenever no message has been queued for a quarter second.
+    """
+
+    # {{{ __init__
+    def __init__(self, publish, max_pending = 1000, batch_size = 50,
+                 flush_interval = 0.05, name = "publisher", idle = None):
+        super(BatchPublisher, self).__init__(name = name)
+
+        self.daemon = True
+
+        self._logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+        self.__publish = publish
+        self.__idle = idle
+        self.__queue = Queue.Queue(max_pending)
+
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+
+        self.__stop_event = threading.Event()
+
+        # counters; submitted and overflowed are updated by every thread
+        # calling submit(), under __count_lock, and the rest only by the
+        # publisher thread
+        self.__count_lock = threading.Lock()
+        self.submitted = 0
+        self.overflowed = 0
+        self.published = 0
+        self.dropped = 0
+        self.batches = 0
+
+    # }}}
+
+    # {{{ submit
+    def submit(self, msg):
+        """
+        Queues msg for publishing without blocking.  Returns False if the
+        queue was full and msg was discarded.
+        """
+
+        try:
+            self.__queue.put_nowait(msg)
+        except Queue.Full:
+            with self.__count_lock:
+                self.overflowed += 1
+
+            return False
+
+        with self.__count_lock:
+            self.submitted += 1
+
+        return True
+
+    # }}}
+
+    # {{{ pending
+    def pending(self):
+        """returns the number of messages waiting to be published"""
+
+        return self.__queue.qsize()
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        """returns a dict of the counters and the current queue depth"""
+
+        return {
+            'submitted' : self.submitted,
+            'overflowed' : self.overflowed,
+            'published' : self.published,
+            'dropped' : self.dropped,
+            'batches' : self.batches,
+            'pending' : self.pending(),
+        }
+
+    # }}}
+
+    # {{{ stop
+    def stop(self, timeout = None):
+        """
+        Publishes any messages still queued and stops the thread, waiting
+        up to timeout seconds for it to finish.
+        """
+
+        self.__stop_event.set()
+
+        if self.is_alive():
+            self.join(timeout)
+
+    # }}}
+
+    # {{{ __next_batch
+    def __next_batch(self):
+        get = self.__queue.get
+
+        try:
+            # wait for the first message of the batch; the timeout bounds
+            # how long it takes to notice stop()
+            batch = [get(True, 0.25)]
+        except Queue.Empty:
+            return []
+
+        deadline = time.time() + self.__flush_interval
+
+        while len(batch) < self.__batch_size:
+            remaining = deadline - time.time()
+
+            try:
+                if remaining <= 0 or self.__stop_event.is_set():
+                    # take only what's already waiting
+                    batch.append(get(False))
+                else:
+                    batch.append(get(True, remaining))
+            except Queue.Empty:
+                break
+
+        return batch
+
+    # }}}
+
+    # {{{ _publish_batch
+    def _publish_batch(self, batch):
+        """publishes each message of batch; subclasses may publish a batch at once"""
+
+        for msg in batch:
+            try:
+                self.__publish(msg)
+                self.published += 1
+            except:
+                self.dropped += 1
+                self._logger.error("unable to publish message", exc_info = True)
+
+    # }}}
+
+    # {{{ run
+    def run(self):
+        while True:
+            batch = self.__next_batch()
+
+            if not batch:
+                if self.__stop_event.is_set():
+                    break
+
+                if self.__idle is not None:
+                    try:
+                        self.__idle()
+                    except:
+                        self._logger.error("exception in idle callback", exc_info = True)
+
+                continue
+
+            self._publish_batch(batch)
+            self.batches += 1
+
+        self._logger.debug("stopped: %r", self.stats())
+
+    # }}}
+
+
+if __name__ == '__main__':
+    # how long submit() takes while a slow publisher falls behind; see
+    # support/tests/test_batch_publisher.py for the tests
+    def slow_publish(msg):
+        time.sleep(0.001)
+
+    pub = BatchPublisher(slow_publish, max_pending = 100, batch_size = 10)
+    pub.start()
+
+    start = time.time()
+
+    for i in range(1000):
+        pub.submit(i)
+
+    print "submitted 1000 messages in %.2f ms" % ((time.time() - start) * 1000)
+
+    pub.stop()
+
+    print pub.stats()
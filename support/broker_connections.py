@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+broker_connections.py
+
+Shares broker connections between the parts of a process.
+
+A BlockingConnection may only be used by one thread at a time, and is
+blocked for good by a thread consuming from it, so each consumer used to
+open a connection for consuming, another for transmitting XBee frames,
+another for publishing and another for its RPC worker; four TCP
+connections and AMQP handshakes per daemon. A ConnectionManager opens
+one connection for each thread that consumes, and one shared by every
+thread that publishes, usually two per process. Publishing channels
+serialize their use of the shared connection, and reconnect and retry
+once if it has been lost. get_manager() returns the process's manager
+for a broker.
+"""
+
+import sys
+import time
+import socket
+import threading
+import logging
+
+import pika
+
+# errors after which a connection is considered lost
+CONNECTION_ERRORS = (pika.exceptions.AMQPError, socket.error)
+
+class PublishingChannel(object):
+    """
+    A channel on the manager's shared publishing connection
+
+    Only publishing is supported.  Each call holds the connection's lock,
+    so a PublishingChannel may be used from any thread.  If the connection
+    has been replaced since the channel was last used, the channel is
+    opened again on the new one, with its return callbacks.
+    """
+
+    # {{{ __init__
+    def __init__(self, manager):
+        super(PublishingChannel, self).__init__()
+
+        self.__manager = manager
+
+        # the underlying channel, and the connection generation it's on
+        self._chan = None
+        self._generation = None
+
+        self._return_callbacks = []
+
+    # }}}
+
+    # {{{ add_on_return_callback
+    def add_on_return_callback(self, callback):
+        """callback is called for messages returned by the broker"""
+
+        self._return_callbacks.append(callback)
+
+        if self._chan is not None:
+            self._chan.add_on_return_callback(callback)
+
+    # }}}
+
+    # {{{ basic_publish
+    def basic_publish(self, **kwargs):
+        """publishes a message; takes the keyword arguments of Channel.basic_publish"""
+
+        return self.__manager._publish(self, kwargs)
+
+    # }}}
+
+
+class ConnectionManager(object):
+    """
+    Hands out channels over as few broker connections as possible
+
+    consumer_channel() returns a channel on a connection belonging to the
+    calling thread, opened the first time that thread asks; only that
+    thread may use it.  publishing_channel() returns a PublishingChannel
+    on the shared publishing connection, which is opened when first
+    needed and again after it's lost, no more often than every
+    RECONNECT_INTERVAL seconds.
+    """
+
+    # seconds between attempts to reopen the publishing connection
+    RECONNECT_INTERVAL = 5
+
+    # {{{ __init__
+    def __init__(self, conn_params, connect = pika.BlockingConnection):
+        super(ConnectionManager, self).__init__()
+
+        self._logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+        self.__connection_params = conn_params
+        self.__connect = connect
+
+        # thread -> its consuming connection
+        self.__consumer_conns = {}
+        self.__consumer_conns_lock = threading.Lock()
+
+        # guards the publishing connection and every channel on it
+        self.__publishing_lock = threading.RLock()
+        self.__publishing_conn = None
+
+        # bumped each time the publishing connection is replaced, so that
+        # channels know to reopen
+        self.__generation = 0
+        self.__next_reconnect = 0
+
+        # counters
+        self.opened = 0
+        self.reconnects = 0
+        self.connect_time = 0.0
+
+    # }}}
+
+    # {{{ connect
+    def connect(self):
+        """
+        opens and returns a new connection, counted but not shared; for
+        callers that manage a connection themselves
+        """
+
+        start = time.time()
+
+        conn = self.__connect(self.__connection_params)
+
+        self.connect_time += time.time() - start
+        self.opened += 1
+
+        return conn
+
+    # }}}
+
+    # {{{ consumer_channel
+    def consumer_channel(self):
+        """returns a new channel on the calling thread's consuming connection"""
+
+        thread = threading.currentThread()
+
+        with self.__consumer_conns_lock:
+            conn = self.__consumer_conns.get(thread)
+
+        if conn is None:
+            # only this thread adds its own entry, so there's no race here
+            conn = self.connect()
+
+            with self.__consumer_conns_lock:
+                self.__consumer_conns[thread] = conn
+
+        return conn.channel()
+
+    # }}}
+
+    # {{{ drop_consumer_connection
+    def drop_consumer_connection(self, thread = None):
+        """
+        closes the consuming connection of thread, by default the calling
+        thread; the next consumer_channel() call from it opens another
+        """
+
+        if thread is None:
+            thread = threading.currentThread()
+
+        with self.__consumer_conns_lock:
+            conn = self.__consumer_conns.pop(thread, None)
+
+        if conn is not None:
+            self.__close(conn)
+
+    # }}}
+
+    # {{{ publishing_channel
+    def publishing_channel(self):
+        """returns a new PublishingChannel; the connection is opened when first used"""
+
+        return PublishingChannel(self)
+
+    # }}}
+
+    # {{{ _publish
+    def _publish(self, channel, kwargs):
+        """publishes on behalf of channel, reconnecting and retrying once if necessary"""
+
+        with self.__publishing_lock:
+            # raises if the connection is down and can't be reopened yet
+            chan = self.__open_channel(channel)
+
+            try:
+                return chan.basic_publish(**kwargs)
+            except CONNECTION_ERRORS:
+                self._logger.warn("lost publishing connection: %s", sys.exc_info()[1])
+
+                self.__drop_publishing_connection()
+
+            return self.__open_channel(channel).basic_publish(**kwargs)
+
+    # }}}
+
+    # {{{ __open_channel
+    def __open_channel(self, channel):
+        """returns channel's underlying channel; called with the lock held"""
+
+        if self.__publishing_conn is None:
+            if time.time() < self.__next_reconnect:
+                raise pika.exceptions.AMQPConnectionError("publishing connection is down")
+
+            self.__next_reconnect = time.time() + self.RECONNECT_INTERVAL
+
+            self.__publishing_conn = self.connect()
+            self.__generation += 1
+
+            if self.__generation > 1:
+                self.reconnects += 1
+                self._logger.info("reopened publishing connection")
+
+        if channel._generation != self.__generation:
+            chan = self.__publishing_conn.channel()
+
+            for callback in channel._return_callbacks:
+                chan.add_on_return_callback(callback)
+
+            channel._chan = chan
+            channel._generation = self.__generation
+
+        return channel._chan
+
+    # }}}
+
+    # {{{ __drop_publishing_connection
+    def __drop_publishing_connection(self):
+        conn = self.__publishing_conn
+        self.__publishing_conn = None
+
+        # reconnect straight away the first time
+        self.__next_reconnect = 0
+
+        if conn is not None:
+            self.__close(conn)
+
+    # }}}
+
+    # {{{ __close
+    def __close(self, conn):
+        try:
+            conn.close()
+        except:
+            self._logger.debug("error closing connection: %s", sys.exc_info()[1])
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        """returns counts of open connections, connections opened, and time spent opening them"""
+
+        with self.__consumer_conns_lock:
+            consuming = len(self.__consumer_conns)
+
+        return {
+            'consuming' : consuming,
+            'publishing' : int(self.__publishing_conn is not None),
+            'opened' : self.opened,
+            'reconnects' : self.reconnects,
+            'connect_time' : self.connect_time,
+        }
+
+    # }}}
+
+    # {{{ close
+    def close(self):
+        """closes every connection; channels handed out reconnect if used again"""
+
+        with self.__consumer_conns_lock:
+            conns = self.__consumer_conns.values()
+            self.__consumer_conns.clear()
+
+        for conn in conns:
+            self.__close(conn)
+
+        with self.__publishing_lock:
+            self.__drop_publishing_connection()
+
+    # }}}
+
+
+# {{{ get_manager
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_manager(conn_params):
+    """returns the process's ConnectionManager for the broker in conn_params"""
+
+    key = (conn_params.host, conn_params.port, conn_params.virtual_host)
+
+    with _managers_lock:
+        manager = _managers.get(key)
+
+        if manager is None:
+            manager = _managers[key] = ConnectionManager(conn_params)
+
+    return manager
+
+# }}}
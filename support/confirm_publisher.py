@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+confirm_publisher.py
+
+Publishes messages in batches and has the broker confirm each one.
+
+A plain basic_publish returns as soon as the message is written to the
+socket, so a message the broker fails to route or store, or one still in
+flight when the connection drops, is lost without a trace. A
+ConfirmPublisher is a BatchPublisher whose thread puts a channel of its
+own in confirm mode, publishes a batch, and waits for the broker to ack
+or nack every message in it. Nacked and unconfirmed messages are
+published again, a few times, before being given up on; every message
+dropped, on the way in or after its retries, is counted and logged.
+Retries wait their turn alongside new batches, so a broker refusing
+messages doesn't stop the queue being drained.
+
+This relies on the blocking adapter of pika 0.9.5 to 0.9.8, whose
+confirm_delivery() takes a callback that process_data_events() calls with
+each Basic.Ack and Basic.Nack; later versions confirm within basic_publish
+instead.
+"""
+
+import sys
+import time
+
+from support.batch_publisher import BatchPublisher
+
+class ConfirmPublisher(BatchPublisher):
+    """
+    Publishes queued messages in batches with publisher confirms
+
+    Messages are (exchange, routing_key, properties, body) tuples.  connect
+    is called on the publisher's thread to open the connection it uses,
+    which no other thread may touch; it is opened when first needed, and
+    again after an error.  A batch is published and then confirmed within
+    confirm_timeout seconds; the messages of it that are nacked, not
+    confirmed in time, or not published before an error are retried after
+    RETRY_INTERVAL seconds times the attempts so far, and dropped once
+    max_attempts have failed.  Retries are published between batches, or
+    while the queue is idle, so may be overtaken by newer messages; those
+    still waiting at stop() are retried without waiting.  A message
+    retried after a timeout or an error may reach the broker twice.
+    """
+
+    # seconds to wait before retrying, multiplied by the attempts so far
+    RETRY_INTERVAL = 1.0
+
+    # {{{ __init__
+    def __init__(self, connect, max_pending = 1000, batch_size = 50,
+                 flush_interval = 0.05, name = "confirm_publisher",
+                 confirm_timeout = 5.0, max_attempts = 3):
+        super(ConfirmPublisher, self).__init__(
+            None, max_pending, batch_size, flush_interval, name,
+            idle = self.__publish_retries
+        )
+
+        self.__connect = connect
+        self.__confirm_timeout = confirm_timeout
+        self.__max_attempts = max_attempts
+
+        self.__conn = None
+        self.__chan = None
+        self.__connected = False
+
+        # delivery tag of the last message published on the channel
+        self.__tag = 0
+
+        # tags of the current batch not yet confirmed, and those nacked
+        self.__unconfirmed = set()
+        self.__nacked = set()
+
+        # (time due, attempt, messages) of failed messages to publish again
+        self.__retries = []
+
+        # counters, as BatchPublisher's
+        self.nacked = 0
+        self.timed_out = 0
+        self.retried = 0
+        self.reconnects = 0
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        stats = super(ConfirmPublisher, self).stats()
+
+        stats.update({
+            'nacked' : self.nacked,
+            'timed_out' : self.timed_out,
+            'retried' : self.retried,
+            'reconnects' : self.reconnects,
+            'retrying' : sum(len(r[2]) for r in self.__retries),
+        })
+
+        return stats
+
+    # }}}
+
+    # {{{ __open
+    def __open(self):
+        if self.__conn is None:
+            self.__conn = self.__connect()
+
+            if self.__connected:
+                self.reconnects += 1
+
+            self.__connected = True
+
+        self.__chan = self.__conn.channel()
+        self.__chan.confirm_delivery(self.__on_confirm)
+
+        # delivery tags start again from 1 on each channel
+        self.__tag = 0
+
+    # }}}
+
+    # {{{ __close
+    def __close(self):
+        conn = self.__conn
+
+        self.__conn = None
+        self.__chan = None
+
+        if conn is not None:
+            try:
+                conn.close()
+            except:
+                self._logger.debug("error closing connection: %s", sys.exc_info()[1])
+
+    # }}}
+
+    # {{{ __on_confirm
+    def __on_confirm(self, frame):
+        """called for Basic.Ack and Basic.Nack from the broker"""
+
+        method = frame.method
+
+        if method.multiple:
+            tags = [t for t in self.__unconfirmed if t <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        self.__unconfirmed.difference_update(tags)
+
+        if method.NAME == 'Basic.Nack':
+            self.__nacked.update(tags)
+
+    # }}}
+
+    # {{{ __publish_confirmed
+    def __publish_confirmed(self, batch):
+        """
+        publishes batch and waits for it to be confirmed; returns the
+        messages that were nacked or not confirmed, in order, followed by
+        any not published because of an error
+        """
+
+        messages = {}
+        self.__unconfirmed = set()
+        self.__nacked = set()
+
+        try:
+            if self.__chan is None:
+                self.__open()
+
+            for msg in batch:
+                exchange, routing_key, properties, body = msg
+
+                self.__chan.basic_publish(
+                    exchange = exchange,
+                    routing_key = routing_key,
+                    properties = properties,
+                    body = body
+                )
+
+                self.__tag += 1
+                messages[self.__tag] = msg
+                self.__unconfirmed.add(self.__tag)
+
+            deadline = time.time() + self.__confirm_timeout
+
+            while self.__unconfirmed and time.time() < deadline:
+                self.__conn.process_data_events()
+        except:
+            self._logger.warn(
+                "unable to publish %d of %d messages: %s",
+                len(batch) - len(messages), len(batch), sys.exc_info()[1]
+            )
+
+            self.__close()
+            unpublished = batch[len(messages):]
+        else:
+            unpublished = []
+
+            if self.__unconfirmed:
+                self.timed_out += len(self.__unconfirmed)
+
+                self._logger.warn(
+                    "%d of %d messages not confirmed within %.1fs",
+                    len(self.__unconfirmed), len(batch), self.__confirm_timeout
+                )
+
+                # confirms for them could still arrive, and be taken for
+                # another batch's
+                self.__close()
+
+        failed = self.__nacked | self.__unconfirmed
+
+        self.published += len(messages) - len(failed)
+        self.nacked += len(self.__nacked)
+
+        return [messages[tag] for tag in sorted(failed)] + unpublished
+
+    # }}}
+
+    # {{{ __retry_later
+    def __retry_later(self, failed, attempt):
+        """schedules failed, which has been tried attempt times, to be retried"""
+
+        if not failed:
+            return
+
+        if attempt >= self.__max_attempts:
+            self.dropped += len(failed)
+
+            self._logger.error(
+                "dropped %d messages after %d attempts; %d dropped so far",
+                len(failed), attempt, self.dropped
+            )
+
+            return
+
+        self.retried += len(failed)
+        self.__retries.append((time.time() + self.RETRY_INTERVAL * attempt, attempt + 1, failed))
+
+    # }}}
+
+    # {{{ __publish_retries
+    def __publish_retries(self, flush = False):
+        """publishes the failed messages whose retry is due, or all of them if flush"""
+
+        now = time.time()
+        retries, self.__retries = self.__retries, []
+
+        for due, attempt, messages in retries:
+            if flush or (due <= now):
+                self.__retry_later(self.__publish_confirmed(messages), attempt)
+            else:
+                self.__retries.append((due, attempt, messages))
+
+    # }}}
+
+    # {{{ _publish_batch
+    def _publish_batch(self, batch):
+        self.__retry_later(self.__publish_confirmed(batch), 1)
+        self.__publish_retries()
+
+    # }}}
+
+    # {{{ run
+    def run(self):
+        try:
+            super(ConfirmPublisher, self).run()
+
+            while self.__retries:
+                self.__publish_retries(flush = True)
+        finally:
+            self.__close()
+
+    # }}}
+
+
+
+if __name__ == '__main__':
+    # how long submit() takes, and how fast messages are confirmed, with a
+    # stand-in broker acking each batch at once; see
+    # support/tests/test_confirm_publisher.py for the tests
+    class StandInMethod(object):
+        NAME = 'Basic.Ack'
+        multiple = True
+
+        def __init__(self, delivery_tag):
+            self.delivery_tag = delivery_tag
+
+    class StandInFrame(object):
+        def __init__(self, method):
+            self.method = method
+
+    class StandInConnection(object):
+        def __init__(self):
+            self.tag = 0
+
+        def channel(self):
+            return self
+
+        def confirm_delivery(self, callback):
+            self.callback = callback
+
+        def basic_publish(self, exchange, routing_key, properties, body):
+            self.tag += 1
+
+        def process_data_events(self):
+            self.callback(StandInFrame(StandInMethod(self.tag)))
+
+        def close(self):
+            pass
+
+    pub = ConfirmPublisher(StandInConnection, max_pending = 5000)
+    pub.start()
+
+    start = time.time()
+
+    for i in range(5000):
+        pub.submit(('sensor_data', 'temperature', None, 'reading %d' % i))
+
+    elapsed = time.time() - start
+
+    print "submitted 5000 in %.2f ms (%.1f us each)" % (elapsed * 1000, elapsed / 5000 * 1e6)
+
+    while pub.published < 5000:
+        time.sleep(0.001)
+
+    print "confirmed in %.2f ms: %r" % ((time.time() - start) * 1000, pub.stats())
+
+    pub.stop()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+coordinators.py
+
+XBee coordinator radios, and routing of requests between them.
+
+A Coordinator owns one radio: its reader thread, its frame ids, the
+scheduler its outbound requests wait in, and the requests awaiting
+replies. Frame ids are only unique per radio, so each tracks its own.
+CoordinatorRouter learns which coordinator each device is attached to
+from the frames the device sends, so that requests for it are queued on
+the radio that can reach it.
+"""
+
+import threading
+import logging
+
+import xbee
+
+from support.frame_id_allocator import FrameIdAllocator
+from support import tx_scheduler
+from support.deadline_heap import DeadlineTimer, monotonic
+
+class Coordinator(object):
+    """
+    One coordinator radio on a serial port
+
+    device is an open serial port, or anything like one with a fileno().
+    Each frame received is passed to on_frame(coordinator, frame) from
+    the radio's reader thread, as a FrameRecord if lazy_frames is set.
+    Requests are given to submit() along with an opaque context, such as
+    the properties of the broker message they came in, which take_reply()
+    returns when a reply arrives.
+    """
+
+    # {{{ __init__
+    def __init__(self, name, device, on_frame, escaped = False, lazy_frames = False,
+                 rate = 25, burst = 5, request_timeout = 120):
+        super(Coordinator, self).__init__()
+
+        self._logger = logging.getLogger(__name__ + "." + self.__class__.__name__ + "." + name)
+
+        self.name = name
+        self.device = device
+
+        self.__on_frame = on_frame
+        self.__escaped = escaped
+        self.__lazy_frames = lazy_frames
+        self.__request_timeout = request_timeout
+
+        self.xbee = None
+
+        # frame ids of requests awaiting replies; a frame id is only
+        # reused once its request is finished or has expired
+        self.__frame_ids = FrameIdAllocator()
+
+        self.__correlations = {}
+        self.__correlation_lock = threading.RLock()
+
+        # notified when a frame id is released
+        self.__frame_id_freed = threading.Condition(self.__correlation_lock)
+
+        # (req, context, keep_alive, expiration) for requests waiting to be
+        # sent; requests are only taken from it when a frame id is free, so
+        # it also holds requests while all are in use
+        self.__scheduler = tx_scheduler.TxScheduler(rate = rate, burst = burst)
+
+        self.__tx_thread = None
+        self.__tx_stop = threading.Event()
+
+        # expires requests whose replies don't arrive, by frame id
+        self.__expiry = DeadlineTimer(self.__expire_request, name = "%s_expiry" % name)
+
+        # requests expired without a reply
+        self.reaped = 0
+
+    # }}}
+
+    # {{{ start
+    def start(self):
+        """starts reading from the radio and sending requests to it"""
+
+        self.__expiry.start()
+
+        self.xbee = xbee.XBee(self.device,
+                              shorthand = True,
+                              callback = self.__dispatch_frame,
+                              event_driven = True,
+                              escaped = self.__escaped,
+                              lazy_frames = self.__lazy_frames)
+
+        self.__tx_thread = threading.Thread(target = self.__tx_loop, name = "%s_tx" % self.name)
+        self.__tx_thread.daemon = True
+        self.__tx_thread.start()
+
+    # }}}
+
+    # {{{ stop
+    def stop(self, timeout = 5):
+        """stops sending, then reading; doesn't close the device"""
+
+        self.__tx_stop.set()
+
+        if self.__tx_thread is not None:
+            self.__tx_thread.join(timeout)
+
+        self.__expiry.stop()
+
+        if self.__expiry.is_alive():
+            self.__expiry.join(timeout)
+
+        if self.xbee is not None:
+            self.xbee.halt()
+
+    # }}}
+
+    # {{{ submit
+    def submit(self, dest, req, context, keep_alive = False,
+               priority = tx_scheduler.PRIORITY_DEFAULT, coalesce_key = None):
+        """
+        Queues req for the device whose 64-bit address is dest.  Replies
+        are expected until the first arrives, or if keep_alive until the
+        request expires.  Returns the context of a request superseded by
+        this one through coalesce_key, or None.
+        """
+
+        superseded = self.__scheduler.put(
+            dest,
+            (req, context, keep_alive, monotonic() + self.__request_timeout),
+            priority,
+            coalesce_key
+        )
+
+        if superseded is not None:
+            return superseded[1]
+
+        return None
+
+    # }}}
+
+    # {{{ take_reply
+    def take_reply(self, frame_id):
+        """
+        Returns (context, latency) for the request a reply with frame_id
+        answers, or None if there isn't one.  latency is the seconds since
+        the request was sent, for its first reply only, otherwise None.
+        Unless the request is keep_alive, it is finished.
+        """
+
+        with self.__correlation_lock:
+            correlation = self.__correlations.get(frame_id)
+
+            if correlation is None:
+                return None
+
+            latency = None
+
+            if correlation['sent'] is not None:
+                latency = monotonic() - correlation['sent']
+                correlation['sent'] = None
+
+            if not correlation['keep_alive']:
+                self.__finish_request(frame_id)
+
+            return correlation['context'], latency
+
+    # }}}
+
+    # {{{ tx_stats
+    def tx_stats(self):
+        """returns counts of requests in flight and queued for transmission"""
+
+        stats = self.__scheduler.stats()
+
+        with self.__correlation_lock:
+            stats['in_flight'] = self.__frame_ids.in_flight()
+            stats['id_utilization'] = self.__frame_ids.utilization()
+            stats['reaped'] = self.reaped
+
+        return stats
+
+    # }}}
+
+    # {{{ rx_stats
+    def rx_stats(self):
+        if self.xbee is None:
+            return None
+
+        return self.xbee.rx_stats()
+
+    # }}}
+
+    # {{{ __dispatch_frame
+    def __dispatch_frame(self, frame):
+        self.__on_frame(self, frame)
+
+    # }}}
+
+    # {{{ __expire_request
+    def __expire_request(self, frame_id):
+        """called by __expiry when a request's deadline passes"""
+
+        with self.__correlation_lock:
+            req = self.__correlations.get(frame_id)
+
+            # the id may have been finished and reused since it expired
+            if req is not None and monotonic() >= req['expiration']:
+                self._logger.debug("reaping expired request with frame id %02x", ord(frame_id))
+                self.__finish_request(frame_id)
+
+                self.reaped += 1
+
+    # }}}
+
+    # {{{ __finish_request
+    def __finish_request(self, frame_id):
+        """forgets the request using frame_id and frees the id"""
+
+        with self.__correlation_lock:
+            del self.__correlations[frame_id]
+            self.__expiry.cancel(frame_id)
+            self.__frame_ids.release(frame_id)
+
+            self.__frame_id_freed.notify()
+
+    # }}}
+
+    # {{{ __tx_loop
+    def __tx_loop(self):
+        """
+        sends queued requests as frame ids become free, in the order and at
+        the rate determined by the scheduler
+        """
+
+        while not self.__tx_stop.is_set():
+            with self.__frame_id_freed:
+                if self.__frame_ids.utilization() == 1.0:
+                    self.__frame_id_freed.wait(0.5)
+                    continue
+
+            entry = self.__scheduler.get(0.5)
+
+            if entry is None:
+                continue
+
+            dest, (req, context, keep_alive, expiration) = entry
+
+            if monotonic() > expiration:
+                self._logger.debug("dropping expired queued %s request for %r",
+                                   req['method'], req['dest'])
+                continue
+
+            try:
+                self.__transmit(dest, req, context, keep_alive, expiration)
+            except:
+                self._logger.error("failed sending %s request for %r",
+                                   req['method'], req['dest'], exc_info = True)
+
+    # }}}
+
+    # {{{ __transmit
+    def __transmit(self, dest, req, context, keep_alive, expiration):
+        """sends a request with a free frame id; runs on the TX thread"""
+
+        with self.__correlation_lock:
+            # mapping of frame id to request context; used to direct the
+            # response.  __tx_loop waited for a free id.
+            frame_id = self.__frame_ids.allocate()
+
+            self.__correlations[frame_id] = {
+                'context' : context,
+                'keep_alive' : keep_alive,
+                'expiration' : expiration,
+
+                # cleared by the first reply, once its latency is taken
+                'sent' : monotonic(),
+            }
+
+            self.__expiry.add(frame_id, expiration)
+
+        try:
+            if req['method'] == 'send_remote_at':
+                # {'method' : 'send_remote_at',
+                #  'dest' : <addr>,
+                #  'command' : ...,
+                #  'param_val' : ...,
+                # }
+                self.xbee.remote_at(frame_id = frame_id,
+                                    dest_addr_long = dest,
+                                    command = req['command'],
+                                    parameter = req['param_val'])
+
+            elif req['method'] == 'send_data':
+                # {'method' : 'send_data',
+                #  'dest' : <addr>,
+                #  'data' : ...,
+                # }
+                self.xbee.zb_tx_request(frame_id = frame_id,
+                                        dest_addr_long = dest,
+                                        data = req['data'])
+
+            else:
+                raise ValueError("unknown TX method %s" % req['method'])
+
+            self._logger.debug("XBee command sent with frame id %02x", ord(frame_id))
+
+        except:
+            # no reply will come, so don't tie up the id
+            self.__finish_request(frame_id)
+            raise
+
+    # }}}
+
+
+class CoordinatorRouter(object):
+    """
+    Chooses the coordinator for each destination address
+
+    Devices are associated with the coordinator that last received a
+    frame from them; requests for devices which haven't been heard from
+    go to the first coordinator.
+    """
+
+    # {{{ __init__
+    def __init__(self, coordinators):
+        super(CoordinatorRouter, self).__init__()
+
+        self.coordinators = list(coordinators)
+        self.default = self.coordinators[0]
+
+        # 64-bit address -> Coordinator; plain dict operations, so safe to
+        # update from every reader thread
+        self.__routes = {}
+
+    # }}}
+
+    # {{{ learn
+    def learn(self, addr, coordinator):
+        """records that the device with 64-bit address addr is on coordinator"""
+
+        if self.__routes.get(addr) is not coordinator:
+            self.__routes[addr] = coordinator
+
+    # }}}
+
+    # {{{ route
+    def route(self, addr):
+        """returns the coordinator for the device with 64-bit address addr"""
+
+        return self.__routes.get(addr, self.default)
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        """returns the number of devices known on each coordinator"""
+
+        stats = dict((c.name, 0) for c in self.coordinators)
+
+        for coordinator in self.__routes.values():
+            stats[coordinator.name] += 1
+
+        return stats
+
+    # }}}
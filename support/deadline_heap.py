@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+deadline_heap.py
+
+Expiry of outstanding requests by deadline.
+
+DeadlineHeap keeps keys ordered by deadline in a heap, so adding a key
+and expiring one are O(log n) however many are outstanding, and
+cancelling one is O(1). DeadlineTimer runs one on its own thread and
+calls back as each key expires. Deadlines are taken from monotonic(),
+which isn't affected by changes to the system clock.
+"""
+
+import time
+import heapq
+import itertools
+import threading
+import logging
+
+# {{{ monotonic
+def _clock_gettime_monotonic():
+    import ctypes, ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'libc.so.6')
+    clock_gettime = librt.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    # from <linux/time.h>
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        """returns seconds from an arbitrary point; never goes backwards"""
+
+        ts = timespec()
+
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            raise OSError("clock_gettime failed")
+
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    # make sure it works before relying on it
+    monotonic()
+
+    return monotonic
+
+try:
+    monotonic = _clock_gettime_monotonic()
+except (OSError, AttributeError):
+    # not Linux; fall back to the wall clock
+    monotonic = time.time
+
+# }}}
+
+class DeadlineHeap(object):
+    """
+    Keys ordered by deadline
+
+    Not thread-safe; see DeadlineTimer.
+    """
+
+    # {{{ __init__
+    def __init__(self):
+        super(DeadlineHeap, self).__init__()
+
+        # [deadline, sequence, key, live]; cancelled entries stay in the heap
+        # until they reach the top, or until the heap is rebuilt
+        self.__heap = []
+        self.__entries = {}
+        self.__sequence = itertools.count()
+
+    # }}}
+
+    # {{{ add
+    def add(self, key, deadline):
+        """adds key, or moves it to a new deadline"""
+
+        self.cancel(key)
+
+        entry = [deadline, next(self.__sequence), key, True]
+        self.__entries[key] = entry
+
+        heapq.heappush(self.__heap, entry)
+
+    # }}}
+
+    # {{{ cancel
+    def cancel(self, key):
+        """removes key; does nothing if it isn't present"""
+
+        entry = self.__entries.pop(key, None)
+
+        if entry is not None:
+            entry[3] = False
+
+            # rebuild once mostly cancelled entries, to bound memory
+            if len(self.__heap) > 64 and len(self.__heap) > 2 * len(self.__entries):
+                self.__heap = [e for e in self.__heap if e[3]]
+                heapq.heapify(self.__heap)
+
+    # }}}
+
+    # {{{ pop_expired
+    def pop_expired(self, now = None):
+        """removes and returns the keys whose deadlines are at or before now"""
+
+        if now is None:
+            now = monotonic()
+
+        heap = self.__heap
+        expired = []
+
+        while heap and heap[0][0] <= now:
+            deadline, sequence, key, live = heapq.heappop(heap)
+
+            if live:
+                del self.__entries[key]
+                expired.append(key)
+
+        return expired
+
+    # }}}
+
+    # {{{ next_deadline
+    def next_deadline(self):
+        """returns the earliest deadline, or None if there are no keys"""
+
+        heap = self.__heap
+
+        while heap and not heap[0][3]:
+            heapq.heappop(heap)
+
+        if heap:
+            return heap[0][0]
+
+        return None
+
+    # }}}
+
+    # {{{ __len__
+    def __len__(self):
+        return len(self.__entries)
+
+    # }}}
+
+    # {{{ __contains__
+    def __contains__(self, key):
+        return key in self.__entries
+
+    # }}}
+
+
+class DeadlineTimer(threading.Thread):
+    """
+    Calls callback(key) from its own thread as each key's deadline passes
+
+    add() and cancel() may be called from any thread.  callback is called
+    without any lock held, so it may race with a cancel(); it should check
+    that the key is still outstanding.
+    """
+
+    # {{{ __init__
+    def __init__(self, callback, name = "expiry"):
+        super(DeadlineTimer, self).__init__(name = name)
+
+        self.daemon = True
+
+        self._logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+        self.__callback = callback
+        self.__deadlines = DeadlineHeap()
+        self.__cond = threading.Condition(threading.Lock())
+        self.__stopped = False
+
+        # number of keys expired
+        self.expired = 0
+
+    # }}}
+
+    # {{{ add
+    def add(self, key, deadline):
+        with self.__cond:
+            self.__deadlines.add(key, deadline)
+            self.__cond.notify()
+
+    # }}}
+
+    # {{{ cancel
+    def cancel(self, key):
+        with self.__cond:
+            self.__deadlines.cancel(key)
+
+    # }}}
+
+    # {{{ __len__
+    def __len__(self):
+        return len(self.__deadlines)
+
+    # }}}
+
+    # {{{ stop
+    def stop(self):
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify()
+
+    # }}}
+
+    # {{{ run
+    def run(self):
+        while True:
+            with self.__cond:
+                while not self.__stopped:
+                    now = monotonic()
+                    expired = self.__deadlines.pop_expired(now)
+
+                    if expired:
+                        break
+
+                    next_deadline = self.__deadlines.next_deadline()
+
+                    if next_deadline is None:
+                        self.__cond.wait()
+                    else:
+                        self.__cond.wait(next_deadline - now)
+
+                if self.__stopped:
+                    break
+
+            for key in expired:
+                self.expired += 1
+
+                try:
+                    self.__callback(key)
+                except:
+                    self._logger.error("exception expiring %r", key, exc_info = True)
+
+    # }}}
+
+
+if __name__ == '__main__':
+    # thousands of outstanding requests, most of which are answered
+    # (cancelled) before they expire, compared with scanning the whole
+    # table for expired requests on every reply; see
+    # support/tests/test_deadline_heap.py for the tests
+    import random
+
+    N = 5000
+
+    heap = DeadlineHeap()
+    table = {}
+
+    now = monotonic()
+    deadlines = [now + random.uniform(0, 120) for i in range(N)]
+
+    start = monotonic()
+    for i, d in enumerate(deadlines):
+        heap.add(i, d)
+    for i in range(0, N, 2):
+        heap.cancel(i)
+        heap.pop_expired(now)
+    heap_time = monotonic() - start
+
+    start = monotonic()
+    for i, d in enumerate(deadlines):
+        table[i] = d
+    for i in range(0, N, 2):
+        del table[i]
+        [k for k, d in table.iteritems() if d <= now]
+    scan_time = monotonic() - start
+
+    print "%d requests, %d replies: heap %.3f s, scan %.3f s" % (N, N / 2, heap_time, scan_time)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+dedup_window.py
+
+Recognizes messages seen a moment ago.
+
+Mesh retries and route repairs occasionally deliver the same frame from
+a device twice. DedupWindow remembers the fingerprint of each message
+for a fixed window of seconds, so that a copy arriving within it can be
+dropped. Checking a fingerprint costs a couple of dict lookups however
+many are remembered, and the number remembered is capped.
+"""
+
+import time
+
+class DedupWindow(object):
+    """
+    Remembers fingerprints for at least window seconds
+
+    Fingerprints are any hashable value; the caller decides what makes
+    two messages the same.  They are kept in two generations of dicts:
+    new fingerprints go into the current one, which replaces the previous
+    one every window seconds, so each is remembered for between one and
+    two windows.  After a gap of more than a window since the current
+    generation should have been replaced, both are cleared instead.  A
+    generation is also started early once the current one
+    holds max_entries, bounding memory at the cost of missing some
+    duplicates under a flood.
+
+    seen() may be called from several threads without locking; a race
+    while starting a generation at worst forgets a few fingerprints early.
+    """
+
+    # {{{ __init__
+    def __init__(self, window, max_entries = 4096):
+        super(DedupWindow, self).__init__()
+
+        self.window = window
+        self.max_entries = max_entries
+
+        # current generation, previous generation, when to start the next
+        state = self.__state = [{}, {}, 0.0]
+
+        # duplicates found
+        self.duplicates = 0
+
+        # a closure avoids attribute lookups on every check
+        def seen(fingerprint, now = None):
+            """
+            Returns True if fingerprint was seen within the window before
+            now; otherwise remembers it and returns False.  now defaults to
+            time.time(), but any clock may be used consistently.
+            """
+
+            if now is None:
+                now = time.time()
+
+            current, previous, rotate_at = state
+
+            if now >= rotate_at:
+                if now >= rotate_at + window:
+                    # idle for longer than a window; everything remembered
+                    # is older than that
+                    previous, current = {}, {}
+                else:
+                    previous, current = current, {}
+
+                state[:] = current, previous, now + window
+
+            if fingerprint in current or fingerprint in previous:
+                self.duplicates += 1
+                return True
+
+            if len(current) >= max_entries:
+                previous, current = current, {}
+                state[:] = current, previous, now + window
+
+            current[fingerprint] = True
+
+            return False
+
+        self.seen = seen
+
+    # }}}
+
+    # {{{ __len__
+    def __len__(self):
+        current, previous, rotate_at = self.__state
+
+        return len(current) + len(previous)
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        return {
+            'duplicates' : self.duplicates,
+            'remembered' : len(self),
+        }
+
+    # }}}
+
+
+if __name__ == '__main__':
+    # a few dozen devices, each frame checked once and a few repeated, as
+    # the gateway does with (routing key, hash of packet); see
+    # support/tests/test_dedup_window.py for the tests
+    import timeit
+
+    packets = [('zb_rx.00:13:a2:00:40:32:dc:%02x' % (i % 40), hash('V:%04d' % i)) for i in range(1000)]
+
+    dedup = DedupWindow(0.5)
+    clock = iter(xrange(10 ** 9)).next
+    n = len(packets) * 100
+
+    t = min(timeit.repeat(
+        'for p in packets: seen(p, clock() * 0.001)',
+        setup = 'from __main__ import packets, dedup, clock; seen = dedup.seen',
+        number = 100, repeat = 3))
+
+    print "%.0f ns per frame, %d remembered" % (t / n * 1e9, len(dedup))
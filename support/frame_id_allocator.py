@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+frame_id_allocator.py
+
+Tracks which XBee API frame ids are in use.
+
+Replies from the radio are matched to requests by a single-byte frame
+id; id 0 means no reply is wanted, leaving 255 usable ids. Handing them
+out from a counter reuses an id after 255 requests even if the first
+request is still waiting for its reply, so that reply can be routed to
+the wrong requester. FrameIdAllocator only hands out ids which have been
+released, and reports when none are left so the caller can hold its
+request until one is.
+"""
+
+import random
+import threading
+import collections
+
+class FrameIdAllocator(object):
+    """
+    Allocates frame ids from the 255 non-zero values
+
+    Free ids are handed out least recently released first, so that a
+    late reply to an expired request is unlikely to find its id reused.
+    """
+
+    # {{{ __init__
+    def __init__(self, ids = range(1, 256)):
+        super(FrameIdAllocator, self).__init__()
+
+        ids = [chr(i) for i in ids]
+
+        # start somewhere random so that a restarted process doesn't
+        # reuse ids for which replies may still arrive
+        start = random.randrange(len(ids))
+
+        self.__free = collections.deque(ids[start:] + ids[:start])
+        self.__in_use = set()
+        self.__size = len(ids)
+
+        self.__lock = threading.Lock()
+
+    # }}}
+
+    # {{{ allocate
+    def allocate(self):
+        """returns a free frame id as a 1-byte string, or None if all are in use"""
+
+        with self.__lock:
+            if not self.__free:
+                return None
+
+            frame_id = self.__free.popleft()
+            self.__in_use.add(frame_id)
+
+            return frame_id
+
+    # }}}
+
+    # {{{ release
+    def release(self, frame_id):
+        """returns frame_id to the pool; releasing a free id does nothing"""
+
+        with self.__lock:
+            if frame_id in self.__in_use:
+                self.__in_use.remove(frame_id)
+                self.__free.append(frame_id)
+
+    # }}}
+
+    # {{{ in_flight
+    def in_flight(self):
+        """returns the number of ids in use"""
+
+        return len(self.__in_use)
+
+    # }}}
+
+    # {{{ utilization
+    def utilization(self):
+        """returns the fraction of the id space in use, from 0.0 to 1.0"""
+
+        return float(len(self.__in_use)) / self.__size
+
+    # }}}
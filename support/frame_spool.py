@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+frame_spool.py
+
+Holds messages on disk while the broker can't be reached.
+
+FrameSpool is an append-only queue of records in a fixed-size,
+memory-mapped file. Appending and replaying are a struct pack or unpack
+and a slice of the map, with no system calls, so a backlog can be
+replayed as fast as the broker will take it. Records survive a restart
+of the process; the spool carries on from where it left off. Once the
+file is full further records are refused and counted, bounding the space
+used.
+"""
+
+import os
+import mmap
+import struct
+import threading
+
+class FrameSpool(object):
+    """
+    A bounded FIFO of records, each a tuple of strings
+
+    The file starts with a header giving the offsets of the oldest record
+    and of the end of the newest, followed by the records themselves,
+    each a length-prefixed list of parts.  The space used by replayed
+    records is reclaimed once the spool is empty, or when an append
+    wouldn't otherwise fit.
+    """
+
+    MAGIC = 'XBSPOOL1'
+
+    # magic, offset of the oldest record, end of the newest, record count
+    HEADER = struct.Struct('!8sQQQ')
+
+    # total length of a record following this prefix, and its part count
+    RECORD = struct.Struct('!IH')
+
+    # {{{ __init__
+    def __init__(self, path, size = 64 * 1024 * 1024):
+        super(FrameSpool, self).__init__()
+
+        self.path = path
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+
+        try:
+            # an existing spool keeps its size, so its records stay put
+            self.__size = max(os.fstat(fd).st_size, size)
+            os.ftruncate(fd, self.__size)
+
+            self.__map = mmap.mmap(fd, self.__size)
+        finally:
+            # the map holds its own reference to the file
+            os.close(fd)
+
+        magic, self.__head, self.__tail, self.__count = self.HEADER.unpack_from(self.__map, 0)
+
+        if magic != self.MAGIC or \
+           not (self.HEADER.size <= self.__head <= self.__tail <= self.__size):
+            self.__reset()
+
+        self.__lock = threading.Lock()
+
+        # counters
+        self.spooled = 0
+        self.replayed = 0
+        self.overflowed = 0
+
+    # }}}
+
+    # {{{ __reset
+    def __reset(self):
+        self.__head = self.__tail = self.HEADER.size
+        self.__count = 0
+
+        self.__write_header()
+
+    # }}}
+
+    # {{{ __write_header
+    def __write_header(self):
+        self.HEADER.pack_into(self.__map, 0,
+                              self.MAGIC, self.__head, self.__tail, self.__count)
+
+    # }}}
+
+    # {{{ append
+    def append(self, parts):
+        """
+        Adds a record made of the strings in parts.  Returns False if the
+        spool is full and the record was discarded.
+        """
+
+        lengths = struct.pack('!%dI' % len(parts), *[len(p) for p in parts])
+        data = lengths + ''.join(parts)
+
+        prefix = self.RECORD.pack(len(data), len(parts))
+        needed = len(prefix) + len(data)
+
+        with self.__lock:
+            if self.__tail + needed > self.__size:
+                self.__compact()
+
+                if self.__tail + needed > self.__size:
+                    self.overflowed += 1
+                    return False
+
+            tail = self.__tail
+            self.__map[tail:tail + needed] = prefix + data
+
+            self.__tail = tail + needed
+            self.__count += 1
+            self.__write_header()
+
+            self.spooled += 1
+
+        return True
+
+    # }}}
+
+    # {{{ __compact
+    def __compact(self):
+        """moves the records to the start of the file; called with the lock held"""
+
+        offset = self.__head - self.HEADER.size
+
+        if offset:
+            self.__map.move(self.HEADER.size, self.__head, self.__tail - self.__head)
+
+            self.__head -= offset
+            self.__tail -= offset
+            self.__write_header()
+
+    # }}}
+
+    # {{{ replay
+    def replay(self, publish, limit = None):
+        """
+        Calls publish(parts) for up to limit records, oldest first, removing
+        each once publish returns.  If publish raises, the record stays at
+        the front of the spool and the exception propagates.  Returns the
+        number of records replayed.
+        """
+
+        record_size = self.RECORD.size
+        unpack_record = self.RECORD.unpack_from
+
+        replayed = 0
+
+        while limit is None or replayed < limit:
+            with self.__lock:
+                head = self.__head
+
+                if head == self.__tail:
+                    break
+
+                length, count = unpack_record(self.__map, head)
+
+                start = head + record_size
+                lengths = struct.unpack_from('!%dI' % count, self.__map, start)
+
+                pos = start + 4 * count
+                parts = []
+
+                for l in lengths:
+                    parts.append(self.__map[pos:pos + l])
+                    pos += l
+
+            # the lock isn't held while publishing, so append() never waits
+            # on the broker
+            publish(tuple(parts))
+
+            with self.__lock:
+                # relative to the head, which append() may have moved by
+                # compacting the spool meanwhile
+                self.__head += record_size + length
+                self.__count -= 1
+
+                if self.__head == self.__tail:
+                    # empty; start over at the front of the file
+                    self.__reset()
+                else:
+                    self.__write_header()
+
+                self.replayed += 1
+
+            replayed += 1
+
+        return replayed
+
+    # }}}
+
+    # {{{ __len__
+    def __len__(self):
+        return self.__count
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        """returns the number of records and bytes spooled, and counters"""
+
+        with self.__lock:
+            return {
+                'pending' : self.__count,
+                'bytes' : self.__tail - self.__head,
+                'capacity' : self.__size - self.HEADER.size,
+                'spooled' : self.spooled,
+                'replayed' : self.replayed,
+                'overflowed' : self.overflowed,
+            }
+
+    # }}}
+
+    # {{{ close
+    def close(self):
+        """writes the spool to disk and unmaps it"""
+
+        with self.__lock:
+            self.__map.flush()
+            self.__map.close()
+
+    # }}}
+
+
+if __name__ == '__main__':
+    # A day of frames from 10 devices reporting every second is spooled
+    # and replayed, timing each; see support/tests/test_frame_spool.py for
+    # the tests.
+    import time, tempfile
+
+    FRAMES = 10 * 60 * 60 * 24
+
+    fd, path = tempfile.mkstemp(suffix = '.spool')
+    os.close(fd)
+
+    spool = FrameSpool(path, size = 256 * 1024 * 1024)
+
+    record = ('raw_xbee_frames', 'zb_rx.00:13:a2:00:40:32:dc:dc',
+              'application/x-xbee-frame', '', 'x' * 60)
+
+    start = time.time()
+
+    for i in xrange(FRAMES):
+        spool.append(record)
+
+    print "spooled %d frames (%.1f MB) in %.2f s" % (
+        len(spool), spool.stats()['bytes'] / 1048576.0, time.time() - start)
+
+    start = time.time()
+    spool.replay(lambda parts: None)
+    elapsed = time.time() - start
+
+    print "replayed %d frames in %.2f s (%.0f frames/s)" % (
+        FRAMES, elapsed, FRAMES / elapsed)
+
+    spool.close()
+    os.unlink(path)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+metrics.py
+
+Lightweight counters and latency histograms for long-running daemons.
+
+Recording is a dict increment or a list append, so that it can be done
+for every frame without measurably slowing the hot path; histograms
+sort their observations into buckets later, in bulk.
+Metrics.snapshot() returns everything as plain, JSON-serializable data,
+with per-second rates of the counters since the previous snapshot.
+serve_metrics() makes snapshots available to local scrapers over HTTP,
+on a TCP port or a Unix socket.
+"""
+
+import os
+import time
+import bisect
+import collections
+import threading
+import logging
+import json
+import BaseHTTPServer
+import SocketServer
+
+class Histogram(object):
+    """
+    Counts observations into buckets with fixed upper bounds
+
+    The bounds default to roughly logarithmic steps from 100us to 60s,
+    suiting latencies recorded in seconds.  observe() only appends the
+    value to a list; values are sorted into buckets when the histogram is
+    read, or once PENDING_LIMIT of them are waiting, by whichever thread
+    gets there; only sorting them takes a lock.
+    """
+
+    BOUNDS = (0.0001, 0.00025, 0.0005,
+              0.001, 0.0025, 0.005,
+              0.01, 0.025, 0.05,
+              0.1, 0.25, 0.5,
+              1.0, 2.5, 5.0,
+              10.0, 30.0, 60.0)
+
+    PENDING_LIMIT = 4096
+
+    # {{{ __init__
+    def __init__(self, bounds = BOUNDS):
+        super(Histogram, self).__init__()
+
+        self.bounds = tuple(bounds)
+
+        # the last bucket counts observations above the highest bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+        # held while pending observations are counted, so two threads
+        # flushing at once don't count the same ones
+        self.__flush_lock = threading.Lock()
+
+        pending = self.__pending = []
+        append = pending.append
+        limit = self.PENDING_LIMIT
+        flush = self.flush
+
+        # a closure avoids attribute lookups on every observation
+        def observe(value):
+            append(value)
+
+            if len(pending) >= limit:
+                flush()
+
+        self.observe = observe
+
+    # }}}
+
+    # {{{ flush
+    def flush(self):
+        """sorts pending observations into buckets"""
+
+        pending = self.__pending
+
+        with self.__flush_lock:
+            # anything appended meanwhile stays pending
+            values = pending[:]
+            del pending[:len(values)]
+
+            # counting sorted values between bounds is much cheaper than
+            # finding the bucket of each value
+            values.sort()
+
+            counts = self.counts
+            below = 0
+
+            for i, bound in enumerate(self.bounds):
+                upto = bisect.bisect_right(values, bound)
+                counts[i] += upto - below
+                below = upto
+
+            counts[-1] += len(values) - below
+
+            self.count += len(values)
+            self.total += sum(values)
+
+    # }}}
+
+    # {{{ quantile
+    def quantile(self, q):
+        """
+        returns the upper bound of the bucket containing the q'th quantile,
+        '+Inf' if it's above the highest bound, as the bucket is labelled in
+        snapshot(), or None if nothing has been observed
+        """
+
+        self.flush()
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+
+            if seen >= rank:
+                return bound
+
+        # in the overflow bucket; float('inf') isn't valid JSON
+        return '+Inf'
+
+    # }}}
+
+    # {{{ snapshot
+    def snapshot(self):
+        self.flush()
+
+        return {
+            'count' : self.count,
+            'sum' : self.total,
+            'buckets' : [[b, c] for b, c in zip(self.bounds, self.counts)] +
+                        [['+Inf', self.counts[-1]]],
+            'p50' : self.quantile(0.5),
+            'p90' : self.quantile(0.9),
+            'p99' : self.quantile(0.99),
+        }
+
+    # }}}
+
+
+class Metrics(object):
+    """
+    A named collection of counters and histograms
+
+    Counters are dicts of label -> count, so that one counter can break
+    down by frame type and address, for example; use increment() or
+    update the dict returned by counter() directly.  Values recorded from
+    several threads may very occasionally lose an update, which is fine
+    for monitoring and keeps recording free of locks.
+    """
+
+    # {{{ __init__
+    def __init__(self):
+        super(Metrics, self).__init__()
+
+        self.__counters = {}
+        self.__histograms = {}
+        self.__gauges = {}
+
+        self.__started = time.time()
+
+        # counter values and time as of the previous snapshot, for rates
+        self.__last_counts = {}
+        self.__last_snapshot = self.__started
+
+        self.__snapshot_lock = threading.Lock()
+
+    # }}}
+
+    # {{{ counter
+    def counter(self, name):
+        """returns the label -> count dict for the named counter"""
+
+        counter = self.__counters.get(name)
+
+        if counter is None:
+            counter = self.__counters[name] = collections.defaultdict(int)
+
+        return counter
+
+    # }}}
+
+    # {{{ increment
+    def increment(self, name, label = '', value = 1):
+        self.counter(name)[label] += value
+
+    # }}}
+
+    # {{{ histogram
+    def histogram(self, name, bounds = Histogram.BOUNDS):
+        histogram = self.__histograms.get(name)
+
+        if histogram is None:
+            histogram = self.__histograms[name] = Histogram(bounds)
+
+        return histogram
+
+    # }}}
+
+    # {{{ gauge
+    def gauge(self, name, func):
+        """registers func, which returns a value or dict of values, to be
+        called for each snapshot"""
+
+        self.__gauges[name] = func
+
+    # }}}
+
+    # {{{ snapshot
+    def snapshot(self):
+        """returns all metrics as a JSON-serializable dict"""
+
+        with self.__snapshot_lock:
+            now = time.time()
+            elapsed = max(now - self.__last_snapshot, 1e-6)
+
+            counters = {}
+            rates = {}
+
+            for name, counter in self.__counters.items():
+                values = dict((self.__label(l), c) for l, c in counter.items())
+                last = self.__last_counts.get(name, {})
+
+                counters[name] = values
+                rates[name] = dict(
+                    (l, (c - last.get(l, 0)) / elapsed) for l, c in values.items()
+                )
+
+                self.__last_counts[name] = values
+
+            self.__last_snapshot = now
+
+            gauges = {}
+
+            for name, func in self.__gauges.items():
+                try:
+                    gauges[name] = func()
+                except:
+                    logging.getLogger(__name__).error(
+                        "unable to read gauge %s", name, exc_info = True
+                    )
+
+            return {
+                'uptime' : now - self.__started,
+                'interval' : elapsed,
+                'counters' : counters,
+                'rates' : rates,
+                'histograms' : dict(
+                    (name, h.snapshot()) for name, h in self.__histograms.items()
+                ),
+                'gauges' : gauges,
+            }
+
+    # }}}
+
+    # {{{ __label
+    @staticmethod
+    def __label(label):
+        # tuple labels are joined so that they can be JSON object keys
+        if isinstance(label, tuple):
+            return '.'.join(str(l) for l in label)
+
+        return str(label)
+
+    # }}}
+
+
+# {{{ HTTP endpoint
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.server.metrics.snapshot(), indent = 2)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients don't have a host
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+
+        return 'local'
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+class _TCPMetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixMetricsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_metrics(metrics, address):
+    """
+    Serves metrics.snapshot() as JSON to GET / or /metrics from a daemon
+    thread.  address is a (host, port) tuple, or the path of a Unix socket
+    to create.  Returns the server; call its shutdown() to stop it.
+    """
+
+    if isinstance(address, basestring):
+        if os.path.exists(address):
+            os.unlink(address)
+
+        server = _UnixMetricsServer(address, _MetricsHandler)
+    else:
+        server = _TCPMetricsServer(address, _MetricsHandler)
+
+    server.metrics = metrics
+
+    t = threading.Thread(target = server.serve_forever, name = "metrics_http")
+    t.daemon = True
+    t.start()
+
+    return server
+
+# }}}
+
+
+if __name__ == '__main__':
+    # the cost of recording a frame as the gateway does; see
+    # support/tests/test_metrics.py for the tests
+    import timeit
+
+    m = Metrics()
+
+    frames = m.counter('frames')
+    latency = m.histogram('latency')
+    key = ('zb_rx', '00:13:a2:00:40:32:dc:dc')
+
+    n = 1000000
+    t = min(timeit.repeat('frames[key] += 1; observe(0.0042)',
+                          setup = 'from __main__ import frames, latency, key; observe = latency.observe',
+                          number = n, repeat = 3))
+
+    print "recording a counter and a histogram: %.0f ns per frame" % (t / n * 1e9)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+pipeline.py
+
+Keeps several requests to a device in flight at once.
+
+Sending a sequence of commands one after another costs a full radio
+round trip for each, through the broker, the gateway's transmit queue and
+the mesh and back. pipelined() submits up to a window of requests before
+waiting for the oldest to finish, so that their round trips overlap, and
+returns the results in the order the requests were submitted.
+"""
+
+import collections
+
+# {{{ pipelined
+def pipelined(submit, items, window = 4):
+    """
+    Calls submit(item) for each of items, which must return a future: an
+    object whose result() waits for and returns the request's result.
+    Returns a list of the results, in order, waiting for the oldest
+    whenever window requests are unfinished.  An exception raised by
+    result() propagates; requests still in flight are left to finish or
+    expire on their own.
+    """
+
+    results = []
+    in_flight = collections.deque()
+
+    for item in items:
+        if len(in_flight) >= window:
+            results.append(in_flight.popleft().result())
+
+        in_flight.append(submit(item))
+
+    while in_flight:
+        results.append(in_flight.popleft().result())
+
+    return results
+
+# }}}
+
+
+if __name__ == '__main__':
+    # A stand-in for the gateway paces frames as it does, with a
+    # TxScheduler, and replies to each one a radio round trip after it's
+    # sent.  Querying all of a device's parameters, as xbee_device_config
+    # does, is timed one command at a time and pipelined; see
+    # support/tests/test_pipeline.py for the tests.
+    import time
+    import threading
+
+    from support.tx_scheduler import TxScheduler
+    from support.deadline_heap import DeadlineTimer, monotonic
+
+    # remote AT command to a router a hop or two away, and the broker hops
+    # between consumer and gateway
+    ROUND_TRIP = 0.15
+    BROKER = 0.002
+
+    COMMANDS = ['C%02d' % i for i in range(60)]
+
+    class StandInReply(object):
+        def __init__(self, command):
+            self.command = command
+            self.event = threading.Event()
+            self.response = None
+
+        def result(self):
+            self.event.wait()
+            return self.response
+
+    class StandInGateway(object):
+        def __init__(self):
+            self.scheduler = TxScheduler(rate = 25, burst = 5)
+            self.replies = DeadlineTimer(self.__reply, name = "radio")
+            self.replies.start()
+
+            t = threading.Thread(target = self.__transmit, name = "tx")
+            t.daemon = True
+            t.start()
+
+        def send(self, command):
+            reply = StandInReply(command)
+
+            time.sleep(BROKER)
+            self.scheduler.put('00:13:a2:00:40:32:dc:dc', reply)
+
+            return reply
+
+        def __transmit(self):
+            while True:
+                dest, reply = self.scheduler.get()
+                self.replies.add(reply, monotonic() + ROUND_TRIP + BROKER)
+
+        def __reply(self, reply):
+            reply.response = {'command' : reply.command, 'status' : '\x00'}
+            reply.event.set()
+
+    gateway = StandInGateway()
+
+    for window in (1, 2, 4, 8):
+        start = monotonic()
+        results = pipelined(gateway.send, COMMANDS, window)
+        elapsed = monotonic() - start
+
+        print "window %d: %d commands in %.2f s, %3.0f ms each" % (
+            window, len(COMMANDS), elapsed, elapsed / len(COMMANDS) * 1000)
+
+    gateway.replies.stop()
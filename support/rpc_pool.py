@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+rpc_pool.py
+
+Runs RPC handlers on a pool of threads.
+
+An RPC handler may wait tens of seconds for a device to reply, so handling
+requests one at a time lets a single slow call hold up every other one.
+RPCWorkerPool runs requests on several threads, while limiting how many
+from each RPC queue run at once, so that handlers which keep state needn't
+be thread-safe and one busy queue can't take every thread. Each request
+may carry a deadline; a request still waiting when its deadline passes
+is dropped without running, as its caller has given up on it.
+"""
+
+import threading
+import collections
+import logging
+
+from support.deadline_heap import monotonic
+
+class RPCWorkerPool(object):
+    """
+    A fixed number of threads running submitted requests
+
+    Requests are started in the order submitted, except that one is passed
+    over while its queue has as many requests running as its limit; that
+    is default_limit unless set with set_limit().
+    """
+
+    # {{{ __init__
+    def __init__(self, size = 4, default_limit = 1, name = 'rpc_worker'):
+        super(RPCWorkerPool, self).__init__()
+
+        self._logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+        self.size = size
+        self.default_limit = default_limit
+        self.name = name
+
+        # queue -> maximum requests from it running at once
+        self.limits = {}
+
+        # (queue, deadline, func, args), oldest first
+        self.__pending = collections.deque()
+
+        # queue -> requests from it running
+        self.__running = collections.defaultdict(int)
+
+        self.__cond = threading.Condition()
+        self.__threads = []
+        self.__shutdown = False
+
+        # counters
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+
+    # }}}
+
+    # {{{ set_limit
+    def set_limit(self, queue, limit):
+        """sets the number of requests from queue that may run at once"""
+
+        with self.__cond:
+            self.limits[queue] = limit
+            self.__cond.notify_all()
+
+    # }}}
+
+    # {{{ start
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target = self.__run, name = "%s_%d" % (self.name, i))
+            t.daemon = True
+            t.start()
+
+            self.__threads.append(t)
+
+    # }}}
+
+    # {{{ submit
+    def submit(self, queue, deadline, func, *args):
+        """
+        Runs func(*args) on a worker, counted against queue.  deadline is a
+        monotonic() time after which the request is dropped if it hasn't
+        started, or None to wait however long it takes.
+        """
+
+        with self.__cond:
+            self.__pending.append((queue, deadline, func, args))
+            self.__cond.notify()
+
+    # }}}
+
+    # {{{ in_worker
+    def in_worker(self):
+        """returns True if called from one of the pool's threads"""
+
+        return threading.currentThread() in self.__threads
+
+    # }}}
+
+    # {{{ __take
+    def __take(self):
+        """
+        removes and returns the first request able to start, dropping any
+        that have expired; called with the condition held
+        """
+
+        now = monotonic()
+
+        for request in list(self.__pending):
+            queue, deadline, func, args = request
+
+            if deadline is not None and deadline <= now:
+                self._logger.warn("dropping expired request for %s: %r", queue, func)
+
+                self.__pending.remove(request)
+                self.expired += 1
+
+            elif self.__running[queue] < self.limits.get(queue, self.default_limit):
+                self.__pending.remove(request)
+
+                return request
+
+        return None
+
+    # }}}
+
+    # {{{ __run
+    def __run(self):
+        while True:
+            with self.__cond:
+                request = self.__take()
+
+                while request is None:
+                    if self.__shutdown:
+                        return
+
+                    self.__cond.wait()
+
+                    request = self.__take()
+
+                queue, deadline, func, args = request
+
+                self.__running[queue] += 1
+
+            try:
+                func(*args)
+            except:
+                self._logger.error("exception running request for %s", queue, exc_info = True)
+                self.failed += 1
+
+            with self.__cond:
+                self.__running[queue] -= 1
+                self.completed += 1
+
+                # a request held back by this queue's limit may now start
+                self.__cond.notify_all()
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        with self.__cond:
+            return {
+                'pending' : len(self.__pending),
+                'running' : sum(self.__running.values()),
+                'completed' : self.completed,
+                'failed' : self.failed,
+                'expired' : self.expired,
+            }
+
+    # }}}
+
+    # {{{ shutdown
+    def shutdown(self):
+        """stops the threads once their current requests finish; pending requests are dropped"""
+
+        with self.__cond:
+            self.__shutdown = True
+            self.__pending.clear()
+            self.__cond.notify_all()
+
+    # }}}
+
+    # {{{ is_alive
+    def is_alive(self):
+        return any(t.is_alive() for t in self.__threads)
+
+    # }}}
+
+    # {{{ join
+    def join(self, timeout = None):
+        for t in self.__threads:
+            t.join(timeout)
+
+    # }}}
+
+
+if __name__ == '__main__':
+    # A consumer's RPCs, as the driver host would serve them: calibration
+    # reads that wait on a device, mixed with quick timer and sprinkler
+    # calls.  Device waits are scaled down from up to 30 s to 0.5 s.
+    import time
+
+    SLOW = 0.5
+    FAST = 0.002
+
+    def call(duration, done):
+        time.sleep(duration)
+        done.append(monotonic())
+
+    def workload(pool):
+        latencies = collections.defaultdict(list)
+        submitted = []
+
+        pool.start()
+        start = monotonic()
+
+        for i in range(200):
+            if i % 20 == 0:
+                kind, queue, duration = 'slow', 'environmental_node', SLOW
+            else:
+                kind, queue, duration = 'fast', ('furnace', 'sprinkler')[i % 2], FAST
+
+            finished = []
+            submitted.append((kind, monotonic(), finished))
+            pool.submit(queue, None, call, duration, finished)
+
+            # requests arrive over time, not all at once
+            time.sleep(0.001)
+
+        while pool.stats()['completed'] < len(submitted):
+            time.sleep(0.01)
+
+        elapsed = monotonic() - start
+
+        pool.shutdown()
+        pool.join()
+
+        for kind, submitted_at, finished in submitted:
+            latencies[kind].append(finished[0] - submitted_at)
+
+        return elapsed, latencies
+
+    def describe(latencies):
+        l = sorted(latencies)
+        return "p50 %6.1f ms, max %6.1f ms" % (l[len(l) / 2] * 1000, l[-1] * 1000)
+
+    two_reads = RPCWorkerPool(size = 4)
+    two_reads.set_limit('environmental_node', 2)
+
+    for label, pool in (
+        ('one worker', RPCWorkerPool(size = 1)),
+        ('pool of 4', RPCWorkerPool(size = 4)),
+        ('2 reads', two_reads),
+    ):
+        elapsed, latencies = workload(pool)
+
+        print "%-10s %5.0f calls/s; fast calls %s; slow calls %s" % (
+            label, 200 / elapsed, describe(latencies['fast']), describe(latencies['slow']))
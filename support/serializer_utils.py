@@ -4,14 +4,25 @@
 serializer_utils.py
 
 Created by Brian Lalor on 2012-05-18.
+
+CONTENT_TYPE_XBEE_FRAME is a compact encoding of received XBee frames:
+the _timestamp as microseconds since the epoch, followed by the frame's
+packet exactly as the radio sent it, which holds every other field.
+Frames are decoded into lazy FrameRecords, so a consumer only pays for
+the fields it reads.
 """
 
 import cPickle as pickle
 import json
 import bson
+import struct
 
 import datetime, time
 
+from xbee.impl import XBee
+from xbee.spec import split_response
+from xbee.record import FrameRecord
+
 import time_util
 SYSTEM_TZ = time_util.SYSTEM_TZ
 UTC = time_util.UTC
@@ -19,6 +30,7 @@ UTC = time_util.UTC
 CONTENT_TYPE_PICKLE = 'application/x-python-pickle'
 CONTENT_TYPE_JSON   = 'application/json'
 CONTENT_TYPE_BSON   = 'application/bson'
+CONTENT_TYPE_XBEE_FRAME = 'application/x-xbee-frame'
 
 ## alias to affect all uses
 CONTENT_TYPE_BINARY = CONTENT_TYPE_BSON
@@ -38,6 +50,9 @@ def _dthandler(obj):
         
         return dt.astimezone(UTC).isoformat()
     
+    elif isinstance(obj, FrameRecord):
+        return obj.to_dict()
+    
     elif isinstance(obj, Exception):
         return {
             'py/class': obj.__class__.__name__,
@@ -49,6 +64,61 @@ def _dthandler(obj):
 
 
 
+# {{{ _plain
+def _plain(obj):
+    """returns obj with any FrameRecords, which BSON can't encode, as dicts"""
+    
+    if isinstance(obj, FrameRecord):
+        obj = obj.to_dict()
+    
+    if isinstance(obj, dict):
+        return dict((k, _plain(v)) for k, v in obj.iteritems())
+    
+    elif isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    
+    return obj
+
+# }}}
+
+# {{{ XBee frames
+# timestamp in microseconds since the epoch; the packet carries the rest
+_FRAME_HEADER = struct.Struct('!q')
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo = UTC)
+
+_RESPONSE_SPECS = XBee._response_specs
+
+def _dump_frame(frame):
+    """frame is a FrameRecord which holds its packet"""
+    
+    packet = frame.raw()
+    
+    if packet is None:
+        raise ValueError("frame was decoded without keeping its packet")
+    
+    timestamp = 0
+    dt = frame.get('_timestamp')
+    
+    if dt is not None:
+        if dt.tzinfo == None:
+            dt = SYSTEM_TZ.localize(dt)
+        
+        delta = dt - _EPOCH
+        timestamp = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    
+    return _FRAME_HEADER.pack(timestamp) + packet
+
+def _load_frame(data):
+    timestamp = _FRAME_HEADER.unpack_from(data)[0]
+    
+    frame = split_response(_RESPONSE_SPECS, data[_FRAME_HEADER.size:], lazy = True)
+    frame['_timestamp'] = _EPOCH + datetime.timedelta(microseconds = timestamp)
+    
+    return frame
+
+# }}}
+
 # {{{ serialize
 def serialize(data, content_type):
     retVal = None
@@ -61,7 +131,10 @@ def serialize(data, content_type):
         retVal = json.dumps(data, default = _dthandler)
     
     elif content_type == CONTENT_TYPE_BSON:
-        retVal = bson.dumps(data)
+        retVal = bson.dumps(_plain(data))
+
+    elif content_type == CONTENT_TYPE_XBEE_FRAME:
+        retVal = _dump_frame(data)
 
     else:
         raise InvalidSerializationContentType(content_type)
@@ -84,6 +157,9 @@ def deserialize(data, content_type):
     elif content_type == CONTENT_TYPE_BSON:
         retVal = bson.loads(data)
     
+    elif content_type == CONTENT_TYPE_XBEE_FRAME:
+        retVal = _load_frame(data)
+    
     else:
         raise InvalidSerializationContentType(content_type)
 
@@ -113,3 +189,44 @@ if __name__ == '__main__':
     print "    serialized:", utcser
     print "iso8601 parsed:", iso8601.parse_date(utcser).isoformat()
     print "   iso8601 sys:", iso8601.parse_date(utcser).astimezone(SYSTEM_TZ).isoformat()
+
+    # raw_xbee_frames encodings: size, and time taken by the gateway to
+    # decode a packet and encode it, and by a consumer to decode it and
+    # read the field it wants
+    import timeit
+    
+    xb = XBee(None)
+    timestamp = SYSTEM_TZ.localize(datetime.datetime.now())
+    
+    packets = (
+        ('zb_rx', 'rf_data',
+         '\x90\x00\x13\xa2\x00\x40\x32\xdc\xdc\xda\xe0\x01' + 'V:1234,I:0567\r\n'),
+        ('zb_rx_io_data', 'samples',
+         '\x92\x00\x13\xa2\x00\x40\x55\x6e\x7d\x52\xc1\x01' +
+         '\x01\x08\x00\x0e\x08\x00\x00\x00\x02P\x02\x06'),
+    )
+    
+    def gateway(packet, lazy, content_type):
+        frame = xb._split_response(packet, lazy)
+        frame['_timestamp'] = timestamp
+        
+        return serialize(frame, content_type)
+    
+    def consumer(body, content_type, field):
+        return deserialize(body, content_type)[field]
+    
+    def per_call(func, n = 20000):
+        return min(timeit.repeat(func, number = n, repeat = 3)) / n * 1e6
+    
+    print
+    print "%-14s %-6s %6s %12s %12s" % ('frame', 'format', 'bytes', 'gateway us', 'consumer us')
+    
+    for name, field, packet in packets:
+        for label, lazy, content_type in (('bson', False, CONTENT_TYPE_BSON),
+                                          ('xbee', True, CONTENT_TYPE_XBEE_FRAME)):
+            body = gateway(packet, lazy, content_type)
+            
+            print "%-14s %-6s %6d %12.1f %12.1f" % (
+                name, label, len(body),
+                per_call(lambda: gateway(packet, lazy, content_type)),
+                per_call(lambda: consumer(body, content_type, field)))
@@ -0,0 +1,206 @@
+#! /usr/bin/python
+"""
+test_batch_publisher.py
+
+Tests publishing queued messages in batches on a separate thread.
+"""
+import sys
+import time
+import threading
+import unittest
+from support.batch_publisher import BatchPublisher
+
+class TestBatchPublisher(unittest.TestCase):
+    """
+    BatchPublisher must publish every message it accepts, in order,
+    without ever blocking the submitter
+    """
+    
+    def setUp(self):
+        self.published = []
+        self.batches = []
+        self.pub = None
+    
+    def tearDown(self):
+        if self.pub is not None:
+            self.pub.stop(5)
+    
+    def start(self, publish = None, **kwargs):
+        self.pub = BatchPublisher(publish or self.published.append, **kwargs)
+        self.pub.start()
+        
+        return self.pub
+    
+    def test_order(self):
+        """
+        messages should be published in the order submitted
+        """
+        pub = self.start()
+        
+        for i in range(500):
+            self.assertTrue(pub.submit(i))
+        
+        pub.stop(5)
+        
+        self.assertEqual(self.published, range(500))
+        self.assertEqual(pub.stats()['published'], 500)
+        self.assertEqual(pub.pending(), 0)
+    
+    def test_overflow(self):
+        """
+        a full queue should discard and count messages rather than block
+        """
+        release = threading.Event()
+        
+        def blocked(msg):
+            release.wait()
+            self.published.append(msg)
+        
+        pub = self.start(blocked, max_pending = 10, batch_size = 1)
+        
+        start = time.time()
+        accepted = [pub.submit(i) for i in range(100)]
+        elapsed = time.time() - start
+        
+        release.set()
+        pub.stop(5)
+        
+        self.assertTrue(elapsed < 0.5, elapsed)
+        self.assertEqual(accepted.count(False), pub.overflowed)
+        self.assertTrue(pub.overflowed >= 89, pub.stats())
+        self.assertEqual(pub.published + pub.overflowed, 100)
+        self.assertEqual(self.published, sorted(self.published))
+    
+    def test_concurrent_overflow(self):
+        """
+        with several threads submitting into a full queue, every call
+        should be counted as submitted or overflowed
+        """
+        release = threading.Event()
+        
+        def blocked(msg):
+            release.wait()
+        
+        pub = self.start(blocked, max_pending = 10, batch_size = 1)
+        
+        def submitter():
+            for i in range(20000):
+                pub.submit(i)
+        
+        # switch threads as often as possible, to interleave the counting
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        
+        try:
+            threads = [threading.Thread(target = submitter) for i in range(4)]
+            
+            for t in threads:
+                t.start()
+            
+            for t in threads:
+                t.join()
+        finally:
+            sys.setcheckinterval(interval)
+            release.set()
+        
+        self.assertEqual(pub.submitted + pub.overflowed, 80000)
+    
+    def test_publish_failure(self):
+        """
+        a message whose publish raises should be counted as dropped, and
+        the rest published
+        """
+        def publish(msg):
+            if msg % 10 == 0:
+                raise IOError("broker went away")
+            
+            self.published.append(msg)
+        
+        pub = self.start(publish)
+        
+        for i in range(50):
+            pub.submit(i)
+        
+        pub.stop(5)
+        
+        self.assertEqual(pub.dropped, 5)
+        self.assertEqual(pub.published, 45)
+        self.assertEqual(len(self.published), 45)
+    
+    def test_batch_size(self):
+        """
+        no batch should be larger than batch_size
+        """
+        test = self
+        
+        class Recording(BatchPublisher):
+            def _publish_batch(self, batch):
+                test.batches.append(list(batch))
+                super(Recording, self)._publish_batch(batch)
+        
+        pub = self.pub = Recording(self.published.append, batch_size = 7)
+        
+        for i in range(50):
+            pub.submit(i)
+        
+        pub.start()
+        pub.stop(5)
+        
+        self.assertEqual(max(len(b) for b in self.batches), 7)
+        self.assertEqual(sum(self.batches, []), range(50))
+        self.assertEqual(pub.batches, len(self.batches))
+    
+    def test_flush_interval(self):
+        """
+        a partial batch should be published once flush_interval passes
+        """
+        pub = self.start(batch_size = 100, flush_interval = 0.05)
+        
+        pub.submit('a')
+        
+        deadline = time.time() + 2
+        while not self.published and time.time() < deadline:
+            time.sleep(0.01)
+        
+        self.assertEqual(self.published, ['a'])
+    
+    def test_stop_flushes(self):
+        """
+        stop should publish messages still queued
+        """
+        pub = BatchPublisher(self.published.append)
+        
+        for i in range(20):
+            pub.submit(i)
+        
+        pub.start()
+        pub.stop(5)
+        
+        self.assertFalse(pub.is_alive())
+        self.assertEqual(self.published, range(20))
+    
+    def test_idle(self):
+        """
+        idle should be called while no messages are queued, and an
+        exception from it shouldn't stop the thread
+        """
+        calls = []
+        
+        def idle():
+            calls.append(1)
+            raise ValueError("spool unreadable")
+        
+        pub = self.start(idle = idle)
+        
+        deadline = time.time() + 2
+        while len(calls) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        
+        pub.submit('a')
+        pub.stop(5)
+        
+        self.assertTrue(len(calls) >= 2)
+        self.assertEqual(self.published, ['a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+#! /usr/bin/python
+"""
+test_broker_connections.py
+
+Tests sharing broker connections between threads, with stand-ins for
+pika's connections and channels.
+"""
+import socket
+import threading
+import unittest
+
+try:
+    from support import broker_connections
+except ImportError:
+    # pika isn't installed
+    broker_connections = None
+
+class StandInChannel(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.published = []
+        self.return_callbacks = []
+    
+    def add_on_return_callback(self, callback):
+        self.return_callbacks.append(callback)
+    
+    def basic_publish(self, **kwargs):
+        if self.conn.closed:
+            raise socket.error("connection reset")
+        
+        self.published.append(kwargs)
+
+class StandInConnection(object):
+    def __init__(self, params):
+        self.closed = False
+    
+    def channel(self):
+        return StandInChannel(self)
+    
+    def close(self):
+        self.closed = True
+
+class StandInParams(object):
+    def __init__(self, host):
+        self.host = host
+        self.port = 5672
+        self.virtual_host = '/'
+
+def in_thread(func):
+    """returns what func returns when called on a thread of its own"""
+    
+    result = []
+    
+    t = threading.Thread(target = lambda: result.append(func()))
+    t.start()
+    t.join()
+    
+    return result[0]
+
+@unittest.skipIf(broker_connections is None, "pika is not installed")
+class TestConnectionManager(unittest.TestCase):
+    """
+    ConnectionManager must open one consuming connection per thread and
+    one publishing connection shared by all, reopening them when lost
+    """
+    
+    def setUp(self):
+        self.attempts = []
+        self.refuse = False
+        
+        self.manager = broker_connections.ConnectionManager(None, connect = self.connect)
+    
+    def tearDown(self):
+        self.manager.close()
+    
+    def connect(self, params):
+        self.attempts.append(params)
+        
+        if self.refuse:
+            raise socket.error("connection refused")
+        
+        return StandInConnection(params)
+    
+    def test_consumer_connections(self):
+        """
+        consuming channels should share their thread's connection, and
+        other threads get their own
+        """
+        frame_chan = self.manager.consumer_channel()
+        rpc_chan = self.manager.consumer_channel()
+        other = in_thread(self.manager.consumer_channel)
+        
+        self.assertTrue(frame_chan.conn is rpc_chan.conn)
+        self.assertFalse(other.conn is frame_chan.conn)
+        self.assertEqual(self.manager.stats()['consuming'], 2)
+    
+    def test_drop_consumer_connection(self):
+        """
+        a dropped consuming connection should be closed and replaced on
+        the next request
+        """
+        chan = self.manager.consumer_channel()
+        
+        self.manager.drop_consumer_connection()
+        
+        self.assertTrue(chan.conn.closed)
+        self.assertFalse(self.manager.consumer_channel().conn is chan.conn)
+        self.assertEqual(self.manager.opened, 2)
+    
+    def test_shared_publishing_connection(self):
+        """
+        publishing channels on every thread should share one connection,
+        opened when first used
+        """
+        rpc_chan = self.manager.publishing_channel()
+        publisher_chan = self.manager.publishing_channel()
+        
+        self.assertEqual(self.manager.opened, 0)
+        
+        rpc_chan.basic_publish(routing_key = 'xbee_tx')
+        publisher_chan.basic_publish(routing_key = 'sensor_data')
+        in_thread(lambda: self.manager.publishing_channel().basic_publish(routing_key = 'reply'))
+        
+        self.assertTrue(rpc_chan._chan.conn is publisher_chan._chan.conn)
+        self.assertEqual(self.manager.opened, 1)
+        self.assertEqual(rpc_chan._chan.published, [{'routing_key' : 'xbee_tx'}])
+    
+    def test_publish_reconnects(self):
+        """
+        a publish on a lost connection should reopen it, with the
+        channel's return callbacks, and succeed
+        """
+        chan = self.manager.publishing_channel()
+        callback = lambda *args: None
+        chan.add_on_return_callback(callback)
+        
+        chan.basic_publish(routing_key = 'a')
+        lost = chan._chan
+        lost.conn.close()
+        
+        chan.basic_publish(routing_key = 'b')
+        
+        self.assertFalse(chan._chan is lost)
+        self.assertEqual(chan._chan.published, [{'routing_key' : 'b'}])
+        self.assertEqual(chan._chan.return_callbacks, [callback])
+        self.assertEqual(self.manager.reconnects, 1)
+        self.assertEqual(self.manager.opened, 2)
+    
+    def test_reconnect_interval(self):
+        """
+        while the broker is down, reconnecting should be attempted no more
+        often than RECONNECT_INTERVAL
+        """
+        chan = self.manager.publishing_channel()
+        self.refuse = True
+        
+        self.assertRaises(socket.error, chan.basic_publish, routing_key = 'a')
+        self.assertRaises(broker_connections.CONNECTION_ERRORS,
+                          chan.basic_publish, routing_key = 'a')
+        self.assertEqual(len(self.attempts), 1)
+    
+    def test_close(self):
+        """
+        close should close every connection, and channels reconnect if
+        used again
+        """
+        consuming = self.manager.consumer_channel()
+        chan = self.manager.publishing_channel()
+        chan.basic_publish(routing_key = 'a')
+        publishing = chan._chan
+        
+        self.manager.close()
+        
+        self.assertTrue(consuming.conn.closed)
+        self.assertTrue(publishing.conn.closed)
+        self.assertEqual(self.manager.stats()['consuming'], 0)
+        self.assertEqual(self.manager.stats()['publishing'], 0)
+        
+        chan.basic_publish(routing_key = 'b')
+        self.assertEqual(chan._chan.published, [{'routing_key' : 'b'}])
+
+@unittest.skipIf(broker_connections is None, "pika is not installed")
+class TestGetManager(unittest.TestCase):
+    """
+    get_manager must return one manager per broker
+    """
+    
+    def test_per_broker(self):
+        """
+        the same broker should get the same manager, another broker
+        another
+        """
+        a = broker_connections.get_manager(StandInParams('broker_a'))
+        
+        self.assertTrue(broker_connections.get_manager(StandInParams('broker_a')) is a)
+        self.assertFalse(broker_connections.get_manager(StandInParams('broker_b')) is a)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,330 @@
+#! /usr/bin/python
+"""
+test_confirm_publisher.py
+
+Tests publishing batches with publisher confirms against a stand-in
+broker that nacks messages, drops connections and fails part way through
+a batch.
+"""
+import sys
+import time
+import random
+import threading
+import socket
+import logging
+import unittest
+from support.confirm_publisher import ConfirmPublisher
+
+class StandInMethod(object):
+    def __init__(self, name, delivery_tag):
+        self.NAME = name
+        self.delivery_tag = delivery_tag
+        self.multiple = False
+
+class StandInFrame(object):
+    def __init__(self, method):
+        self.method = method
+
+class StandInBroker(object):
+    """
+    Stores a message when its ack is delivered; nack(body) decides which
+    are nacked, and a share of publishes drop the connection
+    """
+    
+    def __init__(self, nack = lambda body: False, loss_rate = 0):
+        self.nack = nack
+        self.loss_rate = loss_rate
+        self.random = random.Random(1)
+        
+        # confirms delivered before the next process_data_events fails
+        self.fail_after = None
+        
+        # bodies stored, and published to the broker in all
+        self.stored = []
+        self.received = 0
+        self.connections = 0
+    
+    def connect(self):
+        self.connections += 1
+        
+        return StandInConnection(self)
+
+class StandInChannel(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.callback = None
+        self.tag = 0
+    
+    def confirm_delivery(self, callback):
+        self.callback = callback
+    
+    def basic_publish(self, exchange, routing_key, properties, body):
+        broker = self.conn.broker
+        
+        if self.conn.closed or (broker.random.random() < broker.loss_rate):
+            self.conn.closed = True
+            raise socket.error("connection reset by stand-in")
+        
+        broker.received += 1
+        self.tag += 1
+        
+        if broker.nack(body):
+            name = 'Basic.Nack'
+        else:
+            name = 'Basic.Ack'
+        
+        self.conn.confirms.append((self.callback, StandInFrame(StandInMethod(name, self.tag)), body))
+
+class StandInConnection(object):
+    def __init__(self, broker):
+        self.broker = broker
+        self.closed = False
+        self.confirms = []
+    
+    def channel(self):
+        return StandInChannel(self)
+    
+    def process_data_events(self):
+        broker = self.broker
+        
+        time.sleep(0.001)
+        
+        while self.confirms:
+            if broker.fail_after == 0:
+                broker.fail_after = None
+                self.close()
+                
+                raise socket.error("connection reset by stand-in")
+            
+            if broker.fail_after is not None:
+                broker.fail_after -= 1
+            
+            callback, frame, body = self.confirms.pop(0)
+            
+            if frame.method.NAME == 'Basic.Ack':
+                broker.stored.append(body)
+            
+            callback(frame)
+    
+    def close(self):
+        self.closed = True
+        self.confirms = []
+
+def message(i):
+    return ('sensor_data', 'temperature', None, 'reading %d' % i)
+
+class TestConfirmPublisher(unittest.TestCase):
+    """
+    ConfirmPublisher must get every message confirmed once, or count it
+    """
+    
+    def setUp(self):
+        # dropped messages are logged
+        logging.getLogger('support.batch_publisher.ConfirmPublisher').setLevel(logging.CRITICAL)
+    
+    def tearDown(self):
+        logging.getLogger('support.batch_publisher.ConfirmPublisher').setLevel(logging.NOTSET)
+    
+    def burst(self, pub, readings):
+        """submits readings as fast as possible, as a bursty driver might"""
+        for i in range(readings):
+            pub.submit(message(i))
+    
+    def test_flaky_broker(self):
+        """
+        with some messages nacked and connections dropped, each message
+        should be stored once, or counted as dropped
+        """
+        broker = StandInBroker(
+            nack = lambda body: broker.random.random() < 0.05,
+            loss_rate = 0.002
+        )
+        
+        pub = ConfirmPublisher(broker.connect, max_pending = 5000)
+        pub.RETRY_INTERVAL = 0.01
+        pub.start()
+        
+        self.burst(pub, 5000)
+        
+        pub.stop()
+        
+        stats = pub.stats()
+        
+        self.assertEqual(stats['published'] + stats['dropped'] + stats['overflowed'], 5000)
+        self.assertEqual(len(broker.stored), stats['published'])
+        self.assertEqual(len(set(broker.stored)), len(broker.stored))
+        self.assertTrue(stats['nacked'] and stats['retried'] and stats['reconnects'], stats)
+    
+    def test_refusing_broker(self):
+        """
+        with every message nacked, each should be dropped after its retries
+        or on the way in
+        """
+        broker = StandInBroker(nack = lambda body: True)
+        
+        pub = ConfirmPublisher(broker.connect, max_pending = 100)
+        pub.RETRY_INTERVAL = 0.01
+        pub.start()
+        
+        self.burst(pub, 5000)
+        
+        pub.stop()
+        
+        stats = pub.stats()
+        
+        self.assertEqual(broker.stored, [])
+        self.assertEqual(stats['published'], 0)
+        self.assertEqual(stats['dropped'] + stats['overflowed'], 5000)
+    
+    def test_concurrent_submit(self):
+        """
+        with hosted drivers and RPC workers submitting into a full queue at
+        once, every call should be counted as submitted or overflowed
+        """
+        broker = StandInBroker()
+        
+        # not started, so the queue stays full
+        pub = ConfirmPublisher(broker.connect, max_pending = 10)
+        
+        def submitter():
+            for i in range(20000):
+                pub.submit(message(i))
+        
+        # switch threads as often as possible, to interleave the counting
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        
+        try:
+            threads = [threading.Thread(target = submitter) for i in range(4)]
+            
+            for t in threads:
+                t.start()
+            
+            for t in threads:
+                t.join()
+        finally:
+            sys.setcheckinterval(interval)
+        
+        stats = pub.stats()
+        
+        self.assertEqual(stats['submitted'], 10)
+        self.assertEqual(stats['submitted'] + stats['overflowed'], 80000)
+    
+    def test_fails_part_way(self):
+        """
+        when the connection fails part way through a batch, only the
+        messages not yet confirmed should be published again
+        """
+        broker = StandInBroker()
+        broker.fail_after = 4
+        
+        pub = ConfirmPublisher(broker.connect)
+        pub.RETRY_INTERVAL = 0
+        
+        pub._publish_batch([message(i) for i in range(10)])
+        
+        stats = pub.stats()
+        
+        self.assertEqual(sorted(broker.stored), sorted(message(i)[3] for i in range(10)))
+        self.assertEqual(broker.received, 16)
+        self.assertEqual(stats['published'], 10)
+        self.assertEqual(stats['retried'], 6)
+        self.assertEqual(stats['reconnects'], 1)
+    
+    def test_fails_before_publishing(self):
+        """
+        when the connection fails while publishing a batch, the messages
+        not published should be retried along with the unconfirmed ones
+        """
+        broker = StandInBroker(loss_rate = 1)
+        
+        pub = ConfirmPublisher(broker.connect, max_attempts = 2)
+        pub.RETRY_INTERVAL = 0
+        
+        pub._publish_batch([message(i) for i in range(10)])
+        
+        stats = pub.stats()
+        
+        self.assertEqual(broker.received, 0)
+        self.assertEqual(stats['retried'], 10)
+        self.assertEqual(stats['dropped'], 10)
+    
+    def test_backoff_does_not_block(self):
+        """
+        while failed messages wait to be retried, new ones should still be
+        taken from the queue; stop should retry them without waiting
+        """
+        broker = StandInBroker(nack = lambda body: True)
+        
+        pub = ConfirmPublisher(broker.connect, max_pending = 100)
+        pub.RETRY_INTERVAL = 10
+        pub.start()
+        
+        for i in range(10):
+            for j in range(50):
+                pub.submit(message(i * 50 + j))
+            
+            time.sleep(0.01)
+        
+        deadline = time.time() + 5
+        
+        while pub.nacked < 500:
+            self.assertTrue(time.time() < deadline, pub.stats())
+            time.sleep(0.01)
+        
+        stats = pub.stats()
+        
+        self.assertEqual(stats['overflowed'], 0)
+        self.assertEqual(stats['retrying'], 500)
+        
+        start = time.time()
+        pub.stop(5)
+        
+        self.assertTrue(time.time() - start < 5)
+        self.assertFalse(pub.is_alive())
+        
+        stats = pub.stats()
+        
+        self.assertEqual(stats['dropped'], 500)
+        self.assertEqual(stats['retrying'], 0)
+        self.assertEqual(broker.received, 1500)
+    
+    def test_retried_while_idle(self):
+        """
+        failed messages should be retried once due, with nothing more
+        submitted
+        """
+        first = set()
+        
+        def nack_first(body):
+            if body in first:
+                return False
+            
+            first.add(body)
+            
+            return True
+        
+        broker = StandInBroker(nack = nack_first)
+        
+        pub = ConfirmPublisher(broker.connect)
+        pub.RETRY_INTERVAL = 0.05
+        pub.start()
+        
+        self.burst(pub, 10)
+        
+        deadline = time.time() + 5
+        
+        while pub.published < 10:
+            self.assertTrue(time.time() < deadline, pub.stats())
+            time.sleep(0.01)
+        
+        pub.stop()
+        
+        stats = pub.stats()
+        
+        self.assertEqual(len(broker.stored), 10)
+        self.assertEqual(stats['retried'], 10)
+        self.assertEqual(stats['nacked'], 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+#! /usr/bin/python
+"""
+test_coordinators.py
+
+Tests routing requests between coordinator radios, with fake radios on
+pseudo-terminals.
+"""
+import time
+import select
+import unittest
+from xbee.frame import APIFrame, FrameDecoder
+from xbee.tests.Fake import FakePtyDevice
+from support.coordinators import Coordinator, CoordinatorRouter
+from support import tx_scheduler
+
+DEVICES_PER_RADIO = 5
+
+def device_addr(radio, i):
+    return '\x00\x13\xa2\x00\x40\x00' + chr(radio) + chr(i)
+
+def wait_for(condition, timeout = 5):
+    deadline = time.time() + timeout
+    
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    
+    return condition()
+
+class FakeCoordinator(object):
+    """
+    Stands in for a Coordinator in routing tests
+    """
+    
+    def __init__(self, name):
+        self.name = name
+
+class TestCoordinatorRouter(unittest.TestCase):
+    """
+    CoordinatorRouter must route each device to the coordinator that last
+    heard from it
+    """
+    
+    def setUp(self):
+        self.radios = [FakeCoordinator('radio0'), FakeCoordinator('radio1')]
+        self.router = CoordinatorRouter(self.radios)
+    
+    def test_default(self):
+        """
+        devices not heard from should go to the first coordinator
+        """
+        self.assertTrue(self.router.route(device_addr(9, 9)) is self.radios[0])
+    
+    def test_learn(self):
+        """
+        a device should follow the coordinator that last heard from it
+        """
+        addr = device_addr(1, 0)
+        
+        self.router.learn(addr, self.radios[1])
+        self.assertTrue(self.router.route(addr) is self.radios[1])
+        
+        self.router.learn(addr, self.radios[0])
+        self.assertTrue(self.router.route(addr) is self.radios[0])
+        
+        self.assertEqual(self.router.stats(), {'radio0' : 1, 'radio1' : 0})
+
+class TestCoordinators(unittest.TestCase):
+    """
+    Requests must be written to the radio that can reach their device,
+    and replies matched to requests on the radio they arrive on
+    """
+    
+    def setUp(self):
+        self.received = []
+        self.ports = [FakePtyDevice() for radio in range(3)]
+        self.coordinators = [
+            Coordinator('radio%d' % radio, port, self.on_frame, rate = 1000, burst = 100)
+            for radio, port in enumerate(self.ports)
+        ]
+        
+        self.router = CoordinatorRouter(self.coordinators)
+        self.decoders = [FrameDecoder() for port in self.ports]
+        
+        for c in self.coordinators:
+            c.start()
+    
+    def tearDown(self):
+        for c in self.coordinators:
+            c.stop()
+        
+        for port in self.ports:
+            port.close()
+    
+    def on_frame(self, coordinator, frame):
+        if 'source_addr_long' in frame:
+            self.router.learn(frame['source_addr_long'], coordinator)
+        
+        self.received.append((coordinator.name, frame))
+    
+    def report_in(self):
+        """each device sends a frame through its own radio"""
+        
+        for radio, port in enumerate(self.ports):
+            for i in range(DEVICES_PER_RADIO):
+                port.write_master(APIFrame(
+                    '\x90' + device_addr(radio, i) + '\xff\xfe\x01' + 'hello').output())
+        
+        self.assertTrue(wait_for(lambda: len(self.received) == 3 * DEVICES_PER_RADIO))
+    
+    def read_written(self, count):
+        """returns {radio:[frame, ...]} once count frames are written"""
+        
+        written = dict((radio, []) for radio in range(len(self.ports)))
+        deadline = time.time() + 5
+        
+        while sum(len(w) for w in written.values()) < count and time.time() < deadline:
+            readable = select.select([p.master for p in self.ports], [], [], 0.1)[0]
+            
+            for radio, port in enumerate(self.ports):
+                if port.master in readable:
+                    self.decoders[radio].feed(port.read_master(4096))
+                    
+                    frame = self.decoders[radio].next_frame()
+                    while frame is not None:
+                        written[radio].append(frame.tobytes())
+                        frame = self.decoders[radio].next_frame()
+        
+        return written
+    
+    def send_data(self, dest, context, **kwargs):
+        return self.router.route(dest).submit(
+            dest, {'method' : 'send_data', 'dest' : dest, 'data' : 'ping'}, context, **kwargs)
+    
+    def test_routing(self):
+        """
+        requests should be written to the port of the radio their device
+        reported in on; unknown devices to the first
+        """
+        self.report_in()
+        
+        self.assertEqual(self.router.stats(),
+                         dict(('radio%d' % r, DEVICES_PER_RADIO) for r in range(3)))
+        
+        for radio in range(3):
+            for i in range(DEVICES_PER_RADIO):
+                self.send_data(device_addr(radio, i), (radio, i))
+        
+        stranger = device_addr(9, 9)
+        self.send_data(stranger, 'stranger')
+        
+        written = self.read_written(3 * DEVICES_PER_RADIO + 1)
+        
+        for radio in range(3):
+            expected = [device_addr(radio, i) for i in range(DEVICES_PER_RADIO)]
+            
+            if radio == 0:
+                expected.append(stranger)
+            
+            self.assertEqual(sorted(f[2:10] for f in written[radio]), sorted(expected))
+    
+    def test_reply(self):
+        """
+        a transmit status should answer the request sent through its radio
+        with that frame id, once
+        """
+        self.report_in()
+        
+        for radio in range(3):
+            self.send_data(device_addr(radio, 0), radio)
+        
+        written = self.read_written(3)
+        frame_id = written[1][0][1]
+        
+        self.ports[1].write_master(APIFrame('\x8b' + frame_id + '\xff\xfe\x00\x00\x00').output())
+        
+        self.assertTrue(wait_for(
+            lambda: [f for name, f in self.received if f['id'] == 'zb_tx_status']))
+        
+        name, status = self.received[-1]
+        self.assertEqual(name, 'radio1')
+        
+        context, latency = self.coordinators[1].take_reply(status['frame_id'])
+        
+        self.assertEqual(context, 1)
+        self.assertTrue(latency is not None)
+        self.assertEqual(self.coordinators[1].take_reply(status['frame_id']), None)
+        self.assertEqual(self.coordinators[1].tx_stats()['in_flight'], 0)
+        self.assertEqual(self.coordinators[0].tx_stats()['in_flight'], 1)
+    
+    def test_coalesce(self):
+        """
+        a request superseded through its coalesce key should have its
+        context returned
+        """
+        c = Coordinator('idle', FakePtyDevice(), self.on_frame)
+        dest = device_addr(0, 0)
+        req = {'method' : 'send_data', 'dest' : dest, 'data' : 'M1'}
+        
+        self.assertEqual(c.submit(dest, req, 'first', coalesce_key = 'meter',
+                                  priority = tx_scheduler.PRIORITY_TELEMETRY), None)
+        self.assertEqual(c.submit(dest, req, 'second', coalesce_key = 'meter',
+                                  priority = tx_scheduler.PRIORITY_TELEMETRY), 'first')
+    
+    def test_expiry(self):
+        """
+        a request without a reply should be reaped once it expires,
+        freeing its frame id
+        """
+        c = Coordinator('radio9', self.ports[0], self.on_frame, request_timeout = 0.1)
+        
+        self.coordinators[0].stop()
+        self.coordinators[0] = c
+        c.start()
+        
+        c.submit(device_addr(0, 0),
+                 {'method' : 'send_data', 'dest' : device_addr(0, 0), 'data' : 'ping'}, 'ctx')
+        
+        self.assertTrue(wait_for(lambda: c.tx_stats()['reaped'] == 1))
+        self.assertEqual(c.tx_stats()['in_flight'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
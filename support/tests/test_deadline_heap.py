@@ -0,0 +1,212 @@
+#! /usr/bin/python
+"""
+test_deadline_heap.py
+
+Tests expiring keys by deadline, directly and from a timer thread.
+"""
+import random
+import threading
+import unittest
+from support.deadline_heap import DeadlineHeap, DeadlineTimer, monotonic
+
+class TestMonotonic(unittest.TestCase):
+    """
+    monotonic must never go backwards
+    """
+    
+    def test_non_decreasing(self):
+        """
+        successive readings should never decrease
+        """
+        readings = [monotonic() for i in range(1000)]
+        
+        self.assertEqual(readings, sorted(readings))
+
+class TestDeadlineHeap(unittest.TestCase):
+    """
+    DeadlineHeap must return each live key once, when its deadline passes
+    """
+    
+    def setUp(self):
+        self.heap = DeadlineHeap()
+    
+    def test_order(self):
+        """
+        keys should expire in deadline order, and only once due
+        """
+        self.heap.add('b', 2.0)
+        self.heap.add('a', 1.0)
+        self.heap.add('c', 3.0)
+        
+        self.assertEqual(self.heap.next_deadline(), 1.0)
+        self.assertEqual(self.heap.pop_expired(0.5), [])
+        self.assertEqual(self.heap.pop_expired(2.0), ['a', 'b'])
+        self.assertEqual(len(self.heap), 1)
+        self.assertTrue('c' in self.heap)
+        self.assertFalse('a' in self.heap)
+    
+    def test_same_deadline(self):
+        """
+        keys with the same deadline should expire in the order added,
+        whatever the keys are
+        """
+        keys = [object(), None, ('x', 1), 'y']
+        
+        for key in keys:
+            self.heap.add(key, 1.0)
+        
+        self.assertEqual(self.heap.pop_expired(1.0), keys)
+    
+    def test_cancel(self):
+        """
+        a cancelled key should not expire, and cancelling an absent key
+        should do nothing
+        """
+        self.heap.add('a', 1.0)
+        self.heap.add('b', 2.0)
+        
+        self.heap.cancel('a')
+        self.heap.cancel('missing')
+        
+        self.assertEqual(self.heap.next_deadline(), 2.0)
+        self.assertEqual(self.heap.pop_expired(5.0), ['b'])
+        self.assertEqual(self.heap.next_deadline(), None)
+    
+    def test_move(self):
+        """
+        adding a key again should move it to its new deadline
+        """
+        self.heap.add('a', 1.0)
+        self.heap.add('a', 5.0)
+        
+        self.assertEqual(self.heap.pop_expired(2.0), [])
+        self.assertEqual(len(self.heap), 1)
+        self.assertEqual(self.heap.pop_expired(5.0), ['a'])
+    
+    def test_many(self):
+        """
+        thousands of keys, half cancelled, should expire exactly once each
+        """
+        n = 5000
+        
+        for i in range(n):
+            self.heap.add(i, random.uniform(0, 120))
+        
+        for i in range(0, n, 2):
+            self.heap.cancel(i)
+            self.assertEqual(self.heap.pop_expired(-1), [])
+        
+        self.assertEqual(len(self.heap), n / 2)
+        self.assertEqual(sorted(self.heap.pop_expired(121)), range(1, n, 2))
+        self.assertEqual(len(self.heap), 0)
+    
+    def test_cancelled_entries_bounded(self):
+        """
+        cancelled entries shouldn't accumulate while few keys are live
+        """
+        for i in range(10000):
+            self.heap.add(i, 1.0)
+            self.heap.cancel(i)
+        
+        self.assertEqual(len(self.heap), 0)
+        self.assertTrue(len(self.heap._DeadlineHeap__heap) <= 130)
+
+class TestDeadlineTimer(unittest.TestCase):
+    """
+    DeadlineTimer must call back each key promptly once its deadline passes
+    """
+    
+    def setUp(self):
+        self.fired = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.expected = None
+        
+        self.timer = DeadlineTimer(self.on_expiry)
+        self.timer.start()
+    
+    def tearDown(self):
+        self.timer.stop()
+        self.timer.join(5)
+    
+    def on_expiry(self, key):
+        with self.lock:
+            self.fired.append((key, monotonic()))
+            
+            if len(self.fired) == self.expected:
+                self.done.set()
+    
+    def test_expiry(self):
+        """
+        keys should be called back at their deadlines, in order
+        """
+        now = monotonic()
+        self.expected = 3
+        
+        self.timer.add('c', now + 0.15)
+        self.timer.add('a', now + 0.05)
+        self.timer.add('b', now + 0.1)
+        
+        self.assertTrue(self.done.wait(5) or self.done.is_set())
+        self.assertEqual([key for key, at in self.fired], ['a', 'b', 'c'])
+        self.assertTrue(self.fired[0][1] >= now + 0.05)
+        self.assertEqual(self.timer.expired, 3)
+        self.assertEqual(len(self.timer), 0)
+    
+    def test_cancel(self):
+        """
+        cancelled keys should never be called back
+        """
+        now = monotonic()
+        n = 2000
+        self.expected = n / 2
+        
+        for i in range(n):
+            self.timer.add(i, now + random.uniform(0.1, 0.3))
+        
+        for i in range(0, n, 2):
+            self.timer.cancel(i)
+        
+        self.assertTrue(self.done.wait(10) or self.done.is_set())
+        self.assertEqual(sorted(key for key, at in self.fired), range(1, n, 2))
+    
+    def test_earlier_deadline_wakes(self):
+        """
+        a key added with an earlier deadline should wake the thread
+        """
+        now = monotonic()
+        self.expected = 1
+        
+        self.timer.add('late', now + 60)
+        self.timer.add('soon', now + 0.05)
+        
+        self.assertTrue(self.done.wait(5) or self.done.is_set())
+        self.assertEqual([key for key, at in self.fired], ['soon'])
+    
+    def test_callback_exception(self):
+        """
+        an exception from the callback should be logged, not stop the
+        thread
+        """
+        def on_expiry(key):
+            if key == 'bad':
+                raise ValueError(key)
+            
+            self.on_expiry(key)
+        
+        self.timer.stop()
+        self.timer = DeadlineTimer(on_expiry)
+        self.timer.start()
+        
+        now = monotonic()
+        self.expected = 1
+        
+        self.timer.add('bad', now)
+        self.timer.add('good', now + 0.05)
+        
+        self.assertTrue(self.done.wait(5) or self.done.is_set())
+        self.assertEqual([key for key, at in self.fired], ['good'])
+        self.assertEqual(self.timer.expired, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#! /usr/bin/python
+"""
+test_dedup_window.py
+
+Tests recognizing messages repeated within a window of seconds.
+"""
+import unittest
+from support.dedup_window import DedupWindow
+
+class TestDedupWindow(unittest.TestCase):
+    """
+    DedupWindow must report a fingerprint as seen for at least a window
+    after it was first seen, and never after two
+    """
+    
+    def setUp(self):
+        self.dedup = DedupWindow(0.5)
+    
+    def test_within_window(self):
+        """
+        a repeat within the window should be a duplicate; other
+        fingerprints shouldn't
+        """
+        self.assertFalse(self.dedup.seen('a', now = 0.0))
+        self.assertTrue(self.dedup.seen('a', now = 0.4))
+        self.assertFalse(self.dedup.seen('b', now = 0.4))
+        self.assertEqual(self.dedup.duplicates, 1)
+    
+    def test_window_edges(self):
+        """
+        a fingerprint should be remembered at exactly one window, and
+        forgotten at two
+        """
+        self.assertFalse(self.dedup.seen('a', now = 0.0))
+        self.assertTrue(self.dedup.seen('a', now = 0.5))
+        
+        self.assertFalse(self.dedup.seen('b', now = 10.0))
+        self.assertFalse(self.dedup.seen('b', now = 11.0))
+    
+    def test_between_windows(self):
+        """
+        fingerprints carried into the previous generation should be found
+        until it is replaced
+        """
+        self.assertFalse(self.dedup.seen('a', now = 0.0))
+        self.assertFalse(self.dedup.seen('b', now = 0.6))
+        
+        self.assertTrue(self.dedup.seen('a', now = 0.9))
+        self.assertTrue(self.dedup.seen('b', now = 1.0))
+        
+        self.assertFalse(self.dedup.seen('a', now = 1.55))
+        self.assertTrue(self.dedup.seen('b', now = 1.55))
+    
+    def test_idle_gaps(self):
+        """
+        a fingerprint repeated after an idle gap longer than the window
+        should never be a duplicate, however many gaps
+        """
+        results = [self.dedup.seen('a', now = float(t)) for t in range(0, 25, 5)]
+        
+        self.assertEqual(results, [False] * 5)
+        self.assertEqual(self.dedup.duplicates, 0)
+    
+    def test_gap_just_over_window(self):
+        """
+        a repeat just over two windows after the last rotation should not
+        be a duplicate
+        """
+        self.assertFalse(self.dedup.seen('a', now = 0.0))
+        self.assertFalse(self.dedup.seen('a', now = 1.01))
+    
+    def test_max_entries(self):
+        """
+        memory should be bounded however many fingerprints arrive within a
+        window, while recent ones are still found
+        """
+        dedup = DedupWindow(60, max_entries = 100)
+        
+        for i in range(10000):
+            dedup.seen(i, now = 0.0)
+        
+        self.assertTrue(len(dedup) <= 200)
+        self.assertTrue(dedup.seen(9999, now = 0.0))
+        self.assertEqual(dedup.stats(), {'duplicates' : 1, 'remembered' : len(dedup)})
+    
+    def test_default_clock(self):
+        """
+        now should default to the current time
+        """
+        self.assertFalse(self.dedup.seen('a'))
+        self.assertTrue(self.dedup.seen('a'))
+
+if __name__ == '__main__':
+    unittest.main()
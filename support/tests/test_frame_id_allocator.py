@@ -0,0 +1,105 @@
+#! /usr/bin/python
+"""
+test_frame_id_allocator.py
+
+Tests allocation of XBee API frame ids.
+"""
+import threading
+import unittest
+from support.frame_id_allocator import FrameIdAllocator
+
+class TestFrameIdAllocator(unittest.TestCase):
+    """
+    FrameIdAllocator must never hand out an id that is in use
+    """
+    
+    def setUp(self):
+        self.alloc = FrameIdAllocator()
+    
+    def test_exhaustion(self):
+        """
+        all 255 non-zero ids should be handed out once, then None
+        """
+        ids = [self.alloc.allocate() for i in range(255)]
+        
+        self.assertFalse(None in ids)
+        self.assertFalse('\x00' in ids)
+        self.assertEqual(len(set(ids)), 255)
+        self.assertEqual(self.alloc.allocate(), None)
+        self.assertEqual(self.alloc.in_flight(), 255)
+        self.assertEqual(self.alloc.utilization(), 1.0)
+    
+    def test_release(self):
+        """
+        a released id should be the only one available once all are used
+        """
+        ids = [self.alloc.allocate() for i in range(255)]
+        
+        self.alloc.release(ids[10])
+        
+        self.assertEqual(self.alloc.allocate(), ids[10])
+        self.assertEqual(self.alloc.allocate(), None)
+    
+    def test_least_recently_released(self):
+        """
+        ids should be reused in the order they were released
+        """
+        ids = [self.alloc.allocate() for i in range(255)]
+        
+        self.alloc.release(ids[5])
+        self.alloc.release(ids[0])
+        
+        self.assertEqual(self.alloc.allocate(), ids[5])
+        self.assertEqual(self.alloc.allocate(), ids[0])
+    
+    def test_release_free_id(self):
+        """
+        releasing an id twice, or one never allocated, should do nothing
+        """
+        frame_id = self.alloc.allocate()
+        
+        self.alloc.release(frame_id)
+        self.alloc.release(frame_id)
+        self.alloc.release('\x00')
+        
+        self.assertEqual(self.alloc.in_flight(), 0)
+        self.assertEqual(len(set(self.alloc.allocate() for i in range(255))), 255)
+        self.assertEqual(self.alloc.allocate(), None)
+    
+    def test_ids(self):
+        """
+        only the ids given should be allocated
+        """
+        alloc = FrameIdAllocator(range(1, 4))
+        
+        self.assertEqual(sorted(alloc.allocate() for i in range(3)),
+                         ['\x01', '\x02', '\x03'])
+        self.assertEqual(alloc.allocate(), None)
+        self.assertAlmostEqual(alloc.utilization(), 1.0)
+    
+    def test_threads(self):
+        """
+        concurrent allocation should never hand out an id twice
+        """
+        allocated = []
+        
+        def allocate():
+            for i in range(50):
+                frame_id = self.alloc.allocate()
+                
+                if frame_id is not None:
+                    allocated.append(frame_id)
+        
+        threads = [threading.Thread(target = allocate) for i in range(8)]
+        
+        for t in threads:
+            t.start()
+        
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(len(allocated), 255)
+        self.assertEqual(len(set(allocated)), 255)
+
+if __name__ == '__main__':
+    unittest.main()
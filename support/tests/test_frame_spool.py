@@ -0,0 +1,171 @@
+#! /usr/bin/python
+"""
+test_frame_spool.py
+
+Tests spooling frames to disk while a stand-in for the broker is down,
+and replaying them once it's back.
+"""
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+import cPickle as pickle
+from support.frame_spool import FrameSpool
+
+class StandInBroker(object):
+    """
+    Refuses messages while down, as a lost connection would
+    """
+    
+    def __init__(self):
+        self.up = False
+        self.received = []
+    
+    def basic_publish(self, parts):
+        if not self.up:
+            raise IOError("connection refused")
+        
+        self.received.append(parts)
+
+class TestFrameSpool(unittest.TestCase):
+    """
+    FrameSpool must give back every record it accepts, in order, once
+    """
+    
+    ROUTING_KEY = 'zb_rx.00:13:a2:00:40:32:dc:dc'
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'dispatcher.spool')
+        self.spools = []
+    
+    def tearDown(self):
+        for spool in self.spools:
+            try:
+                spool.close()
+            except ValueError:
+                # already closed
+                pass
+        
+        shutil.rmtree(self.tmpdir)
+    
+    def open(self, path = None, **kwargs):
+        spool = FrameSpool(path or self.path, **kwargs)
+        self.spools.append(spool)
+        
+        return spool
+    
+    def test_broker_outage(self):
+        """
+        frames spooled while the broker is down should be replayed in
+        order with their original timestamps, surviving a restart and a
+        second outage part way through replaying
+        """
+        frames = 20000
+        broker = StandInBroker()
+        spool = self.open(size = 16 * 1024 * 1024)
+        
+        start_ts = datetime.datetime(2012, 1, 1)
+        frame = {'id' : 'zb_rx', 'rf_data' : 'V:1234,I:0567\r\n'}
+        
+        for i in xrange(frames):
+            frame['_timestamp'] = start_ts + datetime.timedelta(seconds = i / 10)
+            record = ('raw_xbee_frames', self.ROUTING_KEY, 'application/x-python-pickle',
+                      '', pickle.dumps(frame, pickle.HIGHEST_PROTOCOL))
+            
+            try:
+                broker.basic_publish(record)
+            except IOError:
+                self.assertTrue(spool.append(record))
+        
+        spool.close()
+        spool = self.open()
+        
+        self.assertEqual(len(spool), frames)
+        
+        broker.up = True
+        self.assertEqual(spool.replay(broker.basic_publish, limit = 1000), 1000)
+        
+        broker.up = False
+        self.assertRaises(IOError, spool.replay, broker.basic_publish)
+        self.assertEqual(len(spool), frames - 1000)
+        
+        broker.up = True
+        self.assertEqual(spool.replay(broker.basic_publish), frames - 1000)
+        
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(len(broker.received), frames)
+        self.assertEqual(spool.stats()['replayed'], frames)
+        
+        for i in (0, 999, 1000, frames - 1):
+            parts = broker.received[i]
+            
+            self.assertEqual(parts[:4], ('raw_xbee_frames', self.ROUTING_KEY,
+                                         'application/x-python-pickle', ''))
+            self.assertEqual(pickle.loads(parts[4])['_timestamp'],
+                             start_ts + datetime.timedelta(seconds = i / 10))
+    
+    def test_parts(self):
+        """
+        records should keep their parts, including empty ones
+        """
+        spool = self.open(size = 4096)
+        
+        spool.append(('a', '', 'bc'))
+        spool.append(())
+        
+        replayed = []
+        spool.replay(replayed.append)
+        
+        self.assertEqual(replayed, [('a', '', 'bc'), ()])
+    
+    def test_full(self):
+        """
+        a full spool should refuse records rather than grow, and reclaim
+        the space of replayed ones
+        """
+        spool = self.open(size = 4096)
+        
+        while spool.append(('x' * 100,)):
+            pass
+        
+        self.assertEqual(spool.overflowed, 1)
+        self.assertEqual(os.path.getsize(self.path), 4096)
+        
+        pending = len(spool)
+        
+        self.assertEqual(spool.replay(lambda parts: None, limit = 10), 10)
+        self.assertTrue(spool.append(('x' * 100,)))
+        self.assertEqual(len(spool), pending - 9)
+    
+    def test_size_kept(self):
+        """
+        reopening a spool with a smaller size should keep its records
+        """
+        spool = self.open(size = 8192)
+        spool.append(('frame',))
+        spool.close()
+        
+        spool = self.open(size = 4096)
+        
+        self.assertEqual(os.path.getsize(self.path), 8192)
+        self.assertEqual(spool.stats()['capacity'], 8192 - FrameSpool.HEADER.size)
+        self.assertEqual(len(spool), 1)
+    
+    def test_corrupt_header(self):
+        """
+        a file that isn't a spool should be started afresh
+        """
+        f = open(self.path, 'wb')
+        f.write('not a spool' * 100)
+        f.close()
+        
+        spool = self.open(size = 4096)
+        
+        self.assertEqual(len(spool), 0)
+        self.assertTrue(spool.append(('frame',)))
+        self.assertEqual(spool.replay(lambda parts: None), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+#! /usr/bin/python
+"""
+test_metrics.py
+
+Tests counters, latency histograms and the HTTP metrics endpoint.
+"""
+import os
+import sys
+import json
+import socket
+import threading
+import shutil
+import tempfile
+import urllib2
+import unittest
+from support.metrics import Histogram, Metrics, serve_metrics
+
+class TestHistogram(unittest.TestCase):
+    """
+    Histogram must count each observation in the bucket of the lowest
+    bound at or above it
+    """
+    
+    def test_buckets(self):
+        """
+        values on a bound should count in that bound's bucket, and values
+        above every bound in the last
+        """
+        h = Histogram((1, 2, 3))
+        
+        for value in (0.5, 1, 1.5, 2, 3, 4, 100):
+            h.observe(value)
+        
+        snap = h.snapshot()
+        
+        self.assertEqual(snap['buckets'], [[1, 2], [2, 2], [3, 1], ['+Inf', 2]])
+        self.assertEqual(snap['count'], 7)
+        self.assertEqual(snap['sum'], 112.0)
+    
+    def test_quantile(self):
+        """
+        quantiles should be the upper bound of their bucket
+        """
+        h = Histogram((1, 2, 3))
+        
+        self.assertEqual(h.quantile(0.5), None)
+        
+        for value in [0.5] * 50 + [1.5] * 40 + [2.5] * 9 + [10]:
+            h.observe(value)
+        
+        self.assertEqual(h.quantile(0.5), 1)
+        self.assertEqual(h.quantile(0.9), 2)
+        self.assertEqual(h.quantile(0.99), 3)
+        self.assertEqual(h.quantile(1.0), '+Inf')
+        
+        # strict parsers reject Infinity
+        json.loads(json.dumps(h.snapshot()), parse_constant = self.fail)
+    
+    def test_pending_limit(self):
+        """
+        observations should be sorted into buckets once PENDING_LIMIT
+        are waiting, keeping memory bounded
+        """
+        h = Histogram()
+        
+        for i in range(Histogram.PENDING_LIMIT * 3):
+            h.observe(0.0042)
+        
+        self.assertEqual(h.count, Histogram.PENDING_LIMIT * 3)
+        self.assertEqual(h.quantile(0.5), 0.005)
+    
+    def test_concurrent_flush(self):
+        """
+        observations flushed by several threads at once should each be
+        counted once
+        """
+        class SmallHistogram(Histogram):
+            PENDING_LIMIT = 16
+        
+        h = SmallHistogram((1, 2, 3))
+        
+        def observer():
+            for i in range(20000):
+                h.observe(1.5)
+        
+        def reader():
+            for i in range(2000):
+                h.snapshot()
+        
+        # switch threads as often as possible, to interleave the flushes
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        
+        try:
+            threads = [threading.Thread(target = observer) for i in range(4)]
+            threads.append(threading.Thread(target = reader))
+            
+            for t in threads:
+                t.start()
+            
+            for t in threads:
+                t.join()
+        finally:
+            sys.setcheckinterval(interval)
+        
+        h.flush()
+        
+        self.assertEqual(h.count, 80000)
+        self.assertEqual(h.counts, [0, 80000, 0, 0])
+        self.assertEqual(h.total, 1.5 * 80000)
+
+class TestMetrics(unittest.TestCase):
+    """
+    Metrics must report counters, rates, histograms and gauges as plain
+    data
+    """
+    
+    def setUp(self):
+        self.metrics = Metrics()
+    
+    def test_counters(self):
+        """
+        counters should break down by label, with tuple labels joined
+        """
+        frames = self.metrics.counter('frames')
+        frames[('zb_rx', '00:13:a2:00:40:32:dc:dc')] += 2
+        self.metrics.increment('frames', ('zb_rx', '00:13:a2:00:40:32:dc:dc'))
+        self.metrics.increment('errors')
+        
+        snap = self.metrics.snapshot()
+        
+        self.assertTrue(self.metrics.counter('frames') is frames)
+        self.assertEqual(snap['counters'],
+                         {'frames' : {'zb_rx.00:13:a2:00:40:32:dc:dc' : 3},
+                          'errors' : {'' : 1}})
+        
+        # plain data throughout
+        self.assertEqual(json.loads(json.dumps(snap))['counters'], snap['counters'])
+    
+    def test_rates(self):
+        """
+        rates should count only what was added since the previous snapshot
+        """
+        self.metrics.increment('frames', 'a', 100)
+        self.metrics.snapshot()
+        
+        self.metrics.increment('frames', 'a', 10)
+        snap = self.metrics.snapshot()
+        
+        self.assertAlmostEqual(snap['rates']['frames']['a'] * snap['interval'], 10)
+    
+    def test_histograms(self):
+        """
+        histograms should be included in snapshots
+        """
+        self.metrics.histogram('latency').observe(0.0042)
+        
+        self.assertTrue(self.metrics.histogram('latency') is self.metrics.histogram('latency'))
+        self.assertEqual(self.metrics.snapshot()['histograms']['latency']['p50'], 0.005)
+    
+    def test_gauges(self):
+        """
+        gauges should be read for each snapshot, and one that raises
+        left out
+        """
+        values = iter([1, 2])
+        
+        self.metrics.gauge('depth', lambda: values.next())
+        self.metrics.gauge('broken', lambda: 1 / 0)
+        
+        self.assertEqual(self.metrics.snapshot()['gauges'], {'depth' : 1})
+        self.assertEqual(self.metrics.snapshot()['gauges'], {'depth' : 2})
+
+class TestServeMetrics(unittest.TestCase):
+    """
+    serve_metrics must serve snapshots as JSON over TCP and Unix sockets
+    """
+    
+    def setUp(self):
+        self.metrics = Metrics()
+        self.metrics.increment('frames', 'a', 3)
+        self.metrics.gauge('pid', os.getpid)
+        
+        self.server = None
+        self.tmpdir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        
+        shutil.rmtree(self.tmpdir)
+    
+    def test_tcp(self):
+        """
+        GET /metrics should return the snapshot, and other paths 404
+        """
+        self.server = serve_metrics(self.metrics, ('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        
+        response = urllib2.urlopen(url + '/metrics')
+        snap = json.loads(response.read())
+        
+        self.assertEqual(response.info()['Content-Type'], 'application/json')
+        self.assertEqual(snap['counters']['frames']['a'], 3)
+        self.assertEqual(snap['gauges']['pid'], os.getpid())
+        
+        try:
+            urllib2.urlopen(url + '/other')
+            self.fail("expected a 404")
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 404)
+    
+    def test_unix_socket(self):
+        """
+        snapshots should be served on a Unix socket, replacing a stale one
+        """
+        path = os.path.join(self.tmpdir, 'metrics.sock')
+        open(path, 'w').close()
+        
+        self.server = serve_metrics(self.metrics, path)
+        
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        sock.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+        
+        response = ''
+        while True:
+            data = sock.recv(4096)
+            
+            if not data:
+                break
+            
+            response += data
+        
+        sock.close()
+        
+        headers, body = response.split('\r\n\r\n', 1)
+        
+        self.assertTrue(headers.startswith('HTTP/1.0 200'), headers)
+        self.assertEqual(json.loads(body)['counters']['frames']['a'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#! /usr/bin/python
+"""
+test_pipeline.py
+
+Tests keeping a window of requests in flight and collecting their results
+in order.
+"""
+import unittest
+from support.pipeline import pipelined
+
+class StandInFuture(object):
+    def __init__(self, device, item):
+        self.device = device
+        self.item = item
+    
+    def result(self):
+        self.device.in_flight -= 1
+        
+        if isinstance(self.item, Exception):
+            raise self.item
+        
+        return self.item * 2
+
+class StandInDevice(object):
+    """counts the requests submitted and not yet waited for"""
+    
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+        self.submitted = []
+    
+    def submit(self, item):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        self.submitted.append(item)
+        
+        return StandInFuture(self, item)
+
+class TestPipelined(unittest.TestCase):
+    """
+    pipelined must keep up to a window of requests in flight, and return
+    their results in order
+    """
+    
+    def setUp(self):
+        self.device = StandInDevice()
+    
+    def test_order(self):
+        """
+        results should be in the order the requests were submitted
+        """
+        self.assertEqual(pipelined(self.device.submit, range(10), 4), [i * 2 for i in range(10)])
+        self.assertEqual(self.device.submitted, range(10))
+        self.assertEqual(self.device.in_flight, 0)
+    
+    def test_window(self):
+        """
+        no more than window requests should be in flight at once
+        """
+        for window in (1, 2, 4, 8):
+            device = StandInDevice()
+            pipelined(device.submit, range(20), window)
+            
+            self.assertEqual(device.peak, window)
+    
+    def test_empty(self):
+        """
+        no items should give no results
+        """
+        self.assertEqual(pipelined(self.device.submit, [], 4), [])
+    
+    def test_exception(self):
+        """
+        an exception from a result should propagate
+        """
+        items = [1, 2, ValueError("no reply"), 4]
+        
+        self.assertRaises(ValueError, pipelined, self.device.submit, items, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#! /usr/bin/python
+"""
+test_rpc_pool.py
+
+Tests running RPC handlers on a pool of threads, with per-queue limits
+and deadlines.
+"""
+import time
+import logging
+import threading
+import unittest
+from support.rpc_pool import RPCWorkerPool
+from support.deadline_heap import monotonic
+
+class TestRPCWorkerPool(unittest.TestCase):
+    """
+    RPCWorkerPool must run each request once, within its queue's limit,
+    unless its deadline has passed
+    """
+    
+    def setUp(self):
+        # expired and failing requests are logged
+        logging.getLogger('support.rpc_pool').setLevel(logging.CRITICAL)
+        
+        self.pool = RPCWorkerPool(size = 8)
+        
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+    
+    def tearDown(self):
+        self.pool.shutdown()
+        self.pool.join()
+        
+        logging.getLogger('support.rpc_pool').setLevel(logging.NOTSET)
+    
+    def counted(self, duration = 0.05):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        
+        time.sleep(duration)
+        
+        with self.lock:
+            self.running -= 1
+    
+    def wait_completed(self, count):
+        deadline = time.time() + 10
+        
+        while self.pool.stats()['completed'] < count:
+            self.assertTrue(time.time() < deadline, self.pool.stats())
+            time.sleep(0.01)
+    
+    def test_limit(self):
+        """
+        no more of a queue's requests than its limit should run at once,
+        however many threads are free
+        """
+        self.pool.set_limit('environmental_node', 2)
+        self.pool.start()
+        
+        for i in range(10):
+            self.pool.submit('environmental_node', None, self.counted)
+        
+        self.wait_completed(10)
+        
+        self.assertEqual(self.peak, 2)
+    
+    def test_default_limit(self):
+        """
+        a queue without a limit of its own should run one request at a time
+        """
+        self.pool.start()
+        
+        for i in range(5):
+            self.pool.submit('furnace', None, self.counted, 0.01)
+        
+        self.wait_completed(5)
+        
+        self.assertEqual(self.peak, 1)
+    
+    def test_busy_queue(self):
+        """
+        a queue at its limit shouldn't hold up another queue's requests
+        """
+        started = threading.Event()
+        release = threading.Event()
+        
+        def slow():
+            started.set()
+            release.wait(10)
+        
+        done = threading.Event()
+        
+        self.pool.start()
+        self.pool.submit('environmental_node', None, slow)
+        self.pool.submit('environmental_node', None, slow)
+        self.pool.submit('furnace', None, done.set)
+        
+        done.wait(5)
+        
+        self.assertTrue(done.is_set())
+        self.assertTrue(started.is_set())
+        self.assertEqual(self.pool.stats()['pending'], 1)
+        
+        release.set()
+        self.wait_completed(3)
+    
+    def test_expired(self):
+        """
+        requests whose deadline has passed should be dropped without running
+        """
+        ran = []
+        
+        self.pool.submit('furnace', monotonic() - 1, ran.append, 'late')
+        self.pool.submit('furnace', monotonic() + 60, ran.append, 'on time')
+        self.pool.submit('furnace', None, ran.append, 'no deadline')
+        self.pool.start()
+        
+        self.wait_completed(2)
+        
+        self.assertEqual(ran, ['on time', 'no deadline'])
+        self.assertEqual(self.pool.expired, 1)
+    
+    def test_failed(self):
+        """
+        a request raising an exception should be counted, and not stop its
+        thread
+        """
+        ran = []
+        
+        self.pool = RPCWorkerPool(size = 1)
+        self.pool.start()
+        self.pool.submit('furnace', None, lambda: 1 / 0)
+        self.pool.submit('furnace', None, ran.append, 'after')
+        
+        self.wait_completed(2)
+        
+        self.assertEqual(ran, ['after'])
+        self.assertEqual(self.pool.failed, 1)
+    
+    def test_in_worker(self):
+        """
+        in_worker should be true only on the pool's threads
+        """
+        inside = []
+        
+        self.pool.start()
+        self.pool.submit('furnace', None, lambda: inside.append(self.pool.in_worker()))
+        
+        self.wait_completed(1)
+        
+        self.assertEqual(inside, [True])
+        self.assertFalse(self.pool.in_worker())
+    
+    def test_shutdown(self):
+        """
+        shutdown should stop the threads, dropping pending requests
+        """
+        self.pool.start()
+        self.pool.shutdown()
+        self.pool.join(5)
+        
+        self.assertFalse(self.pool.is_alive())
+        self.assertEqual(self.pool.stats()['pending'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
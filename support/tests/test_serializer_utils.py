@@ -0,0 +1,83 @@
+#! /usr/bin/python
+"""
+test_serializer_utils.py
+
+Tests the application/x-xbee-frame encoding of received frames.
+"""
+import datetime
+import unittest
+from xbee.impl import XBee
+from xbee.record import FrameRecord
+from support.serializer_utils import serialize, deserialize, \
+     CONTENT_TYPE_XBEE_FRAME, SYSTEM_TZ, UTC
+
+class TestXBeeFrameEncoding(unittest.TestCase):
+    """
+    Frames must come back as lazy FrameRecords with the same fields and
+    timestamp, encoded in no more than the packet and a timestamp
+    """
+    
+    ZB_RX = '\x90\x00\x13\xa2\x00\x40\x32\xdc\xdc\xda\xe0\x01V:1234,I:0567\r\n'
+    ZB_IO = '\x92\x00\x13\xa2\x00\x40\x55\x6e\x7d\x52\xc1\x01' + \
+            '\x01\x08\x00\x0e\x08\x00\x00\x00\x02P\x02\x06'
+    
+    def setUp(self):
+        self.xbee = XBee(None)
+        self.timestamp = datetime.datetime(2012, 5, 18, 12, 30, 15, 123456, UTC)
+    
+    def frame(self, packet):
+        frame = self.xbee._split_response(packet, lazy=True)
+        frame['_timestamp'] = self.timestamp
+        
+        return frame
+    
+    def test_round_trip(self):
+        """
+        every field should decode as from the original packet
+        """
+        for packet in (self.ZB_RX, self.ZB_IO):
+            frame = deserialize(serialize(self.frame(packet), CONTENT_TYPE_XBEE_FRAME),
+                                CONTENT_TYPE_XBEE_FRAME)
+            
+            expected = self.xbee._split_response(packet)
+            expected['_timestamp'] = self.timestamp
+            
+            self.assertTrue(isinstance(frame, FrameRecord))
+            self.assertEqual(frame.to_dict(), expected)
+            self.assertEqual(frame.raw(), packet)
+    
+    def test_size(self):
+        """
+        the body should be the packet after an 8-byte timestamp
+        """
+        body = serialize(self.frame(self.ZB_RX), CONTENT_TYPE_XBEE_FRAME)
+        
+        self.assertEqual(len(body), 8 + len(self.ZB_RX))
+        self.assertTrue(body.endswith(self.ZB_RX))
+    
+    def test_timestamp(self):
+        """
+        timestamps should keep microseconds, and naive ones be taken as
+        local time
+        """
+        naive = datetime.datetime(2012, 5, 18, 8, 30, 15, 654321)
+        
+        frame = self.frame(self.ZB_RX)
+        frame['_timestamp'] = naive
+        
+        decoded = deserialize(serialize(frame, CONTENT_TYPE_XBEE_FRAME),
+                              CONTENT_TYPE_XBEE_FRAME)['_timestamp']
+        
+        self.assertEqual(decoded, SYSTEM_TZ.localize(naive))
+        self.assertEqual(decoded.microsecond, 654321)
+    
+    def test_unkept_packet(self):
+        """
+        a frame decoded without keeping its packet can't be encoded
+        """
+        frame = FrameRecord(None, None, {'id' : 'node_id_indicator'})
+        
+        self.assertRaises(ValueError, serialize, frame, CONTENT_TYPE_XBEE_FRAME)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#! /usr/bin/python
+"""
+test_tx_scheduler.py
+
+Tests ordering, coalescing and pacing of outbound XBee requests.
+"""
+import unittest
+from support.tx_scheduler import TxScheduler, \
+     PRIORITY_CONTROL, PRIORITY_DEFAULT, PRIORITY_TELEMETRY
+from support.deadline_heap import monotonic
+
+class TestTxScheduler(unittest.TestCase):
+    """
+    TxScheduler must return requests by priority, then in turn by
+    destination, no faster than its rate
+    """
+    
+    def setUp(self):
+        # fast enough that pacing doesn't slow the ordering tests
+        self.sched = TxScheduler(rate = 10000, burst = 1000)
+    
+    def drain(self):
+        items = []
+        
+        while len(self.sched):
+            items.append(self.sched.get(0))
+        
+        return items
+    
+    def test_priority(self):
+        """
+        higher priority requests should be returned first
+        """
+        self.sched.put('a', 'telemetry', PRIORITY_TELEMETRY)
+        self.sched.put('a', 'default')
+        self.sched.put('b', 'control', PRIORITY_CONTROL)
+        
+        self.assertEqual(self.drain(),
+                         [('b', 'control'), ('a', 'default'), ('a', 'telemetry')])
+    
+    def test_round_robin(self):
+        """
+        destinations of the same priority should take turns
+        """
+        for i in range(3):
+            self.sched.put('a', 'a%d' % i)
+        
+        self.sched.put('b', 'b0')
+        
+        self.assertEqual([item for dest, item in self.drain()],
+                         ['a0', 'b0', 'a1', 'a2'])
+    
+    def test_coalesce(self):
+        """
+        a request with a waiting coalesce key should replace the waiting
+        one in its place
+        """
+        self.assertEqual(self.sched.put('a', 'm1', PRIORITY_TELEMETRY, 'meter'), None)
+        self.sched.put('a', 'other', PRIORITY_TELEMETRY)
+        self.assertEqual(self.sched.put('a', 'm2', PRIORITY_TELEMETRY, 'meter'), 'm1')
+        self.sched.put('b', 'm3', PRIORITY_TELEMETRY, 'meter')
+        
+        self.assertEqual(self.drain(),
+                         [('a', 'm2'), ('b', 'm3'), ('a', 'other')])
+        self.assertEqual(self.sched.coalesced, 1)
+        
+        # once sent, the key no longer coalesces
+        self.assertEqual(self.sched.put('a', 'm4', PRIORITY_TELEMETRY, 'meter'), None)
+    
+    def test_coalesce_priority_change(self):
+        """
+        a replacement with a different priority should be queued under
+        its own priority
+        """
+        self.sched.put('a', 'low', PRIORITY_TELEMETRY, 'setpoint')
+        self.sched.put('b', 'default')
+        
+        self.assertEqual(self.sched.put('a', 'urgent', PRIORITY_CONTROL, 'setpoint'), 'low')
+        self.assertEqual(len(self.sched), 2)
+        
+        stats = self.sched.stats()
+        self.assertEqual(stats['queued_%d' % PRIORITY_TELEMETRY], 0)
+        self.assertEqual(stats['queued_%d' % PRIORITY_CONTROL], 1)
+        
+        self.assertEqual(self.drain(), [('a', 'urgent'), ('b', 'default')])
+        
+        # and may be coalesced again under its new priority
+        self.sched.put('a', 'x', PRIORITY_DEFAULT, 'setpoint')
+        self.sched.put('a', 'y', PRIORITY_DEFAULT, 'other')
+        self.sched.put('a', 'z', PRIORITY_TELEMETRY, 'setpoint')
+        
+        self.assertEqual(self.drain(), [('a', 'y'), ('a', 'z')])
+    
+    def test_timeout(self):
+        """
+        get should return None once timeout passes with nothing queued
+        """
+        start = monotonic()
+        
+        self.assertEqual(self.sched.get(0.05), None)
+        self.assertTrue(monotonic() - start >= 0.04)
+    
+    def test_rate(self):
+        """
+        after the burst, requests should be returned at rate per second
+        """
+        sched = TxScheduler(rate = 100, burst = 5)
+        
+        for i in range(25):
+            sched.put('a', i)
+        
+        start = monotonic()
+        
+        for i in range(25):
+            self.assertEqual(sched.get(1), ('a', i))
+        
+        # 20 paced requests at 10 ms each
+        elapsed = monotonic() - start
+        self.assertTrue(0.15 <= elapsed < 0.5, elapsed)
+        self.assertEqual(sched.sent, 25)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#! /usr/bin/python
+"""
+test_xbee_addr.py
+
+Tests converting XBee addresses and routing keys, and bounding the table
+they're interned in.
+"""
+import unittest
+from support import xbee_addr
+from support.xbee_addr import AddressTable
+
+ADDR = '\x00\x13\xa2\x00\x40\x32\xdc\xdc'
+FORMATTED = '00:13:a2:00:40:32:dc:dc'
+
+class TestAddressTable(unittest.TestCase):
+    """
+    AddressTable must convert addresses as the uncached forms would
+    """
+    
+    def setUp(self):
+        self.table = AddressTable()
+    
+    def test_format_addr(self):
+        """
+        raw addresses should be formatted as lower case hex
+        """
+        self.assertEqual(self.table.format_addr(ADDR), FORMATTED)
+        self.assertEqual(self.table.format_addr(ADDR), FORMATTED)
+    
+    def test_parse_addr(self):
+        """
+        formatted addresses should parse to raw ones, in either case
+        """
+        self.assertEqual(self.table.parse_addr(FORMATTED), ADDR)
+        self.assertEqual(self.table.parse_addr(FORMATTED.upper()), ADDR)
+        self.assertEqual(self.table.parse_addr(None), None)
+    
+    def test_routing_key(self):
+        """
+        routing keys should carry the formatted address, or "unknown"
+        """
+        self.assertEqual(self.table.routing_key('zb_rx', ADDR), 'zb_rx.' + FORMATTED)
+        self.assertEqual(self.table.routing_key('zb_rx', None), 'zb_rx.unknown')
+    
+    def test_routing_key_addr(self):
+        """
+        the address should be taken back out of a routing key
+        """
+        routing_key = self.table.routing_key('zb_rx', ADDR)
+        
+        self.assertEqual(self.table.routing_key_addr(routing_key), FORMATTED)
+    
+    def test_bounded(self):
+        """
+        a cache should never hold more than max_entries items
+        """
+        table = AddressTable(max_entries = 10)
+        
+        for i in range(100):
+            addr = chr(i) * 8
+            
+            self.assertEqual(table.format_addr(addr), ":".join(['%02x' % i] * 8))
+        
+        self.assertTrue(len(table._AddressTable__formatted) <= 10)
+    
+    def test_shared_table(self):
+        """
+        the module-level functions should share one table
+        """
+        self.assertEqual(xbee_addr.format_addr(ADDR), FORMATTED)
+        self.assertEqual(xbee_addr.parse_addr(FORMATTED), ADDR)
+        self.assertTrue(xbee_addr.format_addr.im_self is xbee_addr.parse_addr.im_self)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+tx_scheduler.py
+
+Orders outbound XBee requests for transmission.
+
+Requests are queued per destination within a priority class. get()
+returns requests from the highest priority class with any waiting, and
+round-robins between destinations within a class, so a flood of requests
+to one device neither delays more important requests nor starves other
+devices. Requests carrying a coalesce key replace any waiting request
+with the same destination and key, so that only the latest value is
+sent. get() is paced by a token bucket to the rate the radio can carry.
+"""
+
+import time
+import threading
+import collections
+
+from support.deadline_heap import monotonic
+
+# priority classes; lower values are sent first
+PRIORITY_CONTROL = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_TELEMETRY = 2
+
+PRIORITIES = (PRIORITY_CONTROL, PRIORITY_DEFAULT, PRIORITY_TELEMETRY)
+
+class TxScheduler(object):
+    """
+    Thread-safe prioritized, per-destination, rate-limited request queue
+
+    rate is the sustained number of requests per second returned by
+    get(); up to burst may be returned back to back after an idle period.
+    """
+
+    # {{{ __init__
+    def __init__(self, rate = 25.0, burst = 5):
+        super(TxScheduler, self).__init__()
+
+        self.__rate = float(rate)
+        self.__burst = float(burst)
+
+        # token bucket
+        self.__tokens = self.__burst
+        self.__last_fill = monotonic()
+
+        # per priority: destination -> deque of [item, coalesce key]
+        self.__queues = dict((p, {}) for p in PRIORITIES)
+
+        # per priority: destinations with requests waiting, in turn order
+        self.__turns = dict((p, collections.deque()) for p in PRIORITIES)
+
+        # (destination, coalesce key) -> (waiting entry, its priority)
+        self.__coalesce_index = {}
+
+        self.__count = 0
+        self.__cond = threading.Condition(threading.Lock())
+
+        # counters
+        self.coalesced = 0
+        self.sent = 0
+
+    # }}}
+
+    # {{{ put
+    def put(self, dest, item, priority = PRIORITY_DEFAULT, coalesce_key = None):
+        """
+        Queues item for dest.  If coalesce_key is given and a request for
+        dest with the same key is waiting, item takes its place in the
+        queue and the superseded item is returned; otherwise returns None.
+        A replacement with a different priority is queued afresh under
+        its own priority instead.
+        """
+
+        superseded = None
+
+        with self.__cond:
+            if coalesce_key is not None:
+                waiting = self.__coalesce_index.get((dest, coalesce_key))
+
+                if waiting is not None:
+                    entry, queued_priority = waiting
+
+                    superseded = entry[0]
+                    self.coalesced += 1
+
+                    if queued_priority == priority:
+                        entry[0] = item
+
+                        return superseded
+
+                    self.__remove(dest, entry, queued_priority)
+
+            entry = [item, coalesce_key]
+
+            if coalesce_key is not None:
+                self.__coalesce_index[(dest, coalesce_key)] = (entry, priority)
+
+            queues = self.__queues[priority]
+
+            if dest not in queues:
+                queues[dest] = collections.deque()
+                self.__turns[priority].append(dest)
+
+            queues[dest].append(entry)
+            self.__count += 1
+
+            self.__cond.notify()
+
+        return superseded
+
+    # }}}
+
+    # {{{ get
+    def get(self, timeout = None):
+        """
+        Returns the next (dest, item) to send, waiting for one to be queued
+        and for the rate limit to allow it.  Returns None if timeout
+        seconds pass first.
+        """
+
+        deadline = None
+        if timeout is not None:
+            deadline = monotonic() + timeout
+
+        with self.__cond:
+            while True:
+                now = monotonic()
+                wait = None
+
+                if self.__count:
+                    self.__fill(now)
+
+                    if self.__tokens >= 1:
+                        self.__tokens -= 1
+                        self.sent += 1
+
+                        return self.__pop()
+
+                    wait = (1 - self.__tokens) / self.__rate
+
+                if deadline is not None:
+                    remaining = deadline - now
+
+                    if remaining <= 0:
+                        return None
+
+                    if wait is None or remaining < wait:
+                        wait = remaining
+
+                self.__cond.wait(wait)
+
+    # }}}
+
+    # {{{ __fill
+    def __fill(self, now):
+        elapsed = max(now - self.__last_fill, 0)
+        self.__last_fill = now
+
+        self.__tokens = min(self.__burst, self.__tokens + elapsed * self.__rate)
+
+    # }}}
+
+    # {{{ __remove
+    def __remove(self, dest, entry, priority):
+        """removes a waiting entry from its queue; called with the lock held"""
+
+        queues = self.__queues[priority]
+        queue = queues[dest]
+
+        for i, e in enumerate(queue):
+            if e is entry:
+                del queue[i]
+                break
+
+        if not queue:
+            del queues[dest]
+            self.__turns[priority].remove(dest)
+
+        self.__count -= 1
+
+    # }}}
+
+    # {{{ __pop
+    def __pop(self):
+        for priority in PRIORITIES:
+            turns = self.__turns[priority]
+
+            if not turns:
+                continue
+
+            dest = turns.popleft()
+            queue = self.__queues[priority][dest]
+
+            item, coalesce_key = queue.popleft()
+
+            if queue:
+                # back of the line for this priority
+                turns.append(dest)
+            else:
+                del self.__queues[priority][dest]
+
+            if coalesce_key is not None:
+                del self.__coalesce_index[(dest, coalesce_key)]
+
+            self.__count -= 1
+
+            return dest, item
+
+    # }}}
+
+    # {{{ __len__
+    def __len__(self):
+        return self.__count
+
+    # }}}
+
+    # {{{ stats
+    def stats(self):
+        """returns the number of waiting requests per priority and counters"""
+
+        with self.__cond:
+            stats = {
+                'coalesced' : self.coalesced,
+                'sent' : self.sent,
+            }
+
+            for priority in PRIORITIES:
+                stats['queued_%d' % priority] = sum(
+                    len(q) for q in self.__queues[priority].values()
+                )
+
+            return stats
+
+    # }}}
+
+
+if __name__ == '__main__':
+    # Offline benchmark: a voltometer floods its meter updates just before
+    # a furnace timer command.  Frames are built by the XBee driver and
+    # written to a fake serial port which, like the radio, carries RATE
+    # frames per second.
+    import sys, os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import xbee
+
+    RATE = 200.0
+    UPDATES = 200
+
+    VOLTOMETER = '\x00\x13\xa2\x00\x40\x0a\x12\x00'
+    FURNACE = '\x00\x13\xa2\x00\x40\x0a\x12\x01'
+
+    class RadioSerial(object):
+        def __init__(self):
+            self.written = []
+
+        def write(self, data):
+            time.sleep(1 / RATE)
+            self.written.append((monotonic(), data))
+
+    def requests():
+        for i in range(UPDATES):
+            yield VOLTOMETER, 'M%03d' % i, PRIORITY_TELEMETRY, 'M'
+
+        yield FURNACE, 'S\x01\xa4', PRIORITY_CONTROL, None
+
+    def furnace_latency(radio, start):
+        for ts, data in radio.written:
+            if FURNACE in data:
+                return ts - start
+
+    # in arrival order, as the gateway used to
+    radio = RadioSerial()
+    dev = xbee.XBee(radio)
+    start = monotonic()
+
+    for dest, data, priority, key in requests():
+        dev.zb_tx_request(frame_id = '\x01', dest_addr_long = dest, data = data)
+
+    print "FIFO:      %4d frames, furnace command after %7.1f ms" % (
+        len(radio.written), furnace_latency(radio, start) * 1000)
+
+    # through the scheduler, with requests arriving while it is draining
+    radio = RadioSerial()
+    dev = xbee.XBee(radio)
+    sched = TxScheduler(rate = RATE, burst = 1)
+
+    def sender():
+        while True:
+            entry = sched.get(0.2)
+
+            if entry is None:
+                break
+
+            dest, data = entry
+            dev.zb_tx_request(frame_id = '\x01', dest_addr_long = dest, data = data)
+
+    start = monotonic()
+    t = threading.Thread(target = sender)
+    t.start()
+
+    for dest, data, priority, key in requests():
+        sched.put(dest, data, priority, key)
+        time.sleep(0.0001)
+
+    t.join()
+
+    print "scheduled: %4d frames, furnace command after %7.1f ms (%d coalesced)" % (
+        len(radio.written), furnace_latency(radio, start) * 1000, sched.coalesced)
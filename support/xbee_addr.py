@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+xbee_addr.py
+
+Conversion of XBee addresses between their raw and formatted forms.
+
+Frames carry addresses as raw bytes; routing keys, requests and
+configuration use the colon-separated hex form, such as
+"00:13:a2:00:40:32:dc:dc". A network has a few dozen devices, so each
+conversion is computed once and interned in an AddressTable, and so are
+the "<frame type>.<address>" routing keys frames are published with. The
+module-level functions share one table.
+"""
+
+class AddressTable(object):
+    """
+    Caches formatted addresses, raw addresses and routing keys
+
+    Each cache holds up to max_entries items and is emptied when it would
+    grow beyond that, bounding memory even if addresses are garbage.
+    Lookups and inserts are single dict operations, so a table may be
+    shared between threads without locking.
+    """
+
+    # {{{ __init__
+    def __init__(self, max_entries = 1024):
+        super(AddressTable, self).__init__()
+
+        self.max_entries = max_entries
+
+        self.__formatted = {}
+        self.__parsed = {}
+        self.__routing_keys = {}
+        self.__routing_key_addrs = {}
+
+    # }}}
+
+    # {{{ __intern
+    def __intern(self, cache, key, value):
+        if len(cache) >= self.max_entries:
+            cache.clear()
+
+        cache[key] = value
+
+        return value
+
+    # }}}
+
+    # {{{ format_addr
+    def format_addr(self, addr):
+        """returns the formatted form of raw address addr, in lower case"""
+
+        formatted = self.__formatted.get(addr)
+
+        if formatted is None:
+            formatted = self.__intern(self.__formatted, addr,
+                                      ":".join(['%02x' % ord(x) for x in addr]))
+
+        return formatted
+
+    # }}}
+
+    # {{{ parse_addr
+    def parse_addr(self, addr):
+        """returns the raw form of formatted address addr, or None if addr is None"""
+
+        if addr is None:
+            return None
+
+        parsed = self.__parsed.get(addr)
+
+        if parsed is None:
+            parsed = self.__intern(self.__parsed, addr,
+                                   "".join(chr(int(x, 16)) for x in addr.split(":")))
+
+        return parsed
+
+    # }}}
+
+    # {{{ routing_key
+    def routing_key(self, frame_type, addr):
+        """
+        returns the routing key for a frame of frame_type from raw address
+        addr, such as "zb_rx.00:11:22:33:44:55:66:0a"; if addr is None, the
+        address is given as "unknown"
+        """
+
+        key = (frame_type, addr)
+        routing_key = self.__routing_keys.get(key)
+
+        if routing_key is None:
+            if addr is None:
+                formatted = 'unknown'
+            else:
+                formatted = self.format_addr(addr)
+
+            routing_key = self.__intern(self.__routing_keys, key,
+                                        '%s.%s' % (frame_type, formatted))
+
+        return routing_key
+
+    # }}}
+
+    # {{{ routing_key_addr
+    def routing_key_addr(self, routing_key):
+        """returns the formatted address from a routing key made by routing_key()"""
+
+        addr = self.__routing_key_addrs.get(routing_key)
+
+        if addr is None:
+            addr = self.__intern(self.__routing_key_addrs, routing_key,
+                                 routing_key.split('.')[1])
+
+        return addr
+
+    # }}}
+
+
+# {{{ shared table
+_table = AddressTable()
+
+format_addr = _table.format_addr
+parse_addr = _table.parse_addr
+routing_key = _table.routing_key
+routing_key_addr = _table.routing_key_addr
+
+# }}}
+
+
+if __name__ == '__main__':
+    # cached and uncached conversions, timed; see
+    # support/tests/test_xbee_addr.py for the tests
+    import timeit
+
+    addr = '\x00\x13\xa2\x00\x40\x32\xdc\xdc'
+    formatted = '00:13:a2:00:40:32:dc:dc'
+
+    setup = 'from __main__ import addr, formatted, format_addr, parse_addr, routing_key, routing_key_addr'
+    n = 200000
+
+    for label, uncached, cached in (
+        ('format', '":".join(["%02x" % ord(x) for x in addr])', 'format_addr(addr)'),
+        ('parse', '"".join(chr(int(x, 16)) for x in formatted.split(":"))', 'parse_addr(formatted)'),
+        ('routing key', '"%s.%s" % ("zb_rx", ":".join(["%02x" % ord(x) for x in addr]))', 'routing_key("zb_rx", addr)'),
+        ('key address', '"zb_rx.00:13:a2:00:40:32:dc:dc".split(".")[1]', 'routing_key_addr("zb_rx.00:13:a2:00:40:32:dc:dc")'),
+    ):
+        t_uncached = min(timeit.repeat(uncached, setup, number = n, repeat = 3)) / n * 1e9
+        t_cached = min(timeit.repeat(cached, setup, number = n, repeat = 3)) / n * 1e9
+
+        print "%-12s %6.0f ns -> %4.0f ns" % (label, t_uncached, t_cached)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+compare_driver_layouts.py
+
+Compares running drivers as separate daemons with running them in one
+driver_host.py process: the peak RSS, threads and startup time of each
+process, and the totals of each layout.
+
+Each driver, and then a DriverHost of all of them, is started in a child
+process against the configured broker, as its daemon would be, and shut
+down again once it's ready.
+
+usage: compare_driver_layouts.py [<driver> ...]
+
+where <driver> is a name from driver_host.DRIVERS; all of them by default.
+"""
+
+import sys, os
+import time
+import resource
+import threading
+import subprocess
+
+# ../
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+# seconds to wait for a process to be ready
+READY_TIMEOUT = 60
+
+# {{{ run_child
+def run_child(started, names):
+    """
+    runs the named drivers until they're ready, then prints the seconds
+    since started, peak RSS in kilobytes and threads
+    """
+
+    import logging
+    import driver_host
+
+    logging.basicConfig(level = logging.WARN)
+
+    drivers = driver_host.create_drivers(names)
+
+    if len(drivers) == 1:
+        consumer = drivers[0]
+    else:
+        consumer = driver_host.DriverHost(drivers)
+
+    def report():
+        consumer.ready_event.wait(READY_TIMEOUT)
+
+        if not consumer.ready_event.is_set():
+            print "not ready"
+        else:
+            print "%.3f %d %d" % (
+                time.time() - started,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                threading.active_count()
+            )
+
+        sys.stdout.flush()
+        consumer.shutdown()
+
+    reporter = threading.Thread(target = report, name = "report")
+    reporter.daemon = True
+    reporter.start()
+
+    try:
+        consumer.process_forever()
+    except KeyboardInterrupt:
+        pass
+
+# }}}
+
+# {{{ run_layout
+def run_layout(processes):
+    """
+    starts a child for each list of driver names in processes, all at
+    once, and returns (names, startup, rss, threads) for each
+    """
+
+    children = []
+
+    for names in processes:
+        children.append((names, subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--child', repr(time.time())] + names,
+            stdout = subprocess.PIPE
+        )))
+
+    results = []
+
+    for names, child in children:
+        output = child.communicate()[0].split()
+
+        if len(output) != 3:
+            sys.exit("%s failed: %r" % (" ".join(names), output))
+
+        startup, rss, threads = output
+
+        results.append((names, float(startup), int(rss), int(threads)))
+
+    return results
+
+# }}}
+
+# {{{ report_layout
+def report_layout(title, results):
+    print title
+
+    for names, startup, rss, threads in results:
+        print "  %-40s %6.2fs %8dKB %4d threads" % (" ".join(names), startup, rss, threads)
+
+    print "  %-40s %6.2fs %8dKB %4d threads" % (
+        "total (slowest startup)",
+        max(r[1] for r in results),
+        sum(r[2] for r in results),
+        sum(r[3] for r in results)
+    )
+
+# }}}
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        run_child(float(sys.argv[2]), sys.argv[3:])
+        return
+
+    import driver_host
+
+    known = [name for name, spec in driver_host.DRIVERS]
+    names = sys.argv[1:] or known
+
+    for name in names:
+        if name not in known:
+            sys.exit("unknown driver %s; choose from %s" % (name, ", ".join(known)))
+
+    report_layout("separate daemons", run_layout([[name] for name in names]))
+    report_layout("driver_host", run_layout([names]))
+
+
+
+if __name__ == '__main__':
+    main()
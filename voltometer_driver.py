@@ -75,7 +75,10 @@ class VoltometerDriver(consumer.BaseConsumer):
                 clamp_tot, volt_meter_val, pwm_val
             )
         
-            self._send_data(self.voltometer_addr, build_packet('M', pwm_val))
+            # only the latest meter reading matters
+            self._send_data(self.voltometer_addr, build_packet('M', pwm_val),
+                            priority = consumer.PRIORITY_TELEMETRY,
+                            coalesce = 'M')
         except:
             self._logger.critical("exception handling meter packet", exc_info = True)
     
@@ -104,24 +107,24 @@ class VoltometerDriver(consumer.BaseConsumer):
     
     # }}}
     
-    # {{{ process_forever
-    def process_forever(self):
+    # {{{ _startup
+    # also called when hosted by driver_host.py, where our own
+    # process_forever isn't
+    def _startup(self):
         self._logger.debug("starting sens_dat thread")
         t = threading.Thread(target = self.__run_thread, name = 'sens_dat')
         # t.daemon = True
         t.start()
         
-        self._logger.debug("invoking parent process_forever")
-        
-        super(VoltometerDriver, self).process_forever()
-        
-        self._logger.debug("parent process_forever returned; closing sensor data channel")
+    # }}}
+    
+    # {{{ _teardown
+    def _teardown(self):
+        self._logger.debug("closing sensor data channel")
         
         self._sensor_data_chan.stop_consuming()
         self._sensor_data_conn.close()
         
-        self._logger.debug("process_forever complete")
-        
     # }}}
     
     # {{{ set_light
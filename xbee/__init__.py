@@ -6,3 +6,4 @@ pmalmsten@gmail.com
 """
 
 from xbee.impl import XBee
+from xbee.asyncore_impl import AsyncXBee
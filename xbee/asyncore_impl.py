@@ -0,0 +1,144 @@
+"""
+asyncore_impl.py
+
+An XBee Series 1/Series 2 driver for asyncore event loops.
+
+XBee runs a reader thread per device and delivers frames on it.
+AsyncXBee instead registers the serial port's file descriptor with an
+asyncore socket map, so that any number of devices, and anything else
+using asyncore (such as pika's AsyncoreConnection), can be serviced by
+a single thread. It uses the same compiled command and response
+specifications as XBee.
+"""
+import asyncore, collections
+from xbee.frame import APIFrame, FrameDecoder
+from xbee.impl import XBee
+from xbee.spec import split_response
+
+class AsyncXBee(asyncore.file_dispatcher):
+    """
+    Non-blocking XBee driver
+    
+    Received frames are passed to callback, if given, from within the
+    event loop; otherwise they are held until retrieved with frames().
+    Frames given to send() are buffered and written as the serial port
+    becomes writable.
+    """
+    
+    # Bytes read from the serial port per read event
+    READ_SIZE = 4096
+    
+    _command_specs = XBee._command_specs
+    _response_specs = XBee._response_specs
+    
+    def __init__(self, ser, callback=None, escaped=False, map=None):
+        # file_dispatcher duplicates the descriptor and makes it
+        # non-blocking
+        asyncore.file_dispatcher.__init__(self, ser.fileno(), map)
+        
+        self.serial = ser
+        self._callback = callback
+        self._escaped = escaped
+        self._decoder = FrameDecoder(escaped=escaped)
+        
+        # Frames received but not yet retrieved with frames()
+        self._received = collections.deque()
+        
+        # Encoded frames waiting to be written
+        self._outgoing = collections.deque()
+        
+        # Frames received which could not be split
+        self.errors = 0
+    
+    def frames(self):
+        """
+        frames: None -> iterator of frame info dictionaries
+        
+        Yields each frame received so far, without blocking
+        """
+        received = self._received
+        
+        while received:
+            yield received.popleft()
+    
+    def wait_read_frame(self, timeout=None):
+        """
+        wait_read_frame: float -> frame info dictionary or None
+        
+        Runs the event loop until a frame has been received, or until
+        timeout seconds have passed
+        """
+        loop_timeout = 0.1 if timeout is None else min(timeout, 0.1)
+        remaining = timeout
+        
+        while not self._received:
+            if self._fileno is None:
+                # Closed
+                return None
+            
+            if remaining is not None:
+                if remaining <= 0:
+                    return None
+                
+                remaining -= loop_timeout
+            
+            asyncore.loop(timeout=loop_timeout, map=self._map, count=1)
+        
+        return self._received.popleft()
+    
+    def send(self, cmd, **kwargs):
+        """
+        send: string param=binary data ... -> None
+        
+        Queues an API command for transmission; see XBeeBase.send. It
+        is written by the event loop.
+        """
+        data = self._command_specs[cmd].build(kwargs)
+        self._outgoing.append(APIFrame(data, self._escaped).output())
+    
+    def pending_writes(self):
+        """
+        pending_writes: None -> int
+        
+        Returns the number of frames not yet completely written
+        """
+        return len(self._outgoing)
+    
+    def readable(self):
+        return True
+    
+    def writable(self):
+        return bool(self._outgoing)
+    
+    def handle_read(self):
+        data = self.recv(self.READ_SIZE)
+        
+        if not data:
+            return
+        
+        self._decoder.feed(data)
+        
+        for frame in self._decoder.frames():
+            try:
+                info = split_response(self._response_specs, frame.tobytes())
+            except (KeyError, ValueError):
+                self.errors += 1
+                continue
+            
+            if self._callback:
+                self._callback(info)
+            else:
+                self._received.append(info)
+    
+    def handle_write(self):
+        frame = self._outgoing[0]
+        sent = self.socket.send(frame)
+        
+        if sent < len(frame):
+            # Partial write; the rest goes out on the next write event
+            self._outgoing[0] = frame[sent:]
+        else:
+            self._outgoing.popleft()
+    
+    def handle_close(self):
+        self.close()
@@ -11,25 +11,74 @@ This class defines data and methods common to both the Xbee Series 1 and
 Series 2 modules. This class should be subclassed in order to provide
 series-specific functionality.
 """
+import os, select, errno, weakref
 import struct, threading, time
-from xbee.frame import APIFrame
+from xbee.frame import APIFrame, FrameDecoder
+from xbee import samples
+from xbee.spec import compile_commands, compile_responses, split_response
 
 class ThreadQuitException(Exception):
     pass
 
+class XBeeMeta(type):
+    """
+    Compiles the api_commands and api_responses specifications of each
+    class which defines them, as the class is created
+    """
+    
+    def __init__(cls, name, bases, attrs):
+        super(XBeeMeta, cls).__init__(name, bases, attrs)
+        
+        if 'api_commands' in attrs:
+            cls._command_specs = compile_commands(attrs['api_commands'])
+        
+        if 'api_responses' in attrs:
+            cls._response_specs = compile_responses(attrs['api_responses'])
+
 class XBeeBase(threading.Thread):
     """
     Abstract base class providing basic API frame generation, validation,
     and data extraction methods for XBee modules
     """
+    __metaclass__ = XBeeMeta
+    
+    # Compiled api_commands and api_responses; populated by XBeeMeta in
+    # derived classes
+    _command_specs = None
+    _response_specs = None
+    
+    # Initial size of the transmit buffer; it grows to fit larger frames
+    TX_BUFFER_SIZE = 128
                        
-    def __init__(self, ser, shorthand=True, callback=None):
+    def __init__(self, ser, shorthand=True, callback=None,
+                 event_driven=False, escaped=False, lazy_frames=False):
         super(XBeeBase, self).__init__()
         self.serial = ser
         self.shorthand = shorthand
         self._callback = None
         self._thread_continue = False
         
+        # Whether the device is in escaped API mode (AP=2)
+        self._escaped = escaped
+        self._decoder = FrameDecoder(escaped=escaped)
+        
+        # Whether received frames are returned as FrameRecords
+        self._lazy_frames = lazy_frames
+        
+        # Outgoing frames are assembled in place in this buffer
+        self._tx_buffer = bytearray(self.TX_BUFFER_SIZE)
+        self._tx_lock = threading.Lock()
+        
+        # When event driven, the reader blocks in select() on the serial
+        # port's file descriptor instead of polling it. halt() wakes it
+        # by writing to the pipe, which is closed once the reader thread
+        # has exited, or when this instance is garbage collected.
+        self._event_driven = event_driven
+        self._wakeup_r = self._wakeup_w = None
+        
+        if event_driven:
+            self._wakeup_r, self._wakeup_w = os.pipe()
+        
         if callback:
             self._callback = callback
             self._thread_continue = True
@@ -43,6 +92,7 @@ class XBeeBase(threading.Thread):
         shutdown.
         """
         self.halt()
+        self._close_wakeup()
 
     def halt(self):
         """
@@ -54,7 +104,67 @@ class XBeeBase(threading.Thread):
         """
         if self._callback:
             self._thread_continue = False
+            self._wakeup()
             self._thread_quit.wait()
+            
+            # Nothing is left to wake up
+            self._close_wakeup()
+    
+    def rx_stats(self):
+        """
+        rx_stats: None -> {counter name:int}
+        
+        Returns the receive error counters: frames which failed their
+        checksum, and bytes skipped, and how many times, while
+        searching for the start of a frame
+        """
+        decoder = self._decoder
+        
+        return {'checksum_errors':decoder.checksum_errors,
+                'discarded_bytes':decoder.discarded_bytes,
+                'resyncs':decoder.resyncs}
+    
+    def _close_wakeup(self):
+        """
+        _close_wakeup: None -> None
+        
+        Closes the pipe used to wake a blocked reader, if any
+        """
+        if self._wakeup_w is not None:
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_r = self._wakeup_w = None
+    
+    def _wakeup(self):
+        """
+        _wakeup: None -> None
+        
+        Interrupts a reader blocked waiting for the serial port
+        """
+        if self._wakeup_w is not None:
+            os.write(self._wakeup_w, '\x00')
+    
+    def _wait_readable(self):
+        """
+        _wait_readable: None -> boolean
+        
+        Blocks until the serial port has data to read or _wakeup is
+        called. Returns True if the serial port is readable.
+        """
+        fds = [self.serial.fileno()]
+        
+        if self._wakeup_r is not None:
+            fds.append(self._wakeup_r)
+        
+        try:
+            readable = select.select(fds, [], [])[0]
+        except select.error, e:
+            # Interrupted by a signal; let the caller check for shutdown
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        
+        return self._wakeup_r not in readable
         
     def _write(self, data):
         """
@@ -63,7 +173,7 @@ class XBeeBase(threading.Thread):
         Packages the given binary data in an API frame and writes the 
         result to the serial port
         """
-        self.serial.write(APIFrame(data).output())
+        self.serial.write(APIFrame(data, self._escaped).output())
         
     def run(self):
         """
@@ -86,52 +196,45 @@ class XBeeBase(threading.Thread):
         _wait_for_frame will read from the serial port until a valid
         API frame arrives. It will then return the binary data
         contained within the frame.
+        
+        All bytes waiting on the port are read at once and handed to
+        a FrameDecoder, so several frames may be decoded from a single
+        read; any left over are returned by subsequent calls.
+        
+        When nothing is waiting, the port is polled every 10ms, or, if
+        this instance is event driven, waited on with select().
 
         If this method is called as a separate thread
         and self.thread_continue is set to False, the thread will
         exit by raising a ThreadQuitException.
         """
-        WAITING = 0
-        PARSING = 1
-        
-        data = ''
-        state = WAITING
+        decoder = self._decoder
         
         while True:
-            if state == WAITING:
-                if self._callback and not self._thread_continue:
-                    raise ThreadQuitException
-
-                if self.serial.inWaiting() == 0:
+            frame = decoder.next_frame()
+            
+            if frame is not None:
+                # Copy out of the decoder's buffer before it is reused
+                return APIFrame(frame.tobytes(), self._escaped)
+            
+            if self._callback and not self._thread_continue:
+                raise ThreadQuitException
+            
+            waiting = self.serial.inWaiting()
+            
+            if waiting == 0:
+                if not self._event_driven:
                     time.sleep(.01)
                     continue
                 
-                byte = self.serial.read()
-                
-                # If a start byte is found, swich states
-                if byte == APIFrame.START_BYTE:
-                    data += byte
-                    state = PARSING
-            else:
-                # Save all following bytes
-                data += self.serial.read()
+                if not self._wait_readable():
+                    continue
                 
-                if len(data) == 3:
-                    # We have the length bytes of the data
-                    # Now, wait for the rest to appear
-                    data_len = struct.unpack("> h", data[1:3])[0]
-                    
-                    # Wait for the expected number of bytes to appear
-                    # Grab the checksum too
-                    data += self.serial.read(data_len + 1)
-                    
-                    try:
-                        # Try to parse and return result
-                        return APIFrame.parse(data)
-                    except ValueError:
-                        # Bad frame, so restart
-                        data = ''
-                        state = WAITING
+                # Read at least one byte, so that a hung up port raises
+                # an exception instead of spinning
+                waiting = max(self.serial.inWaiting(), 1)
+            
+            decoder.feed(self.serial.read(waiting))
                         
     def _build_command(self, cmd, **kwargs):
         """
@@ -145,50 +248,40 @@ class XBeeBase(threading.Thread):
         Each field will be written out in the order they are defined
         in the command definition.
         """
-        try:
-            cmd_spec = self.api_commands[cmd]
-        except AttributeError:
+        return self._command_spec(cmd).build(kwargs)
+    
+    def _command_spec(self, cmd):
+        """
+        _command_spec: string -> CommandSpec
+        
+        Returns the compiled specification of the named command
+        """
+        if self._command_specs is None:
             raise NotImplementedError("API command specifications could not be found; use a derived class which defines 'api_commands'.")
-            
-        packet = ''
         
-        for field in cmd_spec:
-            try:
-                # Read this field's name from the function arguments dict
-                data = kwargs[field['name']]
-            except KeyError:
-                # Data wasn't given
-                # Only a problem if the field has a specific length
-                if field['len'] is not None:
-                    # Was a default value specified?
-                    default_value = field['default']
-                    if default_value:
-                        # If so, use it
-                        data = default_value
-                    else:
-                        # Otherwise, fail
-                        raise KeyError(
-                            "The expected field %s of length %d was not provided" 
-                            % (field['name'], field['len']))
-                else:
-                    # No specific length, ignore it
-                    data = None
+        return self._command_specs[cmd]
+    
+    def _send_command(self, spec, kwargs):
+        """
+        _send_command: CommandSpec, {field name:binary data} -> None
+        
+        Builds the command directly into the transmit buffer, after
+        room for the start byte and length, appends the checksum and
+        writes the whole frame to the serial port at once, escaping it
+        first in escaped mode.
+        """
+        with self._tx_lock:
+            buf = self._tx_buffer
+            end = spec.pack_into(buf, APIFrame.HEADER_SIZE, kwargs)
+            end = APIFrame.enclose(buf, 0, end)
             
-            # Ensure that the proper number of elements will be written
-            if field['len'] and len(data) != field['len']:
-                raise ValueError(
-                    "The data provided for '%s' was not %d bytes long"\
-                    % (field['name'], field['len']))
-        
-            # Add the data to the packet, if it has been specified
-            # Otherwise, the parameter was of variable length, and not 
-            #  given
-            if data:
-                packet += data
-                
-        return packet
+            if self._escaped:
+                self.serial.write(APIFrame.START_BYTE +
+                                  APIFrame.escape(str(buffer(buf, 1, end - 1))))
+            else:
+                self.serial.write(str(buffer(buf, 0, end)))
     
-    def _split_response(self, data):
+    def _split_response(self, data, lazy=False):
         """
         _split_response: binary data -> {'id':str,
                                         'param':binary data,
@@ -197,81 +290,17 @@ class XBeeBase(threading.Thread):
         _split_response takes a data packet received from an XBee device
         and converts it into a dictionary. This dictionary provides
         names for each segment of binary data as specified in the 
-        api_responses spec.
+        api_responses spec, as compiled by XBeeMeta.
+        
+        If lazy is True, a FrameRecord which decodes each field when it
+        is first accessed is returned instead.
         """
         # Fetch the first byte, identify the packet
         # If the spec doesn't exist, raise exception
-        packet_id = data[0]
-        try:
-            packet = self.api_responses[packet_id]
-        except AttributeError:
+        if self._response_specs is None:
             raise NotImplementedError("API response specifications could not be found; use a derived class which defines 'api_responses'.")
-        except KeyError:
-            raise KeyError(
-                "Unrecognized response packet with id byte %s"
-                % data[0])
-        
-        # Current byte index in the data stream
-        index = 1
-        
-        # Result info
-        info = {'id':packet['name']}
-        packet_spec = packet['structure']
-        
-        # Parse the packet in the order specified
-        for field in packet_spec:
-            # Store the number of bytes specified
-            # If the data field has no length specified, store any
-            #  leftover bytes and quit
-            if field['len'] == 'null_terminated_string':
-                field_data = ''
-                
-                while data[index] != '\x00':
-                    field_data += data[index]
-                    index += 1
-                
-                index += 1
-                info[field['name']] = field_data
-            elif field['len'] is not None:
-                # Are we trying to read beyond the last data element?
-                if index + field['len'] > len(data):
-                    raise ValueError(
-                        "Response packet was shorter than expected")
-                
-                field_data = data[index:index + field['len']]
-                info[field['name']] = field_data
-                
-                # Move the index
-                index += field['len']
-            else:
-                field_data = data[index:]
-                
-                # Were there any remaining bytes?
-                if field_data:
-                    # If so, store them
-                    info[field['name']] = field_data
-                    index += len(field_data)
-                break
-            
-            
-        # If there are more bytes than expected, raise an exception
-        if index < len(data):
-            raise ValueError(
-                "Response packet was longer than expected")
-                
-        # Check if this packet was an IO sample
-        # If so, process the sample data
-        if 'parse_as_io_samples' in packet:
-            field_to_process = packet['parse_as_io_samples']
-            info[field_to_process] = XBeeBase._parse_samples(
-                                        info[field_to_process])
-        ## or this packet could be a ZigBee IO sample (Series 2)
-        elif 'parse_as_zb_io_samples' in packet:
-            field_to_process = packet['parse_as_zb_io_samples']
-            info[field_to_process] = XBeeBase._parse_zb_samples(
-                                        info[field_to_process])
-            
-        return info
+        
+        return split_response(self._response_specs, data, lazy)
         
     @staticmethod
     def _parse_samples_header(data):
@@ -337,62 +366,12 @@ class XBeeBase(threading.Thread):
         _parse_samples reads binary data from an XBee device in the IO
         data format specified by the API. It will then return a 
         dictionary indicating the status of each enabled IO port.
-        """
         
-        ## Parse and store header information
-        header_data = XBeeBase._parse_samples_header(data)
-        len_samples, dio_enabled, adc_enabled = header_data
-        
-        samples = []
-        
-        ## Parse the samples
-        # Start at byte 3
-        byte_pos = 3
+        See xbee.samples.parse_sample_arrays for a compact
+        representation of frames carrying many samples.
+        """
         
-        for i in range(0, len_samples):
-            sample = {}
-            
-            # If one or more DIO lines are set, the first two bytes
-            # contain their values
-            if dio_enabled:
-                # Get two bytes
-                values = data[byte_pos:byte_pos + 2]
-                
-                # Read and store values for all enabled DIO lines
-                for dio in dio_enabled:
-                    # Second byte contains values for 0-7
-                    # If we want number 8, switch to the first byte, and
-                    #  move back to the beginning
-                    if dio > 7:
-                        sample["dio-%d" % dio] = True if ord(values[0]) & 2 ** (dio - 8) else False
-                    else:
-                        sample["dio-%d" % dio] = True if ord(values[1]) & 2 ** dio else False
-                
-                # Move the starting position for the next new byte
-                byte_pos += 2
-                
-            # If one or more ADC lines are set, the remaining bytes, in
-            # pairs, represent their values, MSB first.
-            if adc_enabled:
-                for adc in adc_enabled:
-                    # Analog reading stored in two bytes
-                    value_raw = data[byte_pos:byte_pos + 2]
-                    
-                    # Unpack the bits
-                    value = struct.unpack("> h", value_raw)[0]
-                    
-                    # Only 10 bits are meaningful
-                    value &= 0x3FF
-                    
-                    # Save the result
-                    sample["adc-%d" % adc] = value
-                    
-                    # Move the starting position for the next new byte
-                    byte_pos += 2
-                
-            samples.append(sample)
-            
-        return samples
+        return samples.parse_samples(data)
     
     # {{{
     @staticmethod
@@ -406,57 +385,11 @@ class XBeeBase(threading.Thread):
         _parse_zb_samples reads binary data from an XBee device in the IO
         data format specified by the API. It will then return a 
         dictionary indicating the status of each enabled IO port.
-        """
-        # number of samples (always 1?) is the first byte
-        sample_count = ord(io_bytes[0])
-        
-        # bytes 1 and 2 are the DIO mask; bits 9 and 8 aren't used
-        dio_mask = (ord(io_bytes[1]) << 8 | ord(io_bytes[2])) & 0x0E7F
-        
-        # byte 3 is the AIO mask
-        aio_mask = ord(io_bytes[3])
-        
-        # sorted lists of enabled channels; value is position of bit in mask
-        dio_chans = []
-        aio_chans = []
-        
-        for i in range(0,13):
-            if dio_mask & (1 << i):
-                dio_chans.append(i)
-        
-        dio_chans.sort()
-        
-        for i in range(0,8):
-            if aio_mask & (1 << i):
-                aio_chans.append(i)
         
-        aio_chans.sort()
-        
-        samples = []
-        
-        # split the sample data into a list, so it can be pop()'d
-        sample_bytes = [ord(c) for c in io_bytes[4:]]
-        
-        # repeat for every sample provided
-        for sample_ind in range(0, sample_count):
-            tmp_samples = {}
-            
-            if dio_chans:
-                # we have digital data
-                digital_data_set = (sample_bytes.pop(0) << 8 | sample_bytes.pop(0))
-                digital_values = dio_mask & digital_data_set
-                
-                for i in dio_chans:
-                    tmp_samples['dio-%d' % i] = (digital_values >> i) == 1
-                        
-            for i in aio_chans:
-                # only first 10 bits are significant
-                analog_sample = (sample_bytes.pop(0) << 8 | sample_bytes.pop(0)) & 0x03FF
-                tmp_samples['adc-%d' % i] = analog_sample
-            
-            samples.append(tmp_samples)
-        
-        return samples
+        See xbee.samples.parse_zb_sample_arrays for a compact
+        representation of frames carrying many samples.
+        """
+        return samples.parse_zb_samples(io_bytes)
     #}}}
     
     def send(self, cmd, **kwargs):
@@ -474,7 +407,7 @@ class XBeeBase(threading.Thread):
         (of 'None' in the specification. Those are optional).
         """
         # Pass through the keyword arguments
-        self._write(self._build_command(cmd, **kwargs))
+        self._send_command(self._command_spec(cmd), kwargs)
         
         
     def wait_read_frame(self):
@@ -484,11 +417,12 @@ class XBeeBase(threading.Thread):
         wait_read_frame calls XBee._wait_for_frame() and waits until a
         valid frame appears on the serial port. Once it receives a frame,
         wait_read_frame attempts to parse the data contained within it
-        and returns the resulting dictionary
+        and returns the resulting dictionary, or FrameRecord if this
+        instance was created with lazy_frames=True
         """
         
         frame = self._wait_for_frame()
-        return self._split_response(frame.data)
+        return self._split_response(frame.data, self._lazy_frames)
         
     def __getattr__(self, name):
         """
@@ -503,8 +437,19 @@ class XBeeBase(threading.Thread):
         
         # Is shorthand enabled, and is the called name a command?
         if self.shorthand and name in self.api_commands:
-            # If so, simply return a function which passes its arguments
-            # to an appropriate send() call
-            return lambda **kwargs: self.send(name, **kwargs)
+            # If so, return a function which passes its arguments to
+            # the command's builder, and cache it so that later lookups
+            # do not come through here. It only holds a weak reference
+            # to this instance, so __del__ still runs.
+            spec = self._command_specs[name]
+            ref = weakref.ref(self)
+            
+            def sender(**kwargs):
+                ref()._send_command(spec, kwargs)
+            
+            sender.__name__ = name
+            self.__dict__[name] = sender
+            
+            return sender
         else:
             raise AttributeError("XBee has no attribute '%s'" % name)
@@ -16,8 +16,52 @@ class APIFrame:
     
     START_BYTE = '\x7E'
     
-    def __init__(self, data):
+    # Start byte and two length bytes
+    HEADER_SIZE = 3
+    
+    # In escaped API mode (AP=2), these bytes are sent as ESCAPE_BYTE
+    # followed by the byte XOR 0x20; ESCAPE_BYTE must come first so
+    # that escapes added for the others are not escaped again
+    ESCAPE_BYTE = '\x7D'
+    ESCAPES = (('\x7D', '\x7D\x5D'),
+               ('\x7E', '\x7D\x5E'),
+               ('\x11', '\x7D\x31'),
+               ('\x13', '\x7D\x33'))
+    
+    def __init__(self, data, escaped=False):
         self.data = data
+        self.escaped = escaped
+        
+    @staticmethod
+    def escape(data):
+        """
+        escape: binary data -> binary data
+        
+        escape replaces each byte which may not appear in an escaped
+        mode frame with its escape sequence. Each byte value is
+        replaced across the whole buffer at once.
+        """
+        for byte, escaped in APIFrame.ESCAPES:
+            if byte in data:
+                data = data.replace(byte, escaped)
+        
+        return data
+        
+    @staticmethod
+    def unescape(data):
+        """
+        unescape: binary data -> binary data
+        
+        unescape reverses escape. The escaped escape byte is restored
+        last, so that it cannot combine with the following byte.
+        """
+        if APIFrame.ESCAPE_BYTE not in data:
+            return data
+        
+        for byte, escaped in reversed(APIFrame.ESCAPES):
+            data = data.replace(escaped, byte)
+        
+        return data
         
     def checksum(self):
         """
@@ -27,17 +71,7 @@ class APIFrame:
         frame, saves the last byte of the result, and subtracts it from 
         0xFF. The final result is the checksum
         """
-        total = 0
-        
-        # Add together all bytes
-        for byte in self.data:
-            total += ord(byte)
-            
-        # Only keep the last byte
-        total = total & 0xFF
-        
-        # Subtract from 0xFF
-        return chr(0xFF - total)
+        return chr(0xFF - (sum(bytearray(self.data)) & 0xFF))
 
     def verify(self, chksum):
         """
@@ -47,20 +81,7 @@ class APIFrame:
         determines whether the result is correct. The result should 
         be 0xFF.
         """
-        total = 0
-        
-        # Add together all bytes
-        for byte in self.data:
-            total += ord(byte)
-            
-        # Add checksum too
-        total += ord(chksum)
-        
-        # Only keep low bits
-        total &= 0xFF
-        
-        # Check result
-        return total == 0xFF
+        return (sum(bytearray(self.data)) + ord(chksum)) & 0xFF == 0xFF
 
     def len_bytes(self):
         """
@@ -82,33 +103,304 @@ class APIFrame:
         # start is one byte long, length is two bytes
         # data is n bytes long (indicated by length)
         # chksum is one byte long
-        return APIFrame.START_BYTE + \
-                self.len_bytes() + \
-                self.data + \
-                self.checksum()
+        # join() sizes the result once, rather than once per piece
+        if self.escaped:
+            # Everything but the start byte is escaped
+            return APIFrame.START_BYTE + APIFrame.escape(
+                ''.join((self.len_bytes(), self.data, self.checksum())))
+        
+        return ''.join((APIFrame.START_BYTE,
+                        self.len_bytes(),
+                        self.data,
+                        self.checksum()))
+        
+    def output_into(self, buf, offset=0):
+        """
+        output_into: bytearray, int -> int
+        
+        output_into writes a valid API frame into buf, starting at
+        offset, and returns the offset following the frame. buf is
+        grown if it is too small.
+        """
+        if self.escaped:
+            # The escaped length is not known in advance
+            frame = self.output()
+            end = offset + len(frame)
+            buf[offset:end] = frame
+            
+            return end
+        
+        start = offset + APIFrame.HEADER_SIZE
+        end = start + len(self.data)
+        
+        # Make room for the whole frame first, so that slice assignment
+        # cannot append the data short of its position
+        if len(buf) <= end:
+            buf.extend('\x00' * (end + 1 - len(buf)))
+        
+        buf[start:end] = self.data
+        
+        return APIFrame.enclose(buf, offset, end)
+        
+    @staticmethod
+    def enclose(buf, offset, end):
+        """
+        enclose: bytearray, int, int -> int
+        
+        Given frame data which has already been written to
+        buf[offset + HEADER_SIZE:end], enclose writes the start byte and
+        length before it and the checksum after it, growing buf if
+        needed. It returns the offset following the frame.
+        """
+        data_len = end - offset - APIFrame.HEADER_SIZE
+        
+        buf[offset] = APIFrame.START_BYTE
+        buf[offset + 1] = data_len >> 8
+        buf[offset + 2] = data_len & 0xFF
+        
+        chksum = 0xFF - (sum(buf[offset + APIFrame.HEADER_SIZE:end]) & 0xFF)
+        
+        if end < len(buf):
+            buf[end] = chksum
+        else:
+            buf.append(chksum)
+        
+        return end + 1
         
     @staticmethod
-    def parse(raw_data):
+    def parse(raw_data, escaped=False):
         """
         parse: valid API frame (binary data) -> binary data
         
         Given a valid API frame, empty_frame extracts the data contained
         inside it and verifies it against its checksum
         """
+        if escaped:
+            raw_data = raw_data[0] + APIFrame.unescape(raw_data[1:])
+        
         # First two bytes are the length of the data
         raw_len = raw_data[1:3]
         
         # Unpack it
         data_len = struct.unpack("> h", raw_len)[0]
         
-        # Read the data
+        # Read the data, and checksum it along with the checksum byte
         data = raw_data[3:3 + data_len]
-        chksum = raw_data[-1]
         
-        # Checksum check
-        frame = APIFrame(data)
-        if not frame.verify(chksum):
+        if (sum(bytearray(data)) + ord(raw_data[-1])) & 0xFF != 0xFF:
             raise ValueError("Invalid checksum on given frame")
             
         # If the result is valid, return it
-        return frame
+        return APIFrame(data, escaped)
+
+class FrameDecoder(object):
+    """
+    Incrementally extracts API frames from a stream of received bytes
+    
+    Bytes are appended to a reusable bytearray buffer in whatever
+    chunk sizes the serial port provides. Consumed space at the front
+    of the buffer is reclaimed by sliding any pending bytes back to
+    the start, so steady-state decoding does not allocate.
+    """
+    
+    DEFAULT_BUFFER_SIZE = 4096
+    
+    def __init__(self, size=DEFAULT_BUFFER_SIZE, escaped=False):
+        self.escaped = escaped
+        
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        
+        # Unconsumed bytes live in _buf[_start:_end]
+        self._start = 0
+        self._end = 0
+        
+        # Frames discarded because their checksum did not verify
+        self.checksum_errors = 0
+        
+        # Bytes skipped while searching for a start byte
+        self.discarded_bytes = 0
+        
+        # Number of times bytes were skipped to find a start byte
+        self.resyncs = 0
+        
+    def __len__(self):
+        """
+        Number of received bytes not yet consumed by next_frame
+        """
+        return self._end - self._start
+        
+    def _reserve(self, count):
+        """
+        _reserve: int -> None
+        
+        Ensures that count bytes can be appended after the pending
+        data, compacting or growing the buffer as necessary.
+        """
+        if self._end + count <= len(self._buf):
+            return
+        
+        pending = self._end - self._start
+        
+        if pending + count > len(self._buf):
+            # Grow; views handed out earlier keep the old buffer alive
+            size = len(self._buf)
+            while size < pending + count:
+                size *= 2
+            
+            buf = bytearray(size)
+            buf[0:pending] = self._buf[self._start:self._end]
+            
+            self._buf = buf
+            self._view = memoryview(buf)
+        elif pending:
+            # Slide the pending bytes to the front of the buffer
+            self._buf[0:pending] = self._buf[self._start:self._end]
+        
+        self._start = 0
+        self._end = pending
+        
+    def feed(self, data):
+        """
+        feed: binary data -> None
+        
+        Appends received bytes to the decoder
+        """
+        count = len(data)
+        self._reserve(count)
+        self._buf[self._end:self._end + count] = data
+        self._end += count
+        
+    def _discard(self, stop):
+        """
+        _discard: int -> None
+        
+        Counts the pending bytes before stop as skipped
+        """
+        if stop > self._start:
+            self.discarded_bytes += stop - self._start
+            self.resyncs += 1
+        
+    def next_frame(self):
+        """
+        next_frame: None -> memoryview or None
+        
+        Returns the data contained by the next complete, valid API
+        frame in the buffer, or None if more bytes are required. The
+        returned view refers to the decoder's buffer and is only valid
+        until the next call to feed().
+        
+        If a frame fails its checksum, only its start byte is skipped
+        and the search resumes from the following byte, so a valid
+        frame hidden inside the bad one is not lost.
+        
+        In escaped mode, the returned view is of an unescaped copy.
+        """
+        if self.escaped:
+            return self._next_escaped_frame()
+        
+        buf = self._buf
+        start_byte = APIFrame.START_BYTE
+        
+        while True:
+            start = buf.find(start_byte, self._start, self._end)
+            
+            if start == -1:
+                # Nothing but noise; drop it
+                self._discard(self._end)
+                self._start = self._end = 0
+                return None
+            
+            self._discard(start)
+            self._start = start
+            
+            if self._end - start < 3:
+                # Length bytes have not arrived yet
+                return None
+            
+            data_len = (buf[start + 1] << 8) | buf[start + 2]
+            
+            # The checksum byte follows the data
+            frame_end = start + 3 + data_len + 1
+            
+            if frame_end > self._end:
+                return None
+            
+            if sum(buf[start + 3:frame_end]) & 0xFF == 0xFF:
+                self._start = frame_end
+                return self._view[start + 3:frame_end - 1]
+            
+            # Bad frame; resync on the next start byte
+            self.checksum_errors += 1
+            self._start = start + 1
+            
+    def _next_escaped_frame(self):
+        """
+        _next_escaped_frame: None -> memoryview or None
+        
+        next_frame for escaped mode. The start byte never appears
+        within an escaped frame, so everything up to the next start
+        byte belongs to the current frame; it is unescaped in one pass.
+        """
+        buf = self._buf
+        start_byte = APIFrame.START_BYTE
+        
+        while True:
+            start = buf.find(start_byte, self._start, self._end)
+            
+            if start == -1:
+                self._discard(self._end)
+                self._start = self._end = 0
+                return None
+            
+            self._discard(start)
+            self._start = start
+            
+            following = buf.find(start_byte, start + 1, self._end)
+            stop = self._end if following == -1 else following
+            
+            raw = str(buffer(buf, start + 1, stop - start - 1))
+            
+            if following == -1 and raw.endswith(APIFrame.ESCAPE_BYTE):
+                # The rest of an escape sequence has not arrived yet
+                return None
+            
+            frame = APIFrame.unescape(raw)
+            
+            if len(frame) >= 2:
+                data_len = (ord(frame[0]) << 8) | ord(frame[1])
+                
+                if len(frame) >= data_len + 3:
+                    # Anything after the checksum is noise
+                    self._start = stop
+                    
+                    data = frame[2:2 + data_len]
+                    chksum = ord(frame[2 + data_len])
+                    
+                    if (sum(bytearray(data)) + chksum) & 0xFF == 0xFF:
+                        return memoryview(data)
+                    
+                    self.checksum_errors += 1
+                    continue
+            
+            if following == -1:
+                # Wait for the rest of the frame
+                return None
+            
+            # Truncated by the next start byte
+            self.checksum_errors += 1
+            self._start = following
+            
+    def frames(self):
+        """
+        frames: None -> iterator of memoryview
+        
+        Yields every complete frame currently in the buffer
+        """
+        while True:
+            frame = self.next_frame()
+            
+            if frame is None:
+                break
+            
+            yield frame
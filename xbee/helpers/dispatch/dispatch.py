@@ -21,6 +21,10 @@ class Dispatch(object):
             
         self.handlers = []
         self.names = set()
+        
+        # Handlers registered by frame id and/or source address, indexed
+        # by (id, address); None in either position matches any value
+        self.keyed_handlers = {}
             
     def register(self, name, callback, filter):
         """
@@ -44,6 +48,29 @@ class Dispatch(object):
         
         self.names.add(name)
         
+    def register_keyed(self, name, callback, packet_id=None, source_addr=None):
+        """
+        register_keyed: string, function: string, data -> None,
+                        string, binary data -> None
+        
+        register_keyed saves a callback to be called for every packet
+        whose 'id' is packet_id (e.g. 'zb_rx') and/or whose
+        'source_addr_long' or 'source_addr' is source_addr. Keyed
+        handlers are found with dictionary lookups, so their number
+        does not affect the cost of dispatching a packet.
+        """
+        if name in self.names:
+            raise ValueError("A callback has already been registered with the name '%s'" % name)
+        
+        if packet_id is None and source_addr is None:
+            raise ValueError("Either a packet id or a source address must be given")
+        
+        self.keyed_handlers.setdefault((packet_id, source_addr), []).append(
+            {'name':name,
+             'callback':callback})
+        
+        self.names.add(name)
+        
     def run(self, oneshot=False):
         """
         run: boolean -> None
@@ -64,10 +91,25 @@ class Dispatch(object):
         """
         dispatch: XBee data dict -> None
         
-        When called, dispatch checks the given packet against each 
-        registered callback method and calls each callback whose filter 
-        function returns true.
+        When called, dispatch calls the callbacks registered for the
+        packet's id and source address, then checks the given packet
+        against each registered filter function and calls each callback
+        whose filter function returns true.
         """
+        if self.keyed_handlers:
+            packet_id = packet.get('id')
+            
+            keys = [(packet_id, None)]
+            
+            for field in ('source_addr_long', 'source_addr'):
+                if field in packet:
+                    keys.append((packet_id, packet[field]))
+                    keys.append((None, packet[field]))
+            
+            for key in keys:
+                for handler in self.keyed_handlers.get(key, ()):
+                    handler['callback'](handler['name'], packet)
+        
         for handler in self.handlers:
             if handler['filter'](packet):
                 # Call the handler method with its associated
@@ -0,0 +1,45 @@
+"""
+bench_dispatch.py
+
+Measures Dispatch.dispatch with a few hundred handlers, registered
+either as filter functions or keyed by packet id and source address.
+
+Run with: python -m xbee.helpers.dispatch.tests.bench_dispatch
+"""
+import struct, timeit
+from xbee.helpers.dispatch import Dispatch
+
+HANDLERS = 300
+
+def addr(i):
+    return struct.pack('>Q', 0x0013a20040000000 + i)
+
+def main(number=20000):
+    callback = lambda name, packet: None
+    
+    filtered = Dispatch()
+    keyed = Dispatch()
+    
+    for i in range(0, HANDLERS):
+        filtered.register("h%d" % i, callback,
+            lambda packet, a=addr(i): packet['id'] == 'zb_rx' and \
+                                      packet['source_addr_long'] == a)
+        keyed.register_keyed("h%d" % i, callback,
+                             packet_id='zb_rx', source_addr=addr(i))
+    
+    packet = {'id':'zb_rx',
+              'source_addr_long':addr(HANDLERS / 2),
+              'source_addr':'\xda\xe0',
+              'options':'\x01',
+              'rf_data':'hello'}
+    
+    before = min(timeit.repeat(lambda: filtered.dispatch(packet),
+                               number=number, repeat=3))
+    after = min(timeit.repeat(lambda: keyed.dispatch(packet),
+                              number=number, repeat=3))
+    
+    print "%d handlers: %10.0f packets/s filtered %10.0f packets/s keyed (%.0fx)" % (
+        HANDLERS, number / before, number / after, before / after)
+
+if __name__ == '__main__':
+    main()
@@ -74,6 +74,69 @@ class TestDispatch(unittest.TestCase):
         self.assertRaises(ValueError, self.dispatch.register, "test", None, None)
         
         
+class TestKeyedDispatch(unittest.TestCase):
+    """
+    Callbacks registered by packet id and/or source address should be
+    called only for matching packets
+    """
+    
+    def setUp(self):
+        self.dispatch = Dispatch()
+        self.packet = {'id':'zb_rx',
+                       'source_addr_long':'\x00\x13\xa2\x00\x40\x32\xdc\xdc',
+                       'source_addr':'\xda\xe0',
+                       'rf_data':'hello'}
+        
+    def test_keyed_callbacks(self):
+        """
+        callbacks keyed by id, either address, or both should be called
+        """
+        checks = [CallbackCheck() for i in range(0, 4)]
+        
+        self.dispatch.register_keyed("id", checks[0].call, packet_id='zb_rx')
+        self.dispatch.register_keyed("long", checks[1].call,
+            source_addr='\x00\x13\xa2\x00\x40\x32\xdc\xdc')
+        self.dispatch.register_keyed("short", checks[2].call,
+            packet_id='zb_rx', source_addr='\xda\xe0')
+        self.dispatch.register("filter", checks[3].call, lambda data: True)
+        
+        self.dispatch.dispatch(self.packet)
+        
+        for check in checks:
+            self.assertTrue(check.called)
+        
+    def test_keyed_callbacks_not_matching(self):
+        """
+        callbacks keyed to another id or address should not be called
+        """
+        checks = [CallbackCheck() for i in range(0, 3)]
+        
+        self.dispatch.register_keyed("id", checks[0].call, packet_id='rx')
+        self.dispatch.register_keyed("addr", checks[1].call,
+            source_addr='\x00\x01')
+        self.dispatch.register_keyed("both", checks[2].call,
+            packet_id='rx', source_addr='\xda\xe0')
+        
+        self.dispatch.dispatch(self.packet)
+        
+        for check in checks:
+            self.assertFalse(check.called)
+        
+    def test_keyed_name_collisions_raise_valueerror(self):
+        """
+        keyed and filtered callbacks share one namespace
+        """
+        self.dispatch.register("test", None, None)
+        self.assertRaises(ValueError, self.dispatch.register_keyed, "test",
+                          None, packet_id='zb_rx')
+        
+    def test_key_required(self):
+        """
+        a keyed callback needs an id or an address
+        """
+        self.assertRaises(ValueError, self.dispatch.register_keyed, "test",
+                          None)
+        
 class TestHeadlessDispatch(unittest.TestCase):
     """
     Tests Dispatch functionality when it is not constructed with a serial
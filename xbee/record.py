@@ -0,0 +1,151 @@
+"""
+record.py
+
+A compact, read-mostly representation of a received frame.
+
+split_response normally decodes every field of a frame into a new
+dictionary, although most consumers only look at one or two of them.
+A FrameRecord instead keeps the frame's data and its compiled
+ResponseSpec, and slices out each field only when it is accessed. It
+supports the dictionary operations used on decoded frames, so existing
+frame['rf_data'] style code works unchanged.
+"""
+
+class FrameRecord(object):
+    """
+    A received frame whose fields are decoded on access
+    
+    Decoded IO samples and any values assigned to the record (such as
+    a timestamp) are kept in a dictionary which is only created when
+    first needed.
+    """
+    __slots__ = ('_spec', '_data', '_fields')
+    
+    def __init__(self, spec, data, fields=None):
+        self._spec = spec
+        self._data = data
+        self._fields = fields
+    
+    def __getitem__(self, name):
+        fields = self._fields
+        
+        if fields is not None and name in fields:
+            return fields[name]
+        
+        if self._data is None:
+            raise KeyError(name)
+        
+        value = self._spec.field(self._data, name)
+        
+        if name == self._spec.samples_field:
+            # Decoding samples is costly, and they are mutable
+            self[name] = value
+        
+        return value
+    
+    def __setitem__(self, name, value):
+        if self._fields is None:
+            self._fields = {}
+        
+        self._fields[name] = value
+    
+    def __contains__(self, name):
+        fields = self._fields
+        
+        if fields is not None and name in fields:
+            return True
+        
+        if self._data is None:
+            return False
+        
+        if name == 'id':
+            return True
+        
+        try:
+            start, end = self._spec.offsets[name]
+        except KeyError:
+            return False
+        
+        # Tails are omitted when empty
+        return end is not None or len(self._data) > start
+    
+    has_key = __contains__
+    
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        if self._data is None:
+            names = []
+        else:
+            names = self._spec.names(self._data)
+        
+        if self._fields is not None:
+            names.extend(name for name in self._fields if name not in names)
+        
+        return names
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def items(self):
+        return self.to_dict().items()
+    
+    def to_dict(self):
+        """
+        to_dict: None -> {field name:value}
+        
+        Returns the fully decoded frame as a dictionary, as returned
+        by split_response when not lazy, plus any assigned values
+        """
+        fields = self._fields
+        
+        if self._data is None:
+            return dict(fields)
+        
+        # Decoding every field at once is cheapest with the spec's
+        # generated decoder
+        spec = self._spec
+        info = spec.unpack(self._data)
+        name = spec.samples_field
+        
+        if name in info and (fields is None or name not in fields):
+            info[name] = spec.parse_samples(info[name])
+        
+        if fields is not None:
+            info.update(fields)
+        
+        return info
+    
+    def __eq__(self, other):
+        if isinstance(other, FrameRecord):
+            other = other.to_dict()
+        
+        return self.to_dict() == other
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def raw(self):
+        """
+        raw: None -> binary data or None
+        
+        Returns the packet the fields are decoded from, or None if
+        they were all decoded up front
+        """
+        return self._data
+    
+    __hash__ = None
+    
+    def __reduce__(self):
+        # Pickle as a plain dictionary, rather than with the spec
+        return (dict, (self.items(),))
+    
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.to_dict())
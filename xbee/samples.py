@@ -0,0 +1,183 @@
+"""
+samples.py
+
+Decoding of the IO sample data carried by rx_io_data (Series 1) and
+zb_rx_io_data (ZigBee) frames.
+
+Both formats begin with a header giving the number of samples and the
+enabled channels, followed by each sample as a 16-bit word of digital
+values (if any digital channel is enabled) and a 16-bit word per
+enabled analog channel. The channel layout for each combination of
+enabled channels is computed once, so decoding walks the data by
+offset with a single struct unpack per sample.
+
+Samples may be returned either as a list of dictionaries, one per
+sample, or as one compact array per channel.
+"""
+import array, struct, sys
+
+# Only 10 bits of each analog reading are meaningful
+ADC_MASK = 0x03FF
+
+# Series 1 header: sample count, then ADC/DIO8 and DIO 0-7 enable flags
+_HEADER = struct.Struct('>BBB')
+
+# ZigBee header: sample count, DIO enable mask, analog enable mask
+_ZB_HEADER = struct.Struct('>BHB')
+
+# ZigBee DIO lines 9 and 8 aren't used
+_ZB_DIO_MASK = 0x0E7F
+
+class _Layout(object):
+    """
+    Names, masks and the per-sample struct for one combination of
+    enabled channels
+    """
+    
+    def __init__(self, dio_mask, adc_mask):
+        # (channel name, bit in the digital word)
+        self.dio = tuple(('dio-%d' % i, 1 << i)
+                         for i in range(16) if dio_mask & (1 << i))
+        self.adc = tuple('adc-%d' % i
+                         for i in range(8) if adc_mask & (1 << i))
+        
+        # Number of 16-bit words per sample
+        self.width = (1 if self.dio else 0) + len(self.adc)
+        self.sample = struct.Struct('>%dH' % self.width)
+
+# (dio mask, adc mask) -> _Layout; devices use only a few combinations
+_layouts = {}
+
+def _layout(dio_mask, adc_mask):
+    try:
+        return _layouts[(dio_mask, adc_mask)]
+    except KeyError:
+        layout = _layouts[(dio_mask, adc_mask)] = _Layout(dio_mask, adc_mask)
+        return layout
+
+def _header(data):
+    """
+    _header: Series 1 IO data -> (int, _Layout)
+    """
+    count, flags, dio_low = _HEADER.unpack_from(data)
+    
+    # DIO8 is the lowest bit of the first flag byte, ADC 0-5 follow it
+    dio_mask = ((flags & 0x01) << 8) | dio_low
+    adc_mask = (flags >> 1) & 0x3F
+    
+    return count, _layout(dio_mask, adc_mask)
+
+def _zb_header(data):
+    """
+    _zb_header: ZigBee IO data -> (int, _Layout)
+    """
+    count, dio_mask, adc_mask = _ZB_HEADER.unpack_from(data)
+    
+    return count, _layout(dio_mask & _ZB_DIO_MASK, adc_mask)
+
+def _to_dicts(data, offset, count, layout):
+    """
+    Decodes count samples starting at offset into dictionaries
+    """
+    dio = layout.dio
+    adc = layout.adc
+    unpack_from = layout.sample.unpack_from
+    size = layout.sample.size
+    
+    if offset + size * count > len(data):
+        raise ValueError("IO sample data was shorter than expected")
+    
+    samples = []
+    
+    for i in xrange(count):
+        values = unpack_from(data, offset)
+        offset += size
+        
+        sample = {}
+        
+        if dio:
+            digital = values[0]
+            
+            for name, bit in dio:
+                sample[name] = (digital & bit) != 0
+            
+            values = values[1:]
+        
+        for name, value in zip(adc, values):
+            sample[name] = value & ADC_MASK
+        
+        samples.append(sample)
+    
+    return samples
+
+def _to_arrays(data, offset, count, layout):
+    """
+    Decodes count samples starting at offset into an array per channel
+    """
+    end = offset + layout.sample.size * count
+    
+    if end > len(data):
+        raise ValueError("IO sample data was shorter than expected")
+    
+    # All samples are big-endian 16-bit words; convert them in one pass
+    words = array.array('H', data[offset:end])
+    
+    if sys.byteorder == 'little':
+        words.byteswap()
+    
+    width = layout.width
+    channels = {}
+    column = 0
+    
+    if layout.dio:
+        digital = words[0::width]
+        
+        for name, bit in layout.dio:
+            channels[name] = array.array('B', [(d & bit) != 0 for d in digital])
+        
+        column = 1
+    
+    for name in layout.adc:
+        channels[name] = array.array(
+            'H', [v & ADC_MASK for v in words[column::width]])
+        column += 1
+    
+    return channels
+
+def parse_samples(data):
+    """
+    parse_samples: binary data in XBee IO data format ->
+                    [ {"dio-0":True,
+                       "dio-1":False,
+                       "adc-0":100"}, ...]
+    """
+    count, layout = _header(data)
+    return _to_dicts(data, _HEADER.size, count, layout)
+
+def parse_sample_arrays(data):
+    """
+    parse_sample_arrays: binary data in XBee IO data format ->
+                    {"dio-0":array('B', [1, ...]),
+                     "adc-0":array('H', [100, ...]), ...}
+    """
+    count, layout = _header(data)
+    return _to_arrays(data, _HEADER.size, count, layout)
+
+def parse_zb_samples(data):
+    """
+    parse_zb_samples: binary data in XBee ZigBee IO data format ->
+                    [ {"dio-0":True,
+                       "dio-1":False,
+                       "adc-0":100"}, ...]
+    """
+    count, layout = _zb_header(data)
+    return _to_dicts(data, _ZB_HEADER.size, count, layout)
+
+def parse_zb_sample_arrays(data):
+    """
+    parse_zb_sample_arrays: binary data in XBee ZigBee IO data format ->
+                    {"dio-0":array('B', [1, ...]),
+                     "adc-0":array('H', [100, ...]), ...}
+    """
+    count, layout = _zb_header(data)
+    return _to_arrays(data, _ZB_HEADER.size, count, layout)
@@ -0,0 +1,433 @@
+"""
+spec.py
+
+Compiled forms of the api_commands and api_responses specifications
+defined by XBeeBase subclasses.
+
+The specifications are plain lists of field dictionaries, which are
+convenient to write but slow to interpret for every frame. Each one is
+compiled once, when its class is created: responses into struct.Struct
+objects and tuples of field names, commands into flat field tuples
+which can be packed directly into a transmit buffer.
+"""
+import struct
+from itertools import izip
+from xbee import samples
+from xbee.record import FrameRecord
+
+class ResponseSpec(object):
+    """
+    A compiled api_responses entry
+    
+    The fields of a response are split into segments of fixed-length
+    fields, each of which is decoded by a single struct.Struct. A
+    segment may be followed by a null-terminated string; the final
+    segment may be followed by a variable-length tail field which
+    receives any remaining bytes.
+    """
+    
+    def __init__(self, packet):
+        self.name = packet['name']
+        
+        # (struct.Struct, field names, null terminated field name or None)
+        self.segments = []
+        
+        # Name of the field receiving any remaining bytes, if any
+        self.tail = None
+        
+        # Field to be post-processed as IO sample data, and its format
+        self.samples_field = None
+        self.samples_format = None
+        
+        if 'parse_as_io_samples' in packet:
+            self.samples_field = packet['parse_as_io_samples']
+            self.samples_format = 'io'
+        elif 'parse_as_zb_io_samples' in packet:
+            self.samples_field = packet['parse_as_zb_io_samples']
+            self.samples_format = 'zb'
+        
+        # field name -> (start, end) within the packet, for responses
+        # whose fields are all at fixed offsets; the tail's end is None
+        self.offsets = {}
+        
+        fmt = '>'
+        names = []
+        index = 1
+        
+        for field in packet['structure']:
+            if field['len'] == 'null_terminated_string':
+                self.segments.append(
+                    (struct.Struct(fmt), tuple(names), field['name']))
+                fmt = '>'
+                names = []
+            elif field['len'] is not None:
+                fmt += '%ds' % field['len']
+                names.append(field['name'])
+                
+                self.offsets[field['name']] = (index, index + field['len'])
+                index += field['len']
+            else:
+                # Any fields after the tail can never be populated
+                self.tail = field['name']
+                self.offsets[self.tail] = (index, None)
+                break
+        
+        self.segments.append((struct.Struct(fmt), tuple(names), None))
+        
+        # The common case of fixed fields, optionally followed by a tail,
+        # gets a decoder generated specifically for it
+        self.simple = len(self.segments) == 1
+        
+        if self.simple:
+            self.unpack = self._compile_simple()
+            
+            # Length of the packet without its tail
+            self.size = index
+        else:
+            # Offsets after a null-terminated string vary
+            self.offsets = {}
+    
+    def _compile_simple(self):
+        """
+        _compile_simple: None -> function
+        
+        Generates a decoder for a response with no null-terminated
+        string, which extracts all of the fixed-length fields with a
+        single unpack call and builds the result as a dict literal.
+        Also sets record, a function which wraps a packet in a lazy
+        FrameRecord after checking its length.
+        """
+        fixed, names = self.segments[0][:2]
+        end = 1 + fixed.size
+        
+        lines = ["def unpack(data):",
+                 "    size = len(data)",
+                 "    if size < %d:" % end,
+                 "        raise ValueError('Response packet was shorter than expected')"]
+        
+        targets = ['f%d' % i for i in range(len(names))]
+        
+        if names:
+            lines.append("    %s, = unpack_from(data, 1)" % ", ".join(targets))
+        
+        items = ["'id':name"] + ["%r:%s" % (n, t) for n, t in zip(names, targets)]
+        lines.append("    info = {%s}" % ", ".join(items))
+        
+        lines.append("    if size > %d:" % end)
+        
+        if self.tail is not None:
+            lines.append("        info[%r] = data[%d:]" % (self.tail, end))
+        else:
+            lines.append("        raise ValueError('Response packet was longer than expected')")
+        
+        lines.append("    return info")
+        
+        # The lazy equivalent only checks the packet's length
+        lines.extend(["def record(data):",
+                      "    size = len(data)",
+                      "    if size < %d:" % end,
+                      "        raise ValueError('Response packet was shorter than expected')"])
+        
+        if self.tail is None:
+            lines.extend(["    if size > %d:" % end,
+                          "        raise ValueError('Response packet was longer than expected')"])
+        
+        lines.append("    return FrameRecord(spec, data)")
+        
+        namespace = {'unpack_from':fixed.unpack_from, 'name':self.name,
+                     'FrameRecord':FrameRecord, 'spec':self}
+        exec "\n".join(lines) in namespace
+        
+        self.record = namespace['record']
+        
+        return namespace['unpack']
+    
+    def unpack(self, data):
+        """
+        unpack: binary data -> {'id':str, field name:binary data, ...}
+        
+        Splits a received packet, including its leading id byte, into
+        a dictionary of named fields. Responses without a null-terminated
+        string are instead decoded by a function from _compile_simple.
+        """
+        size = len(data)
+        info = {}
+        index = 1
+        
+        for fixed, names, string_name in self.segments:
+            end = index + fixed.size
+            
+            if end > size:
+                raise ValueError("Response packet was shorter than expected")
+            
+            info.update(izip(names, fixed.unpack_from(data, index)))
+            index = end
+            
+            if string_name is not None:
+                end = data.find('\x00', index)
+                
+                if end == -1:
+                    raise ValueError("Response packet was shorter than expected")
+                
+                info[string_name] = data[index:end]
+                index = end + 1
+        
+        info['id'] = self.name
+        
+        if self.tail is not None and index < size:
+            info[self.tail] = data[index:]
+            index = size
+        
+        # If there are more bytes than expected, raise an exception
+        if index < size:
+            raise ValueError("Response packet was longer than expected")
+        
+        return info
+    
+    def names(self, data):
+        """
+        names: binary data -> [field name, ...]
+        
+        Returns the names of the fields present in a packet accepted
+        by record(), including 'id'.
+        """
+        names = ['id']
+        names.extend(self.segments[0][1])
+        
+        if self.tail is not None and len(data) > self.size:
+            names.append(self.tail)
+        
+        return names
+    
+    def field(self, data, name):
+        """
+        field: binary data, field name -> binary data or IO samples
+        
+        Decodes a single field of a packet accepted by record().
+        Raises KeyError if the packet has no such field.
+        """
+        if name == 'id':
+            return self.name
+        
+        start, end = self.offsets[name]
+        
+        if end is None and len(data) <= start:
+            # Tails are omitted when empty
+            raise KeyError(name)
+        
+        value = data[start:end]
+        
+        if name == self.samples_field:
+            value = self.parse_samples(value)
+        
+        return value
+    
+    def parse_samples(self, data):
+        """
+        parse_samples: binary data -> [{channel name:value}, ...]
+        
+        Decodes this response's IO sample field
+        """
+        if self.samples_format == 'io':
+            return samples.parse_samples(data)
+        ## or this packet could be a ZigBee IO sample (Series 2)
+        else:
+            return samples.parse_zb_samples(data)
+
+# Distinguishes omitted command fields from those given as None
+_MISSING = object()
+
+class CommandSpec(object):
+    """
+    A compiled api_commands entry
+    
+    Field definitions are flattened into tuples so that building a
+    command does not need any dictionary lookups beyond the caller's
+    arguments. For writing into a buffer, each run of fixed-length
+    fields is also compiled into a single struct.Struct.
+    """
+    
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple((field['name'], field['len'], field['default'])
+                            for field in fields)
+        
+        # (pack_into, size, fields) for each run of fixed-length fields,
+        # and (None, None, field) for each field without a length
+        self.segments = []
+        run = []
+        
+        for field in self.fields + ((None, None, None),):
+            if field[1]:
+                run.append(field)
+                continue
+            
+            if run:
+                packer = struct.Struct(''.join('%ds' % f[1] for f in run))
+                self.segments.append((packer.pack_into, packer.size, tuple(run)))
+                run = []
+            
+            if field[0] is not None:
+                self.segments.append((None, None, field))
+        
+        self.segments = tuple(self.segments)
+        
+    def values(self, kwargs):
+        """
+        values: {field name:binary data} -> [binary data, ...]
+        
+        Returns the data to be written for each field, in order,
+        applying defaults and validating lengths. Fields without a
+        specific length which were not given are omitted.
+        """
+        values = []
+        get = kwargs.get
+        
+        for name, length, default in self.fields:
+            data = get(name, _MISSING)
+            
+            if data is _MISSING:
+                # Only a problem if the field has a specific length
+                if length is None:
+                    continue
+                
+                if not default:
+                    raise KeyError(
+                        "The expected field %s of length %d was not provided"
+                        % (name, length))
+                
+                data = default
+            
+            # Ensure that the proper number of elements will be written
+            if length and len(data) != length:
+                raise ValueError(
+                    "The data provided for '%s' was not %d bytes long"
+                    % (name, length))
+            
+            if data:
+                values.append(data)
+        
+        return values
+        
+    def build(self, kwargs):
+        """
+        build: {field name:binary data} -> binary data
+        """
+        return ''.join(self.values(kwargs))
+        
+    def pack_into(self, buf, offset, kwargs):
+        """
+        pack_into: bytearray, int, {field name:binary data} -> int
+        
+        Writes the command into buf starting at offset, growing buf if
+        it is too small, and returns the offset following the command.
+        offset must not be beyond the end of buf, and buf must not have
+        any memoryviews exported while it may grow.
+        
+        Fields are written at a running offset, each run of fixed-length
+        fields by its struct's pack_into and other fields by slice
+        assignment; buf is grown first if a run doesn't fit.
+        """
+        size = len(buf)
+        get = kwargs.get
+        
+        for pack, length, fields in self.segments:
+            if pack is None:
+                data = get(fields[0])
+                
+                # omitted, like empty data, if not given
+                if not data:
+                    continue
+                
+                end = offset + len(data)
+                buf[offset:end] = data
+                size = len(buf)
+                offset = end
+                continue
+            
+            args = []
+            
+            for name, field_length, default in fields:
+                data = get(name, _MISSING)
+                
+                if data is _MISSING:
+                    if not default:
+                        raise KeyError(
+                            "The expected field %s of length %d was not provided"
+                            % (name, field_length))
+                    
+                    data = default
+                
+                if len(data) != field_length:
+                    raise ValueError(
+                        "The data provided for '%s' was not %d bytes long"
+                        % (name, field_length))
+                
+                args.append(data)
+            
+            end = offset + length
+            
+            if end > size:
+                buf.extend('\x00' * (end - size))
+                size = end
+            
+            pack(buf, offset, *args)
+            offset = end
+        
+        return offset
+
+def compile_commands(api_commands):
+    """
+    compile_commands: api_commands dict -> {command name:CommandSpec}
+    """
+    return dict((name, CommandSpec(name, fields))
+                for name, fields in api_commands.items())
+
+def compile_responses(api_responses):
+    """
+    compile_responses: api_responses dict -> {id byte:ResponseSpec}
+    """
+    return dict((packet_id, ResponseSpec(packet))
+                for packet_id, packet in api_responses.items())
+
+def split_response(response_specs, data, lazy=False):
+    """
+    split_response: {id byte:ResponseSpec}, binary data ->
+                                        {'id':str,
+                                         'param':binary data,
+                                         ...}
+    
+    Decodes a packet received from an XBee device with the compiled
+    specification matching its id byte, including any IO samples.
+    
+    If lazy is True, a FrameRecord is returned instead of a dictionary;
+    its fields are only decoded when they are accessed.
+    """
+    try:
+        packet = response_specs[data[0]]
+    except KeyError:
+        raise KeyError(
+            "Unrecognized response packet with id byte %s"
+            % data[0])
+    
+    if lazy and packet.simple:
+        # Only the length is checked now
+        return packet.record(data)
+    
+    # All fixed-length fields are extracted by a single unpack
+    info = packet.unpack(data)
+    
+    # Check if this packet was an IO sample
+    # If so, process the sample data
+    field_to_process = packet.samples_field
+    
+    if field_to_process is not None:
+        info[field_to_process] = packet.parse_samples(info[field_to_process])
+    
+    if lazy:
+        # Fields after a null-terminated string have no fixed offset,
+        # so these are decoded up front
+        return FrameRecord(packet, None, info)
+    
+    return info
+
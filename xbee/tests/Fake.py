@@ -8,6 +8,7 @@ pmalmsten@gmail.com
 Provides fake device objects for other unit tests.
 """
 import sys
+import os, fcntl, termios, struct, tty
 
 class FakeDevice:
     """
@@ -54,3 +55,54 @@ class FakeReadDevice:
         Returns the number of bytes available to be read
         """
         return len(self.data) - self.read_index
+
+class FakePtyDevice:
+    """
+    Represents a serial port backed by a pseudo-terminal, so that
+    readers which wait on a real file descriptor can be tested. Data
+    written to the master end with write_master() may be read from
+    this device.
+    """
+    
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        
+        # Pass bytes through untouched
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        
+    def fileno(self):
+        return self.slave
+        
+    def inWaiting(self):
+        """
+        Returns the number of bytes available to be read
+        """
+        buf = fcntl.ioctl(self.slave, termios.FIONREAD, struct.pack('I', 0))
+        return struct.unpack('I', buf)[0]
+        
+    def read(self, length=1):
+        """
+        Read up to the indicated number of bytes from the port
+        """
+        return os.read(self.slave, length)
+        
+    def write(self, data):
+        os.write(self.slave, data)
+        
+    def write_master(self, data):
+        """
+        Writes data which will appear on the port
+        """
+        os.write(self.master, data)
+        
+    def read_master(self, length):
+        """
+        Reads data written to the port
+        """
+        return os.read(self.master, length)
+        
+    def close(self):
+        os.close(self.slave)
+        os.close(self.master)
+
@@ -0,0 +1,90 @@
+#! /usr/bin/python
+"""
+bench_build_command.py
+
+Measures how many frames per second can be sent with the shorthand
+command methods, compared with the original field-by-field
+_build_command and __getattr__ lambda. The frames written by both
+paths are checked to be identical first.
+
+Run with: python -m xbee.tests.bench_build_command
+"""
+import timeit
+from xbee.frame import APIFrame
+from xbee.impl import XBee
+from xbee.tests.Fake import FakeDevice
+
+DEST = '\x00\x13\xa2\x00\x40\x32\xdc\xdc'
+
+COMMANDS = {
+    'remote_at':
+        {'frame_id':'\x01', 'dest_addr_long':DEST, 'command':'D0',
+         'parameter':'\x05'},
+    'zb_tx_request':
+        {'frame_id':'\x02', 'dest_addr_long':DEST,
+         'data':'\xff\x55\x02M\x80\x2e'},
+}
+
+def build_command(xbee, cmd, **kwargs):
+    """
+    The original _build_command
+    """
+    packet = ''
+    
+    for field in xbee.api_commands[cmd]:
+        try:
+            data = kwargs[field['name']]
+        except KeyError:
+            if field['len'] is not None:
+                default_value = field['default']
+                if default_value:
+                    data = default_value
+                else:
+                    raise KeyError(
+                        "The expected field %s of length %d was not provided" 
+                        % (field['name'], field['len']))
+            else:
+                data = None
+        
+        if field['len'] and len(data) != field['len']:
+            raise ValueError(
+                "The data provided for '%s' was not %d bytes long"\
+                % (field['name'], field['len']))
+        
+        if data:
+            packet += data
+    
+    return packet
+
+def legacy_shorthand(xbee, name):
+    """
+    The original __getattr__ shorthand, which builds a new function on
+    every call
+    """
+    return lambda **kwargs: xbee.serial.write(
+        APIFrame(build_command(xbee, name, **kwargs)).output())
+
+def main(number=100000):
+    device = FakeDevice()
+    xbee = XBee(device)
+    
+    for name in sorted(COMMANDS):
+        kwargs = COMMANDS[name]
+        
+        legacy_shorthand(xbee, name)(**kwargs)
+        expected = device.data
+        getattr(xbee, name)(**kwargs)
+        assert device.data == expected, "%s frames differ" % name
+        
+        before = min(timeit.repeat(
+            lambda: legacy_shorthand(xbee, name)(**kwargs),
+            number=number, repeat=3))
+        after = min(timeit.repeat(
+            lambda: getattr(xbee, name)(**kwargs),
+            number=number, repeat=3))
+        
+        print "%-14s %10.0f frames/s before %10.0f frames/s after (%.1fx)" % (
+            name, number / before, number / after, before / after)
+
+if __name__ == '__main__':
+    main()
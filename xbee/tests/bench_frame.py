@@ -0,0 +1,99 @@
+#! /usr/bin/python
+"""
+bench_frame.py
+
+Measures APIFrame checksum, output and parse throughput against the
+original implementations, which looped over every byte with ord(),
+and the cost of escaped API mode against the unescaped path.
+
+Run with: python -m xbee.tests.bench_frame
+"""
+import struct, timeit
+from xbee.frame import APIFrame, FrameDecoder
+
+DATA = '\x90\x00\x13\xa2\x00\x40\x32\xdc\xdc\xda\xe0\x01' + \
+       'T: 770.42 Cm: 375.14 RH:  42.88 Vcc: 3332 tempC:  19.04\r\n'
+
+def legacy_checksum(data):
+    total = 0
+    
+    for byte in data:
+        total += ord(byte)
+    
+    return chr(0xFF - (total & 0xFF))
+
+def legacy_output(data):
+    return APIFrame.START_BYTE + \
+           struct.pack("> h", len(data)) + \
+           data + \
+           legacy_checksum(data)
+
+def legacy_parse(raw_data):
+    data_len = struct.unpack("> h", raw_data[1:3])[0]
+    data = raw_data[3:3 + data_len]
+    
+    total = 0
+    
+    for byte in data:
+        total += ord(byte)
+    
+    if (total + ord(raw_data[-1])) & 0xFF != 0xFF:
+        raise ValueError("Invalid checksum on given frame")
+    
+    return APIFrame(data)
+
+def main(number=100000):
+    frame = APIFrame(DATA)
+    raw = frame.output()
+    buf = bytearray(256)
+    
+    assert raw == legacy_output(DATA)
+    
+    cases = [
+        ('checksum', lambda: legacy_checksum(DATA), frame.checksum),
+        ('output', lambda: legacy_output(DATA), frame.output),
+        ('output_into', lambda: legacy_output(DATA),
+                        lambda: frame.output_into(buf)),
+        ('parse', lambda: legacy_parse(raw), lambda: APIFrame.parse(raw)),
+    ]
+    
+    for name, before_fn, after_fn in cases:
+        before = min(timeit.repeat(before_fn, number=number, repeat=3))
+        after = min(timeit.repeat(after_fn, number=number, repeat=3))
+        
+        print "%-12s %10.0f/s before %10.0f/s after (%.1fx)" % (
+            name, number / before, number / after, before / after)
+    
+    # Escaped mode, with data containing a byte which must be escaped
+    escaped_data = DATA + '\x7E'
+    
+    plain_frame = APIFrame(escaped_data)
+    escaped_frame = APIFrame(escaped_data, escaped=True)
+    
+    plain_raw = plain_frame.output() * 10
+    escaped_raw = escaped_frame.output() * 10
+    
+    plain_decoder = FrameDecoder()
+    escaped_decoder = FrameDecoder(escaped=True)
+    
+    def decode(decoder, raw):
+        decoder.feed(raw)
+        
+        for frame in decoder.frames():
+            pass
+    
+    cases = [
+        ('output', plain_frame.output, escaped_frame.output),
+        ('decode x10', lambda: decode(plain_decoder, plain_raw),
+                       lambda: decode(escaped_decoder, escaped_raw)),
+    ]
+    
+    for name, plain_fn, escaped_fn in cases:
+        plain = min(timeit.repeat(plain_fn, number=number / 10, repeat=3))
+        escaped = min(timeit.repeat(escaped_fn, number=number / 10, repeat=3))
+        
+        print "%-12s %10.0f/s unescaped %10.0f/s escaped (%.1fx the time)" % (
+            name, number / 10 / plain, number / 10 / escaped, escaped / plain)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#! /usr/bin/python
+"""
+bench_frame_record.py
+
+Compares decoding received frames into dictionaries with decoding them
+into lazy FrameRecords, both for a consumer which reads a single field
+and for the gateway's routing of a frame, which reads the id and the
+source address before publishing the whole frame. Also reports the
+memory held per frame by each representation.
+
+Run with: python -m xbee.tests.bench_frame_record
+"""
+import sys, timeit
+from xbee.impl import XBee
+from xbee.tests.bench_split_response import FRAMES
+
+def one_field(xbee, data, lazy):
+    return xbee._split_response(data, lazy)['id']
+
+def route(xbee, data, lazy):
+    frame = xbee._split_response(data, lazy)
+    frame['_timestamp'] = None
+    
+    if 'frame_id' not in frame:
+        key = (frame['id'], frame.get('source_addr_long'))
+    
+    if lazy:
+        frame = frame.to_dict()
+    
+    return frame
+
+def held(frame):
+    """
+    Bytes held by a frame and the field values only it refers to
+    """
+    if isinstance(frame, dict):
+        return sys.getsizeof(frame) + sum(sys.getsizeof(v)
+                                          for k, v in frame.items()
+                                          if k != 'id')
+    
+    return sys.getsizeof(frame) + sys.getsizeof(frame._data)
+
+def main(number=100000):
+    xbee = XBee(None)
+    
+    for name in sorted(FRAMES):
+        data = FRAMES[name]
+        
+        for label, func in (('one field', one_field), ('gateway', route)):
+            before = min(timeit.repeat(lambda: func(xbee, data, False),
+                                       number=number, repeat=3))
+            after = min(timeit.repeat(lambda: func(xbee, data, True),
+                                      number=number, repeat=3))
+            
+            print "%-14s %-10s %10.0f frames/s dict %10.0f frames/s record (%.1fx)" % (
+                name, label, number / before, number / after, before / after)
+        
+        print "%-14s %-10s %10d bytes dict %10d bytes record" % (
+            name, 'held', held(xbee._split_response(data)),
+            held(xbee._split_response(data, True)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#! /usr/bin/python
+"""
+bench_split_response.py
+
+Measures how many frames per second XBee._split_response can decode,
+compared with the original field-by-field walk of api_responses.
+
+Run with: python -m xbee.tests.bench_split_response
+"""
+import timeit
+from xbee.impl import XBee
+
+FRAMES = {
+    'zb_rx':
+        '\x90\x00\x13\xa2\x00\x40\x32\xdc\xdc\xda\xe0\x01' +
+        'T: 770.42 Cm: 375.14 RH:  42.88 Vcc: 3332 tempC:  19.04\r\n',
+    'zb_rx_io_data':
+        '\x92\x00\x13\xa2\x00\x40\x55\x6e\x7d\x52\xc1\x01' +
+        '\x01\x08\x00\x0e\x08\x00\x00\x00\x02P\x02\x06',
+    'zb_tx_status':
+        '\x8b\x01\xff\xfe\x00\x00\x00',
+}
+
+def walk_spec(xbee, data):
+    """
+    The original _split_response field walk
+    """
+    packet = xbee.api_responses[data[0]]
+    index = 1
+    info = {'id':packet['name']}
+    
+    for field in packet['structure']:
+        if field['len'] == 'null_terminated_string':
+            field_data = ''
+            
+            while data[index] != '\x00':
+                field_data += data[index]
+                index += 1
+            
+            index += 1
+            info[field['name']] = field_data
+        elif field['len'] is not None:
+            if index + field['len'] > len(data):
+                raise ValueError(
+                    "Response packet was shorter than expected")
+            
+            info[field['name']] = data[index:index + field['len']]
+            index += field['len']
+        else:
+            field_data = data[index:]
+            
+            if field_data:
+                info[field['name']] = field_data
+                index += len(field_data)
+            break
+    
+    if index < len(data):
+        raise ValueError(
+            "Response packet was longer than expected")
+    
+    if 'parse_as_zb_io_samples' in packet:
+        field_to_process = packet['parse_as_zb_io_samples']
+        info[field_to_process] = xbee._parse_zb_samples(
+                                    info[field_to_process])
+    
+    return info
+
+def main(number=100000):
+    xbee = XBee(None)
+    
+    for name in sorted(FRAMES):
+        data = FRAMES[name]
+        
+        before = min(timeit.repeat(lambda: walk_spec(xbee, data),
+                                   number=number, repeat=3))
+        after = min(timeit.repeat(lambda: xbee._split_response(data),
+                                  number=number, repeat=3))
+        
+        print "%-14s %10.0f frames/s before %10.0f frames/s after (%.1fx)" % (
+            name, number / before, number / after, before / after)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#! /usr/bin/python
+"""
+test_asyncore_impl.py
+
+Tests the asyncore based AsyncXBee driver against a pty-backed fake
+coordinator.
+"""
+import unittest
+import asyncore
+from xbee.asyncore_impl import AsyncXBee
+from xbee.tests.Fake import FakePtyDevice
+
+class TestAsyncXBee(unittest.TestCase):
+    """
+    AsyncXBee should read and write frames from within an asyncore
+    event loop
+    """
+    
+    def setUp(self):
+        self.map = {}
+        self.serial = FakePtyDevice()
+        self.xbee = AsyncXBee(self.serial, map=self.map)
+        
+    def tearDown(self):
+        self.xbee.close()
+        self.serial.close()
+        
+    def test_receive_frames(self):
+        """
+        frames written by the coordinator should be split and made
+        available in order
+        """
+        self.serial.write_master('\x7E\x00\x02\x8A\x01\x74' * 2)
+        
+        self.assertEqual(self.xbee.wait_read_frame(5),
+                         {'id':'status', 'status':'\x01'})
+        
+        asyncore.loop(timeout=0.1, map=self.map, count=1)
+        self.assertEqual(list(self.xbee.frames()),
+                         [{'id':'status', 'status':'\x01'}])
+        self.assertEqual(list(self.xbee.frames()), [])
+        
+    def test_wait_timeout(self):
+        """
+        wait_read_frame should give up after its timeout
+        """
+        self.assertEqual(self.xbee.wait_read_frame(0.2), None)
+        
+    def test_callback(self):
+        """
+        a callback should be called with each frame instead of queueing
+        it
+        """
+        received = []
+        xbee = AsyncXBee(self.serial, callback=received.append, map=self.map)
+        self.xbee.close()
+        
+        self.serial.write_master('\x7E\x00\x02\x8A\x01\x74')
+        asyncore.loop(timeout=1, map=self.map, count=1)
+        
+        self.assertEqual(received, [{'id':'status', 'status':'\x01'}])
+        self.assertEqual(list(xbee.frames()), [])
+        xbee.close()
+        
+    def test_send(self):
+        """
+        sent commands should be written by the event loop
+        """
+        self.xbee.send('at', frame_id='A', command='MY')
+        self.assertEqual(self.xbee.pending_writes(), 1)
+        
+        asyncore.loop(timeout=1, map=self.map, count=1)
+        
+        self.assertEqual(self.xbee.pending_writes(), 0)
+        self.assertEqual(self.serial.read_master(8), '\x7E\x00\x04\x08AMY\x10')
+        
+    def test_escaped(self):
+        """
+        an escaped mode instance should escape and unescape frames
+        """
+        self.xbee.close()
+        self.xbee = AsyncXBee(self.serial, escaped=True, map=self.map)
+        
+        self.serial.write_master('\x7E\x00\x02\x8A\x7D\x33\x62')
+        self.assertEqual(self.xbee.wait_read_frame(5),
+                         {'id':'status', 'status':'\x13'})
+        
+        self.xbee.send('at', frame_id='\x11', command='MY')
+        asyncore.loop(timeout=1, map=self.map, count=1)
+        
+        self.assertEqual(self.serial.read_master(9),
+                         '\x7E\x00\x04\x08\x7D\x31MY\x40')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,8 +8,10 @@ pmalmsten@gmail.com
 Tests the XBeeBase superclass module for XBee API conformance.
 """
 import unittest
+import threading, time
 from xbee.base import XBeeBase
-from xbee.tests.Fake import FakeDevice, FakeReadDevice
+from xbee.impl import XBee
+from xbee.tests.Fake import FakeDevice, FakeReadDevice, FakePtyDevice
 
 class TestWriteToDevice(unittest.TestCase):
     """
@@ -71,6 +73,19 @@ class TestReadFromDevice(unittest.TestCase):
         frame = xbee._wait_for_frame()
         self.assertEqual(frame.data, '\x05')
         
+    def test_read_multiple_frames(self):
+        """
+        _wait_for_frame should return each frame read from the device
+        in a single read, in order
+        """
+        device = FakeReadDevice(
+            '\x7E\x00\x01\x00\xFF' + '\x7E\x00\x01\x05\xFA')
+        xbee = XBeeBase(device)
+        
+        self.assertEqual(xbee._wait_for_frame().data, '\x00')
+        self.assertEqual(xbee._wait_for_frame().data, '\x05')
+        self.assertEqual(device.inWaiting(), 0)
+        
 class TestNotImplementedFeatures(unittest.TestCase):
     """
     In order to properly use the XBeeBase class for most situations,
@@ -137,6 +152,84 @@ class TestAsyncCallback(unittest.TestCase):
         """
         self.xbee = XBeeBase(self.serial, callback=self.callback)
         
+class TestEventDrivenRead(unittest.TestCase):
+    """
+    An event driven XBeeBase should wait on the serial port's file
+    descriptor rather than polling it, and must still shut down
+    promptly when halted.
+    """
+    
+    def setUp(self):
+        self.serial = FakePtyDevice()
+        self.frames = []
+        self.received = threading.Event()
+        
+    def tearDown(self):
+        self.serial.close()
+        
+    def callback(self, data):
+        self.frames.append(data)
+        self.received.set()
+        
+    def test_receive_frame(self):
+        """
+        frames written to the port should be delivered to the callback
+        """
+        xbee = XBee(self.serial, callback=self.callback,
+                    event_driven=True)
+        
+        try:
+            # split the frame across two writes
+            self.serial.write_master('\x7E\x00\x02')
+            time.sleep(.05)
+            self.serial.write_master('\x8A\x01\x74')
+            
+            self.received.wait(5)
+            self.assertEqual(self.frames, [{'id':'status', 'status':'\x01'}])
+        finally:
+            xbee.halt()
+        
+    def test_halt_when_idle(self):
+        """
+        halt should return promptly while the reader is blocked
+        """
+        xbee = XBeeBase(self.serial, callback=self.callback,
+                        event_driven=True)
+        time.sleep(.05)
+        
+        start = time.time()
+        xbee.halt()
+        
+        self.assertTrue(time.time() - start < 1)
+        
+        xbee.join(1)
+        self.assertFalse(xbee.is_alive())
+        
+    def test_read_after_halt(self):
+        """
+        a synchronous reader should still wait for frames after halt
+        """
+        xbee = XBee(self.serial, event_driven=True)
+        xbee.halt()
+        
+        # written once the reader is blocked waiting
+        writer = threading.Timer(.05, self.serial.write_master,
+                                 ['\x7E\x00\x02\x8A\x01\x74'])
+        writer.start()
+        
+        self.assertEqual(xbee.wait_read_frame(),
+                         {'id':'status', 'status':'\x01'})
+        
+    def test_halt_closes_wakeup(self):
+        """
+        halt should close the wakeup pipe once the reader thread exits
+        """
+        xbee = XBeeBase(self.serial, callback=self.callback,
+                        event_driven=True)
+        xbee.halt()
+        
+        self.assertEqual(xbee._wakeup_r, None)
+        
 class TestInitialization(unittest.TestCase):
     """
     Ensures that XBeeBase objects are properly constructed
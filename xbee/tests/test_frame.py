@@ -8,7 +8,7 @@ pmalmsten@gmail.com
 Tests frame module for proper behavior
 """
 import unittest
-from xbee.frame import APIFrame
+from xbee.frame import APIFrame, FrameDecoder
 
 class TestAPIFrameGeneration(unittest.TestCase):
     """
@@ -26,6 +26,25 @@ class TestAPIFrameGeneration(unittest.TestCase):
         frame = APIFrame(data).output()
         self.assertEqual(frame, expected_frame)
         
+    def test_checksum(self):
+        """
+        the checksum should be 0xFF less the low byte of the data's sum
+        """
+        self.assertEqual(APIFrame('\x00\x01\x02').checksum(), '\xFC')
+        self.assertEqual(APIFrame('\xFF' * 300).checksum(), '\x2B')
+        
+    def test_output_into(self):
+        """
+        output_into should write a frame at the given offset of a
+        buffer, growing it if necessary
+        """
+        buf = bytearray('abcd')
+        
+        end = APIFrame('\x00\x01\x02').output_into(buf, 2)
+        
+        self.assertEqual(end, 9)
+        self.assertEqual(buf, bytearray('ab\x7E\x00\x03\x00\x01\x02\xFC'))
+        
 class TestAPIFrameParsing(unittest.TestCase):
     """
     XBee class must be able to read and validate the data contained
@@ -48,3 +67,172 @@ class TestAPIFrameParsing(unittest.TestCase):
         """
         frame = '\x7E\x00\x01\x00\xF6'
         self.assertRaises(ValueError, APIFrame.parse, frame)
+        
+    def test_verify(self):
+        """
+        verify should accept only the correct checksum byte
+        """
+        frame = APIFrame('\x00\x01\x02')
+        
+        self.assertTrue(frame.verify('\xFC'))
+        self.assertFalse(frame.verify('\xFD'))
+
+class TestEscapedAPIFrame(unittest.TestCase):
+    """
+    In escaped API mode, frames must escape the reserved bytes
+    everywhere but the start byte.
+    """
+    
+    def test_escape_round_trip(self):
+        """
+        unescape should reverse escape for every byte value
+        """
+        data = ''.join(chr(i) for i in range(256)) * 2
+        escaped = APIFrame.escape(data)
+        
+        for byte in '\x7E\x11\x13':
+            self.assertFalse(byte in escaped)
+        
+        self.assertEqual(len(escaped), len(data) + 8)
+        self.assertEqual(APIFrame.unescape(escaped), data)
+        
+    def test_escape_escape_byte(self):
+        """
+        escaped escape bytes must not combine with the following byte
+        """
+        for data in ('\x7D\x5E', '\x7D\x7E', '\x7D\x5D\x5E'):
+            self.assertEqual(APIFrame.unescape(APIFrame.escape(data)), data)
+        
+    def test_output(self):
+        """
+        the length, data and checksum should be escaped
+        """
+        frame = APIFrame('\x7E\x11', escaped=True).output()
+        
+        # checksum is 0xFF - 0x8F = 0x70
+        self.assertEqual(frame, '\x7E\x00\x02\x7D\x5E\x7D\x31\x70')
+        
+    def test_parse(self):
+        """
+        parse should unescape a frame before verifying it
+        """
+        frame = '\x7E\x00\x02\x7D\x5E\x7D\x31\x70'
+        
+        self.assertEqual(APIFrame.parse(frame, escaped=True).data, '\x7E\x11')
+
+class TestFrameDecoder(unittest.TestCase):
+    """
+    FrameDecoder must extract valid frames from an arbitrarily chunked
+    stream of bytes and resynchronize after corrupt data.
+    """
+    
+    def setUp(self):
+        self.decoder = FrameDecoder(size=8)
+    
+    def test_single_frame(self):
+        """
+        a complete frame fed at once should be returned
+        """
+        self.decoder.feed('\x7E\x00\x01\x00\xFF')
+        self.assertEqual(self.decoder.next_frame().tobytes(), '\x00')
+        self.assertEqual(self.decoder.next_frame(), None)
+        
+    def test_partial_frame(self):
+        """
+        no frame should be returned until all of its bytes have arrived
+        """
+        self.decoder.feed('\x7E\x00')
+        self.assertEqual(self.decoder.next_frame(), None)
+        
+        self.decoder.feed('\x03\x00\x01')
+        self.assertEqual(self.decoder.next_frame(), None)
+        
+        self.decoder.feed('\x02\xFC')
+        self.assertEqual(self.decoder.next_frame().tobytes(), '\x00\x01\x02')
+        
+    def test_multiple_frames(self):
+        """
+        several frames fed at once should all be returned, in order,
+        growing the buffer as needed
+        """
+        self.decoder.feed('\x7E\x00\x01\x00\xFF' * 2 + '\x7E\x00\x01\x05\xFA')
+        
+        frames = [f.tobytes() for f in self.decoder.frames()]
+        self.assertEqual(frames, ['\x00', '\x00', '\x05'])
+        self.assertEqual(len(self.decoder), 0)
+        
+    def test_leading_noise(self):
+        """
+        bytes preceding a start byte should be discarded
+        """
+        self.decoder.feed('abc\x7E\x00\x01\x00\xFF')
+        self.assertEqual(self.decoder.next_frame().tobytes(), '\x00')
+        self.assertEqual(self.decoder.discarded_bytes, 3)
+        self.assertEqual(self.decoder.resyncs, 1)
+        
+    def test_resync_after_bad_checksum(self):
+        """
+        a frame with a bad checksum should be skipped, and a valid
+        frame starting inside of it should still be found
+        """
+        # the length bytes of the bad frame claim more data than the
+        # valid frame which follows its start byte
+        self.decoder.feed('\x7E\x00\x05' + '\x7E\x00\x01\x05\xFA')
+        self.decoder.feed('\x00\x00')
+        
+        self.assertEqual(self.decoder.next_frame().tobytes(), '\x05')
+        self.assertEqual(self.decoder.checksum_errors, 1)
+        self.assertEqual(self.decoder.resyncs, 1)
+        
+    def test_buffer_reused(self):
+        """
+        consumed space should be reclaimed rather than growing the
+        buffer
+        """
+        for i in range(0, 100):
+            self.decoder.feed('\x7E\x00\x01\x00\xFF')
+            self.assertEqual(self.decoder.next_frame().tobytes(), '\x00')
+        
+        self.assertEqual(len(self.decoder._buf), 8)
+
+class TestEscapedFrameDecoder(unittest.TestCase):
+    """
+    FrameDecoder in escaped mode must unescape frames and resync on
+    every start byte.
+    """
+    
+    def setUp(self):
+        self.decoder = FrameDecoder(escaped=True)
+        self.frame = APIFrame('\x7E\x11\x13\x7D', escaped=True).output()
+    
+    def test_escaped_frame(self):
+        """
+        an escaped frame should be returned unescaped
+        """
+        self.decoder.feed(self.frame * 2)
+        
+        frames = [f.tobytes() for f in self.decoder.frames()]
+        self.assertEqual(frames, ['\x7E\x11\x13\x7D'] * 2)
+        
+    def test_split_escape_sequence(self):
+        """
+        an escape sequence split between reads should be decoded
+        """
+        for i in range(1, len(self.frame)):
+            self.decoder.feed(self.frame[:i])
+            self.assertEqual(self.decoder.next_frame(), None)
+            
+            self.decoder.feed(self.frame[i:])
+            self.assertEqual(self.decoder.next_frame().tobytes(),
+                             '\x7E\x11\x13\x7D')
+        
+    def test_truncated_frame(self):
+        """
+        a frame cut short by the next start byte should be dropped
+        """
+        self.decoder.feed(self.frame[:5] + self.frame)
+        
+        self.assertEqual(self.decoder.next_frame().tobytes(),
+                         '\x7E\x11\x13\x7D')
+        self.assertEqual(self.decoder.checksum_errors, 1)
+
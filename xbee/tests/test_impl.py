@@ -485,6 +485,34 @@ class TestWriteToDevice(unittest.TestCase):
         expected_data = '\x7E\x00\x06\x08AMY\x00\x00\x10'
         self.assertEqual(serial_port.data, expected_data)
         
+class TestEscapedMode(unittest.TestCase):
+    """
+    An XBee in escaped API mode should escape the frames it writes and
+    unescape the frames it reads
+    """
+    
+    def test_send_escaped(self):
+        """
+        reserved bytes in a command should be escaped
+        """
+        serial_port = FakeDevice()
+        xbee = XBee(serial_port, escaped=True)
+        
+        xbee.at(frame_id='\x11', command='MY')
+        
+        # checksum is 0xFF - 0xBF = 0x40
+        self.assertEqual(serial_port.data, '\x7E\x00\x04\x08\x7D\x31MY\x40')
+        
+    def test_read_escaped(self):
+        """
+        an escaped response frame should be read and split
+        """
+        device = FakeReadDevice('\x7E\x00\x02\x8A\x7D\x33\x62')
+        xbee = XBee(device, escaped=True)
+        
+        self.assertEqual(xbee.wait_read_frame(),
+                         {'id':'status', 'status':'\x13'})
+        
 class TestSendShorthand(unittest.TestCase):
     """
     Tests shorthand for sending commands to an XBee provided by
@@ -522,6 +550,19 @@ class TestSendShorthand(unittest.TestCase):
         expected_data = '\x7E\x00\x06\x08AMY\x00\x00\x10'
         self.assertEqual(self.ser.data, expected_data)
         
+    def test_shorthand_cached(self):
+        """
+        The function returned for a shorthand command should be reused,
+        without keeping the XBee instance alive
+        """
+        import weakref
+        
+        self.assertTrue(self.xbee.at is self.xbee.at)
+        
+        ref = weakref.ref(self.xbee)
+        del self.xbee
+        self.assertEqual(ref(), None)
+        
     def test_shorthand_disabled(self):
         """
         When shorthand is disabled, any attempt at calling a 
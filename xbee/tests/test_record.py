@@ -0,0 +1,116 @@
+#! /usr/bin/python
+"""
+test_record.py
+
+Tests lazily decoded FrameRecords against the dictionaries produced by
+split_response.
+"""
+import cPickle as pickle
+import unittest
+from xbee.impl import XBee
+from xbee.record import FrameRecord
+
+class TestFrameRecord(unittest.TestCase):
+    """
+    A FrameRecord must behave like the dictionary it replaces
+    """
+    
+    ZB_RX = '\x90\x00\x13\xa2\x00\x40\x32\xdc\xdc\xda\xe0\x01hello'
+    ZB_IO = '\x92\x00\x13\xa2\x00\x40\x55\x6e\x7d\x52\xc1\x01' + \
+            '\x01\x08\x00\x0e\x08\x00\x00\x00\x02P\x02\x06'
+    
+    def setUp(self):
+        self.xbee = XBee(None)
+    
+    def test_fields(self):
+        """
+        fields should be decoded on access to the same values
+        """
+        record = self.xbee._split_response(self.ZB_RX, lazy=True)
+        
+        self.assertTrue(isinstance(record, FrameRecord))
+        self.assertEqual(record['id'], 'zb_rx')
+        self.assertEqual(record['rf_data'], 'hello')
+        self.assertEqual(record['source_addr'], '\xda\xe0')
+        self.assertEqual(record, self.xbee._split_response(self.ZB_RX))
+        
+    def test_missing_fields(self):
+        """
+        absent fields should raise KeyError and not be contained
+        """
+        record = self.xbee._split_response(self.ZB_RX[:12], lazy=True)
+        
+        self.assertRaises(KeyError, lambda: record['rf_data'])
+        self.assertRaises(KeyError, lambda: record['frame_id'])
+        self.assertFalse('rf_data' in record)
+        self.assertFalse('frame_id' in record)
+        self.assertTrue('options' in record)
+        self.assertEqual(record.get('rf_data', 'default'), 'default')
+        self.assertEqual(sorted(record.keys()),
+                         ['id', 'options', 'source_addr', 'source_addr_long'])
+        
+    def test_bad_length(self):
+        """
+        packets of the wrong length should still raise ValueError
+        """
+        self.assertRaises(ValueError, self.xbee._split_response,
+                          self.ZB_RX[:11], True)
+        self.assertRaises(ValueError, self.xbee._split_response,
+                          '\x8a\x01\x02', True)
+        
+    def test_samples(self):
+        """
+        IO samples should be decoded once
+        """
+        record = self.xbee._split_response(self.ZB_IO, lazy=True)
+        
+        self.assertEqual(record['samples'],
+                         [{'dio-11':True, 'adc-1':0, 'adc-2':592, 'adc-3':518}])
+        self.assertTrue(record['samples'] is record['samples'])
+        
+    def test_assignment(self):
+        """
+        assigned values should be kept alongside decoded fields
+        """
+        record = self.xbee._split_response(self.ZB_RX, lazy=True)
+        record['_timestamp'] = 1
+        
+        self.assertEqual(record['_timestamp'], 1)
+        self.assertTrue('_timestamp' in record)
+        self.assertEqual(record.to_dict()['_timestamp'], 1)
+        self.assertEqual(record.to_dict()['rf_data'], 'hello')
+        
+    def test_null_terminated_string(self):
+        """
+        responses with strings should be decoded up front
+        """
+        data = '\x95\x00\x13\xa2\x00\x40\x52\x2b\xaa\x7d\x84\x02' + \
+               '\x7d\x84\x00\x13\xa2\x00\x40\x52\x2b\xaa' + \
+               'TEST\x00\xff\xfe\x01\x01\xc1\x05\x10\x1e'
+        
+        record = self.xbee._split_response(data, lazy=True)
+        
+        self.assertEqual(record['ni_str'], 'TEST')
+        self.assertEqual(record, self.xbee._split_response(data))
+        self.assertEqual(record.raw(), None)
+        
+    def test_raw(self):
+        """
+        records should give access to the packet they decode
+        """
+        record = self.xbee._split_response(self.ZB_RX, lazy=True)
+        
+        self.assertEqual(record.raw(), self.ZB_RX)
+        
+    def test_pickle(self):
+        """
+        records should be pickled as plain dictionaries
+        """
+        record = self.xbee._split_response(self.ZB_RX, lazy=True)
+        copy = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        
+        self.assertEqual(type(copy), dict)
+        self.assertEqual(copy, self.xbee._split_response(self.ZB_RX))
+        
+if __name__ == '__main__':
+    unittest.main()
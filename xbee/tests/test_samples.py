@@ -0,0 +1,79 @@
+#! /usr/bin/python
+"""
+test_samples.py
+
+Tests decoding of IO sample data into dictionaries and arrays.
+"""
+import unittest
+from xbee import samples
+
+class TestZBSamples(unittest.TestCase):
+    """
+    ZigBee IO sample data should be decoded for every enabled channel
+    """
+    
+    def test_multiple_dio(self):
+        """
+        each enabled digital line should report its own bit, whatever
+        the state of the others
+        """
+        # DIO 0, 1 and 11 enabled; 0 and 11 high, 1 low
+        data = '\x01\x08\x03\x00\x08\x01'
+        
+        self.assertEqual(samples.parse_zb_samples(data),
+                         [{'dio-0':True, 'dio-1':False, 'dio-11':True}])
+        
+    def test_multiple_samples_as_arrays(self):
+        """
+        each channel of a multi-sample frame should be returned as an
+        array of its values, in order
+        """
+        # DIO 2 and ADC 0, 3 enabled; three samples
+        data = '\x03\x00\x04\x09' + \
+               '\x00\x04\x00\x10\x03\x20' + \
+               '\x00\x00\x00\x11\x07\xff' + \
+               '\x00\x04\x00\x12\x00\x00'
+        
+        arrays = samples.parse_zb_sample_arrays(data)
+        
+        self.assertEqual(sorted(arrays), ['adc-0', 'adc-3', 'dio-2'])
+        self.assertEqual(arrays['dio-2'].tolist(), [1, 0, 1])
+        self.assertEqual(arrays['adc-0'].tolist(), [0x10, 0x11, 0x12])
+        self.assertEqual(arrays['adc-3'].tolist(), [0x320, 0x3ff, 0])
+        
+        # the dictionary form must agree
+        dicts = samples.parse_zb_samples(data)
+        self.assertEqual([d['adc-3'] for d in dicts], [0x320, 0x3ff, 0])
+        self.assertEqual([d['dio-2'] for d in dicts], [True, False, True])
+        
+    def test_short_data(self):
+        """
+        data shorter than its header describes should raise ValueError
+        """
+        data = '\x02\x00\x00\x01\x00\x10'
+        
+        self.assertRaises(ValueError, samples.parse_zb_samples, data)
+        self.assertRaises(ValueError, samples.parse_zb_sample_arrays, data)
+
+class TestSamples(unittest.TestCase):
+    """
+    Series 1 IO sample data should be decoded into arrays
+    """
+    
+    def test_multiple_samples_as_arrays(self):
+        """
+        DIO8 and the ADC lines should be located from the header flags
+        """
+        # DIO8, DIO0 and ADC1 enabled; two samples
+        data = '\x02\x05\x01' + \
+               '\x01\x00\x00\x05' + \
+               '\x00\x01\x02\x06'
+        
+        arrays = samples.parse_sample_arrays(data)
+        
+        self.assertEqual(arrays['dio-8'].tolist(), [1, 0])
+        self.assertEqual(arrays['dio-0'].tolist(), [0, 1])
+        self.assertEqual(arrays['adc-1'].tolist(), [5, 0x206])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#! /usr/bin/python
+"""
+test_spec.py
+
+Tests compilation of API specifications into struct based decoders.
+"""
+import unittest
+from xbee.spec import CommandSpec, ResponseSpec
+from xbee.impl import XBee
+
+class TestResponseSpec(unittest.TestCase):
+    """
+    ResponseSpec must decode packets in the same way as the field
+    specification it was compiled from.
+    """
+    
+    def test_fixed_fields_single_struct(self):
+        """
+        consecutive fixed-length fields should be decoded by one struct
+        """
+        spec = XBee._response_specs['\x90']
+        
+        self.assertEqual(len(spec.segments), 1)
+        self.assertEqual(spec.segments[0][0].size, 11)
+        self.assertEqual(spec.tail, 'rf_data')
+        
+    def test_tail_absent(self):
+        """
+        a tail field with no data should be omitted
+        """
+        spec = ResponseSpec({'name':'test',
+                             'structure':
+                                [{'name':'a', 'len':2},
+                                 {'name':'b', 'len':None}]})
+        
+        self.assertEqual(spec.unpack('\x00AB'), {'id':'test', 'a':'AB'})
+        self.assertEqual(spec.unpack('\x00ABC'),
+                         {'id':'test', 'a':'AB', 'b':'C'})
+        
+    def test_null_terminated_string(self):
+        """
+        fields following a null-terminated string should be decoded
+        """
+        spec = ResponseSpec({'name':'test',
+                             'structure':
+                                [{'name':'a', 'len':1},
+                                 {'name':'s', 'len':'null_terminated_string'},
+                                 {'name':'b', 'len':2}]})
+        
+        self.assertEqual(spec.unpack('\x00Ahello\x00BC'),
+                         {'id':'test', 'a':'A', 's':'hello', 'b':'BC'})
+        
+    def test_unterminated_string(self):
+        """
+        a missing string terminator should raise ValueError
+        """
+        spec = XBee._response_specs['\x95']
+        self.assertRaises(ValueError, spec.unpack, '\x95' + 'A' * 30)
+        
+    def test_subclass_specs(self):
+        """
+        a subclass defining its own api_responses should get its own
+        compiled specifications
+        """
+        class CustomXBee(XBee):
+            api_responses = {'\x01':
+                                {'name':'custom',
+                                 'structure':
+                                    [{'name':'value', 'len':1}]}}
+        
+        self.assertEqual(CustomXBee(None)._split_response('\x01\x05'),
+                         {'id':'custom', 'value':'\x05'})
+        self.assertTrue('\x90' in XBee._response_specs)
+
+class TestCommandSpec(unittest.TestCase):
+    """
+    CommandSpec must build commands exactly as the field specification
+    describes.
+    """
+    
+    def setUp(self):
+        self.spec = XBee._command_specs['remote_at']
+    
+    def test_build_with_defaults(self):
+        """
+        omitted fields should be filled with their defaults
+        """
+        data = self.spec.build({'frame_id':'\x01', 'command':'D0',
+                                'parameter':'\x05'})
+        
+        self.assertEqual(data,
+            '\x17\x01' + '\x00' * 8 + '\xFF\xFE\x02D0\x05')
+        
+    def test_missing_field(self):
+        """
+        a required field without a default should raise KeyError
+        """
+        self.assertRaises(KeyError, self.spec.build, {'frame_id':'\x01'})
+        
+    def test_wrong_length(self):
+        """
+        a fixed-length field of the wrong length should raise ValueError
+        """
+        self.assertRaises(ValueError, self.spec.build,
+                          {'command':'D', 'dest_addr':'\x00'})
+        
+    def test_pack_into_grows_buffer(self):
+        """
+        pack_into should write at the given offset, growing the buffer
+        as needed
+        """
+        spec = CommandSpec('test',
+                           [{'name':'id',   'len':1,    'default':'\x42'},
+                            {'name':'data', 'len':None, 'default':None}])
+        buf = bytearray(4)
+        
+        end = spec.pack_into(buf, 3, {'data':'abcdef'})
+        
+        self.assertEqual(end, 10)
+        self.assertEqual(buf[3:end], bytearray('\x42abcdef'))
+        
+    def test_pack_into_matches_build(self):
+        """
+        pack_into should write the same bytes as build for every command,
+        over whatever the buffer held before
+        """
+        kwargs = {'frame_id':'\x01', 'command':'D0', 'parameter':'\x05',
+                  'dest_addr_long':'\x00\x13\xa2\x00\x40\x32\xdc\xdc',
+                  'dest_addr':'\xff\xfe', 'data':'hello'}
+        
+        for name, spec in XBee._command_specs.items():
+            buf = bytearray('\xaa' * 64)
+            
+            try:
+                expected = spec.build(kwargs)
+            except (KeyError, ValueError), e:
+                self.assertRaises(type(e), spec.pack_into, buf, 3, kwargs)
+                continue
+            
+            end = spec.pack_into(buf, 3, kwargs)
+            
+            self.assertEqual(buf[3:end], bytearray(expected), name)
+            self.assertEqual(buf[:3], bytearray('\xaa' * 3))
+        
+    def test_pack_into_fixed_run(self):
+        """
+        consecutive fixed-length fields should be packed by one struct
+        """
+        self.assertEqual([length for pack, length, fields in self.spec.segments],
+                         [15, None])
+        
+    def test_pack_into_errors(self):
+        """
+        pack_into should reject missing and wrong-length fields as build
+        does
+        """
+        buf = bytearray(64)
+        
+        self.assertRaises(KeyError, self.spec.pack_into, buf, 3,
+                          {'frame_id':'\x01'})
+        self.assertRaises(ValueError, self.spec.pack_into, buf, 3,
+                          {'command':'D', 'dest_addr':'\x00'})
+
+if __name__ == '__main__':
+    unittest.main()
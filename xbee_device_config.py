@@ -242,35 +242,29 @@ def main(argv=None):
             SH = gw._send_remote_at("00:00:00:00:00:00:00:00", "SH")['parameter']
             SL = gw._send_remote_at("00:00:00:00:00:00:00:00", "SL")['parameter']
         
-        for addr in sections:
-            logging.info("configuring %s", addr)
+        for section in sections:
+            logging.info("configuring %s", section)
             
             if point_to_me:
                 CONFIG_DATA[section]['DH'] = SH
                 CONFIG_DATA[section]['DL'] = SL
             
-            # need AC as the last command, to make it take effect
-            for opt in CONFIG_DATA[section].keys():
-                val = CONFIG_DATA[section][opt]
-                
+            # several parameters are set at once; need AC as the last
+            # command, once they've all been answered, to make it take effect
+            settings = CONFIG_DATA[section].items()
+            
+            frames = gw._send_remote_at_many(section, settings)
+            
+            for (opt, val), frame in zip(settings, frames):
                 logging.debug(str((section, opt, val)))
+                logging.debug(str(frame))
                 
-                resend = True
-                while resend:
-                    frame = gw._send_remote_at(section, opt, param_val = val)
-                    
-                    logging.debug(str(frame))
-                    
-                    if frame['status'] == '\x00':
-                        resend = False
-                        logging.info("set %s = '%s'", opt, unicode(val, errors='replace'))
-                    elif frame['status'] == '\x04':
-                        logging.warn("timeout setting %s", opt)
-                    else:
-                        resend = False
-                        logging.error("error setting %s: %02X", opt, ord(frame['status']))
-                    
-                    break
+                if frame['status'] == '\x00':
+                    logging.info("set %s = '%s'", opt, unicode(val, errors='replace'))
+                elif frame['status'] == '\x04':
+                    logging.warn("timeout setting %s", opt)
+                else:
+                    logging.error("error setting %s: %02X", opt, ord(frame['status']))
             
             logging.debug('sending "AC"')
             
@@ -319,32 +313,26 @@ def main(argv=None):
         addr = query_addr
         
         data = {}
-        for opt in ALL_PARAMETERS:
-            opt = opt.upper()
-            # print section, opt
-            
-            resend = True
-            while resend:
-                frame = gw._send_remote_at(addr, opt)
-                
-                if frame['status'] == '\x00':
-                    resend = False
-                    if 'parameter' in frame:
-                        val = frame['parameter']
-                        # val = "0x" + "".join('%02X' % ord(x) for x in frame['parameter'])
-                        # print query_addr, opt, " ".join('%02X' % ord(x) for x in frame['parameter'])
-                        # print opt, val #, "(%d)" % int(val, 16)
-                        data[opt] = val
-                    else:
-                        logging.error("no parameter in frame for command %s! %s", opt, str(frame))
-                elif frame['status'] == '\x04':
-                    logging.warn("timeout querying %s", opt)
+        opts = [opt.upper() for opt in ALL_PARAMETERS]
+        
+        # several queries are kept in flight at once
+        frames = gw._send_remote_at_many(addr, [(opt, None) for opt in opts])
+        
+        for opt, frame in zip(opts, frames):
+            if frame['status'] == '\x00':
+                if 'parameter' in frame:
+                    val = frame['parameter']
+                    # val = "0x" + "".join('%02X' % ord(x) for x in frame['parameter'])
+                    # print query_addr, opt, " ".join('%02X' % ord(x) for x in frame['parameter'])
+                    # print opt, val #, "(%d)" % int(val, 16)
+                    data[opt] = val
                 else:
-                    resend = False
-                    # logging.error("error querying %s: %02X", opt, ord(frame['status']))
-                    # logged by BaseConsumer
-                    
-                break
+                    logging.error("no parameter in frame for command %s! %s", opt, str(frame))
+            elif frame['status'] == '\x04':
+                logging.warn("timeout querying %s", opt)
+            # else:
+            #     logging.error("error querying %s: %02X", opt, ord(frame['status']))
+            #     logged by BaseConsumer
                     
         pprint(data)
     
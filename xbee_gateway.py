@@ -11,92 +11,179 @@ to the raw_xbee_frames exchange, with the addition of a _timestamp key whose
 value is a datetime instance. XBee frame transmission to remote devices are
 handled via the RPC mechanism detailed in the RabbitMQ tutorial[1]; messages
 are consumed from the xbee_tx queue, and replies are published with the
-appropriate reply-to and correlation-id properties. Message bodies are
-serialized with pickle; JSON doesn't support binary data.
+appropriate reply-to and correlation-id properties. Received frames are
+sent in the compact application/x-xbee-frame encoding, which carries the
+frame's packet as the radio sent it; other message bodies are serialized
+with BSON, as JSON doesn't support binary data.
+
+Received frames are handed from the XBee reader thread to a
+BatchPublisher, which serializes and publishes them on its own thread, so
+that a slow broker can never hold up reading from the serial port.
+While the broker can't be reached, frames are written to a FrameSpool
+file instead, and replayed in order, with their original _timestamp, once
+the publisher has reconnected.
+
+Several coordinators may be given, one per serial port, to share the
+airtime of a larger network. Each device is associated with the
+coordinator it was last heard through, and requests for it are queued on
+that coordinator; requests for devices not yet heard from go to the
+first. Received frames are published to raw_xbee_frames the same way
+whichever coordinator they arrive through.
+
+Mesh retries occasionally deliver a frame twice. If a dedup window is
+given, a frame whose packet matches one already received from the same
+device within that many seconds is dropped, and counted as a duplicate.
+
+Frame rates, serial errors and latencies are recorded in a Metrics
+instance, published every METRICS_INTERVAL seconds to the events exchange
+as a "metrics" event, and optionally served as JSON over HTTP.
 
 [1] http://www.rabbitmq.com/tutorials/tutorial-six-python.html
 """
 
 import sys, os
-import random
-import datetime, time
+import datetime
 import threading
 import logging
 
 import pika
-import xbee, serial
+import serial
 
 from support import serializer_utils
+from support.batch_publisher import BatchPublisher
+from support import tx_scheduler
+from support.deadline_heap import monotonic
+from support.coordinators import Coordinator, CoordinatorRouter
+from support.metrics import Metrics, serve_metrics
+from support.frame_spool import FrameSpool
+from support.dedup_window import DedupWindow
+from support import xbee_addr
 SYSTEM_TZ = serializer_utils.SYSTEM_TZ
 
 _CONTENT_TYPE = serializer_utils.CONTENT_TYPE_BINARY
-
-# {{{ parse_addr
-def parse_addr(addr):
-    paddr = None
-    
-    if addr != None:
-        paddr = "".join(chr(int(x, 16)) for x in addr.split(":"))
-    
-    return paddr
-
-# }}}
-
-# {{{ format_addr
-def format_addr(addr):
-    return ":".join(['%02x' % ord(x) for x in addr])
-
-# }}}
+_FRAME_CONTENT_TYPE = serializer_utils.CONTENT_TYPE_XBEE_FRAME
 
 class XBeeDispatcher(object):
     RAW_XBEE_PACKET_EXCHANGE = 'raw_xbee_frames'
     
+    # frames waiting to be published; more are dropped
+    PUBLISH_QUEUE_SIZE = 1000
+    
+    # frames are published in batches of up to this many, or after this
+    # many seconds
+    PUBLISH_BATCH_SIZE = 50
+    PUBLISH_INTERVAL = 0.05
+    
+    # seconds a request waits for its replies, including time spent queued
+    # for transmission
+    REQUEST_TIMEOUT = 120
+    
+    # frames per second each radio is given, and how many may be sent back
+    # to back after an idle period
+    TX_RATE = 25
+    TX_BURST = 5
+    
+    # seconds between metrics events
+    METRICS_INTERVAL = 60
+    
+    # bytes of frames spooled while the broker is down; a day of frames
+    # from a dozen devices
+    SPOOL_SIZE = 256 * 1024 * 1024
+    
+    # seconds between attempts to reconnect to the broker, and spooled
+    # frames replayed between checks for newly received ones
+    RECONNECT_INTERVAL = 5
+    SPOOL_REPLAY_BATCH = 1000
+    
     # {{{ __init__
-    def __init__(self, broker_host, serial_port, baudrate):
+    def __init__(self, broker_host, serial_ports, baudrate, escaped = False,
+                 metrics_address = None, spool_path = None, dedup_window = None):
         super(XBeeDispatcher, self).__init__()
         
         self._logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
         
-        self.__serial_port = serial_port
+        # one coordinator per port; the first is the default route
+        self.__serial_ports = list(serial_ports)
         self.__baudrate = baudrate
         
+        # coordinators are configured with AP=2
+        self.__escaped = escaped
+        
         self.__connection_params = pika.ConnectionParameters(host = broker_host)
         
-        self.xbee = None
+        # created once the serial ports are opened
+        self.coordinators = []
+        self.__router = None
+        
+        self.__stop = threading.Event()
+        
+        # publishes received frames; only its thread uses _xb_rx_chan
+        self.__publisher = BatchPublisher(
+            self.__publish_xb_frame,
+            max_pending = self.PUBLISH_QUEUE_SIZE,
+            batch_size = self.PUBLISH_BATCH_SIZE,
+            flush_interval = self.PUBLISH_INTERVAL,
+            idle = self.__drain_spool
+        )
+        
+        # frames received while the broker is down, if spool_path is given;
+        # otherwise they're dropped
+        self.__spool = None
+        if spool_path is not None:
+            self.__spool = FrameSpool(spool_path, self.SPOOL_SIZE)
+        
+        # drops repeated frames, if dedup_window is given; sensors may
+        # legitimately send the same reading twice, so keep it short
+        self.__dedup = None
+        if dedup_window:
+            self.__dedup = DedupWindow(dedup_window)
+        
+        self.__broker_down = False
+        self.__next_reconnect = 0
+        
+        # (host, port) or Unix socket path to serve metrics on, if any
+        self.__metrics_address = metrics_address
+        self.__metrics_server = None
+        self.__metrics_thread = None
+        
+        self.metrics = Metrics()
         
-        self.__frame_id = chr(((random.randint(1, 255)) % 255) + 1)
+        # recorded on the hot paths, so looked up once here
+        self.__frame_counts = self.metrics.counter('frames')
+        self.__tx_retries = self.metrics.counter('tx_retries')
+        self.__duplicates = self.metrics.counter('duplicates')
+        self.__read_to_publish = self.metrics.histogram('read_to_publish').observe
+        self.__tx_latency = self.metrics.histogram('tx_latency').observe
         
-        self.__correlations = {}
-        self.__correlation_lock = threading.RLock()
+        self.metrics.gauge('publisher', self.__publisher.stats)
+        self.metrics.gauge('tx', self.tx_stats)
+        self.metrics.gauge('serial', self.rx_stats)
+        self.metrics.gauge('routes', lambda: self.__router and self.__router.stats())
+        
+        if self.__spool is not None:
+            self.metrics.gauge('spool', self.__spool.stats)
+        
+        if self.__dedup is not None:
+            self.metrics.gauge('dedup', self.__dedup.stats)
     
     # }}}
     
-    # {{{ __next_frame_id
-    def __next_frame_id(self):
-        # increment frame_id but constrain to 1..255.  Seems to go
-        # 2,4,6,…254,1,3,5…255. Whatever.
-        self.__frame_id = chr(((ord(self.__frame_id) + 1) % 255) + 1)
+    # {{{ tx_stats
+    def tx_stats(self):
+        """
+        returns counts of requests in flight and queued for transmission,
+        by coordinator
+        """
         
-        return self.__frame_id
+        return dict((c.name, c.tx_stats()) for c in self.coordinators)
     
     # }}}
     
-    # {{{ __reap_unfinished_requests
-    def __reap_unfinished_requests(self):
-        with self.__correlation_lock:
-            expired_requests = []
-            
-            for frame_id in self.__correlations:
-                req = self.__correlations[frame_id]
-                
-                if time.time() > req['expiration']:
-                    self._logger.debug("reaping expired request %s", req['props'].correlation_id)
-                    expired_requests.append(frame_id)
-                
-            
-            for frame_id in expired_requests:
-                del self.__correlations[frame_id]
-            
+    # {{{ rx_stats
+    def rx_stats(self):
+        """returns the serial receive error counters, by coordinator"""
+        
+        return dict((c.name, c.rx_stats()) for c in self.coordinators)
     
     # }}}
     
@@ -118,48 +205,26 @@ class XBeeDispatcher(object):
                 req['method'], req['dest'], props.correlation_id
             )
             
-            # mapping of frame id to message properties; used to direct the
-            # response
-            frame_id = self.__next_frame_id()
-            
             if props.headers == None:
                 props.headers = {}
             
-            if 'keep_alive' not in props.headers:
-                props.headers['keep_alive'] = False
+            # the consumer sends the header as str(bool)
+            keep_alive = props.headers.get('keep_alive', False) in (True, 'True')
             
-            with self.__correlation_lock:
-                self.__correlations[frame_id] = {
-                    'props' : props,
-                    'keep_alive' : bool(props.headers['keep_alive']),
-                    'expiration' : time.time() + 120,
-                }
+            # set by the consumer: RPC control commands are sent ahead of
+            # telemetry, and a queued request with the same destination and
+            # coalesce key as a newer one is replaced by it
+            priority = int(props.headers.get('priority', tx_scheduler.PRIORITY_DEFAULT))
+            coalesce_key = props.headers.get('coalesce', None)
             
-            if req['method'] == 'send_remote_at':
-                # {'method' : 'send_remote_at',
-                #  'dest' : <addr>,
-                #  'command' : …,
-                #  'param_val' : …,
-                # }
-                self.xbee.remote_at(frame_id = frame_id,
-                                    dest_addr_long = parse_addr(req['dest']),
-                                    command = req['command'],
-                                    parameter = req['param_val'])
-                
+            dest = xbee_addr.parse_addr(req['dest'])
             
-            elif req['method'] == 'send_data':
-                # {'method' : 'send_data',
-                #  'dest' : <addr>,
-                #  'data' : …,
-                # }
-                self.xbee.zb_tx_request(
-                    frame_id = frame_id,
-                    dest_addr_long = parse_addr(req['dest']),
-                    data = req['data']
-                )
-                
+            superseded = self.__router.route(dest).submit(
+                dest, req, props, keep_alive, priority, coalesce_key
+            )
             
-            self._logger.debug("XBee command sent and message ack'd")
+            if superseded is not None:
+                self.__reply_superseded(superseded, props)
             
         except:
             self._logger.error("failed processing XBee TX message",
@@ -167,14 +232,48 @@ class XBeeDispatcher(object):
     
     # }}}
     
+    # {{{ __reply_superseded
+    def __reply_superseded(self, props, superseded_by):
+        """tells the requester its request was replaced by a newer one"""
+        
+        self._logger.debug("request %s superseded by %s",
+                           props.correlation_id, superseded_by.correlation_id)
+        
+        self.__submit(
+            '',
+            props.reply_to,
+            pika.BasicProperties(
+                correlation_id = props.correlation_id,
+                content_type = _CONTENT_TYPE
+            ),
+            {'id' : 'superseded', 'superseded_by' : superseded_by.correlation_id}
+        )
+    
+    # }}}
+    
     # {{{ __dispatch_xb_frame
-    def __dispatch_xb_frame(self, frame):
-        """handles incoming XBee frames"""
+    def __dispatch_xb_frame(self, coordinator, frame):
+        """
+        handles incoming XBee frames; runs on the reader thread of the
+        coordinator the frame arrived through, so must never block on the
+        broker
+        """
+        
+        received = monotonic()
         
         # @todo make utctime, but this will affect the db logger, and the 
         # plotter, too!
         frame['_timestamp'] = SYSTEM_TZ.localize(datetime.datetime.now())
         
+        # frames are read as FrameRecords, which are sent with their packet
+        # rather than decoded; only those whose fields are all decoded up
+        # front, without keeping the packet, need a general encoding
+        content_type = _FRAME_CONTENT_TYPE
+        
+        if frame.raw() is None:
+            frame = frame.to_dict()
+            content_type = _CONTENT_TYPE
+        
         try:
             if 'frame_id' in frame:
                 # this is a response of some kind
@@ -183,55 +282,73 @@ class XBeeDispatcher(object):
                     frame['id'], ord(frame['frame_id'])
                 )
                 
-                with self.__correlation_lock:
-                    if frame['frame_id'] in self.__correlations:
-                        correlation = self.__correlations[frame['frame_id']]
-                        
-                        props = correlation['props']
-                        keep_alive = correlation['keep_alive']
-                        
-                        self._xb_rx_chan.basic_publish(
-                            exchange = '',
-                            routing_key = props.reply_to,
-                            properties = pika.BasicProperties(
-                                correlation_id = props.correlation_id,
-                                content_type = _CONTENT_TYPE
-                            ),
-                            body = serializer_utils.serialize(frame, _CONTENT_TYPE)
-                        )
-                        
-                        if not keep_alive:
-                            del self.__correlations[frame['frame_id']]
-                        
-                    else:
-                        self._logger.error(
-                            "no correlation found for response: %r", frame
-                        )
+                self.__frame_counts[(frame['id'], 'reply')] += 1
+                
+                if 'retries' in frame:
+                    self.__tx_retries[frame['id']] += ord(frame['retries'])
                 
-                # this needs to get called every now and then
-                self.__reap_unfinished_requests()
+                # frame ids are per coordinator
+                reply = coordinator.take_reply(frame['frame_id'])
+                
+                if reply is not None:
+                    props, latency = reply
+                    
+                    if latency is not None:
+                        self.__tx_latency(latency)
+                    
+                    self.__submit(
+                        '',
+                        props.reply_to,
+                        pika.BasicProperties(
+                            correlation_id = props.correlation_id,
+                            content_type = content_type
+                        ),
+                        frame,
+                        received
+                    )
+                    
+                else:
+                    self._logger.error(
+                        "no correlation found for response on %s: %r",
+                        coordinator.name, frame
+                    )
             
             else:
-                frame_addr = 'unknown'
+                frame_addr = None
                 
                 if 'source_addr' in frame:
-                    frame_addr = format_addr(frame['source_addr'])
+                    frame_addr = frame['source_addr']
                     
                     if 'source_addr_long' in frame:
-                        frame_addr = format_addr(frame['source_addr_long'])
+                        frame_addr = frame['source_addr_long']
+                        
+                        # requests for this device go out the same way
+                        self.__router.learn(frame_addr, coordinator)
+                
+                # something like "zb_rx.00:11:22:33:44:55:66:0a", or
+                # "zb_rx.unknown"; interned, so computed once per device
+                key = xbee_addr.routing_key(frame['id'], frame_addr)
                 
-                # something like "zb_rx.00:11:22:33:44:55:66:0a"
-                routing_key = '%s.%s' % (frame['id'], frame_addr)
+                # the same packet from the same device again, within the
+                # window; only frames that kept their packet are checked
+                if self.__dedup is not None and \
+                   content_type is _FRAME_CONTENT_TYPE and \
+                   self.__dedup.seen((key, hash(frame.raw())), received):
+                    self.__duplicates[key] += 1
+                    return
                 
-                self._logger.debug("routing_key: %s", routing_key)
+                self.__frame_counts[key] += 1
                 
-                self._xb_rx_chan.basic_publish(
-                    exchange = self.RAW_XBEE_PACKET_EXCHANGE,
-                    routing_key = routing_key,
-                    properties = pika.BasicProperties(
-                        content_type = _CONTENT_TYPE
+                self._logger.debug("routing_key: %s", key)
+                
+                self.__submit(
+                    self.RAW_XBEE_PACKET_EXCHANGE,
+                    key,
+                    pika.BasicProperties(
+                        content_type = content_type
                     ),
-                    body = serializer_utils.serialize(frame, _CONTENT_TYPE)
+                    frame,
+                    received
                 )
         
         except:
@@ -243,22 +360,209 @@ class XBeeDispatcher(object):
     
     # }}}
     
+    # {{{ __submit
+    def __submit(self, exchange, routing_key, props, frame, received = None):
+        """
+        queues a frame for the publisher thread; received is the monotonic()
+        time the frame was read, for the read_to_publish latency
+        """
+        
+        queued = self.__publisher.submit((exchange, routing_key, props, frame, received))
+        
+        # every hundredth frame dropped, rather than every one, so a full
+        # queue doesn't slow the reader down further
+        if (not queued) and (self.__publisher.overflowed % 100 == 1):
+            self._logger.warn(
+                "publish queue full; dropped frame for %s (%d dropped)",
+                routing_key, self.__publisher.overflowed
+            )
+    
+    # }}}
+    
+    # {{{ __publish_xb_frame
+    def __publish_xb_frame(self, msg):
+        """publishes a queued frame; runs on the publisher thread"""
+        
+        exchange, routing_key, props, frame, received = msg
+        
+        body = serializer_utils.serialize(frame, props.content_type)
+        
+        if self.__spool is not None and (self.__broker_down or len(self.__spool)):
+            # behind any frames already spooled, to keep them in order
+            self.__spool_frame(exchange, routing_key, props, body)
+            self.__drain_spool()
+            return
+        
+        try:
+            self._xb_rx_chan.basic_publish(
+                exchange = exchange,
+                routing_key = routing_key,
+                properties = props,
+                body = body
+            )
+        except:
+            if self.__spool is None:
+                raise
+            
+            self._logger.error("unable to publish; spooling frames until the broker is back",
+                               exc_info = True)
+            
+            self.__broker_down = True
+            self.__next_reconnect = monotonic() + self.RECONNECT_INTERVAL
+            
+            self.__spool_frame(exchange, routing_key, props, body)
+            return
+        
+        if received is not None:
+            self.__read_to_publish(monotonic() - received)
+    
+    # }}}
+    
+    # {{{ __spool_frame
+    def __spool_frame(self, exchange, routing_key, props, body):
+        if not self.__spool.append((str(exchange), str(routing_key),
+                                    str(props.content_type),
+                                    str(props.correlation_id or ''),
+                                    body)):
+            self._logger.warn("spool full; dropped frame for %s (%d dropped)",
+                              routing_key, self.__spool.overflowed)
+    
+    # }}}
+    
+    # {{{ __publish_spooled
+    def __publish_spooled(self, parts):
+        exchange, routing_key, content_type, correlation_id, body = parts
+        
+        self._xb_rx_chan.basic_publish(
+            exchange = exchange,
+            routing_key = routing_key,
+            properties = pika.BasicProperties(
+                content_type = content_type,
+                correlation_id = correlation_id or None
+            ),
+            body = body
+        )
+    
+    # }}}
+    
+    # {{{ __drain_spool
+    def __drain_spool(self):
+        """
+        reconnects to the broker if necessary and replays spooled frames;
+        runs on the publisher thread
+        """
+        
+        if self.__spool is None or not (self.__broker_down or len(self.__spool)):
+            return
+        
+        if self.__broker_down:
+            if monotonic() < self.__next_reconnect or not self.__reconnect():
+                return
+        
+        try:
+            # a batch at a time, leaving off when frames are waiting to be
+            # published so the publisher's queue doesn't overflow; those
+            # frames are spooled behind the rest and draining carries on
+            while self.__spool.replay(self.__publish_spooled, self.SPOOL_REPLAY_BATCH):
+                if self.__publisher.pending():
+                    break
+        except:
+            self._logger.error("unable to replay spooled frames", exc_info = True)
+            
+            self.__broker_down = True
+            self.__next_reconnect = monotonic() + self.RECONNECT_INTERVAL
+    
+    # }}}
+    
+    # {{{ __reconnect
+    def __reconnect(self):
+        """replaces the publisher's broker connection; returns True if it succeeded"""
+        
+        self.__next_reconnect = monotonic() + self.RECONNECT_INTERVAL
+        
+        try:
+            self._xb_rx_conn.close()
+        except:
+            pass
+        
+        try:
+            self._xb_rx_conn = pika.BlockingConnection(self.__connection_params)
+            self._xb_rx_chan = self._xb_rx_conn.channel()
+        except:
+            self._logger.warn("unable to reconnect to broker: %s", sys.exc_info()[1])
+            return False
+        
+        self.__broker_down = False
+        self._logger.info("reconnected to broker; replaying %d spooled frames", len(self.__spool))
+        
+        return True
+    
+    # }}}
+    
+    # {{{ __metrics_loop
+    def __metrics_loop(self):
+        """periodically publishes a metrics snapshot as an event"""
+        
+        while not self.__stop.wait(self.METRICS_INTERVAL):
+            try:
+                self.__submit(
+                    'events',
+                    'xbee_gateway',
+                    pika.BasicProperties(
+                        content_type = serializer_utils.CONTENT_TYPE_JSON
+                    ),
+                    {
+                        'name' : 'metrics',
+                        'data' : self.metrics.snapshot(),
+                    }
+                )
+            except:
+                self._logger.error("unable to publish metrics", exc_info = True)
+    
+    # }}}
+    
     # {{{ process_forever
     def process_forever(self):
-        # create the XBee instance and provide a callback for handling frames
-        ser = serial.Serial(port = self.__serial_port,
-                            baudrate = self.__baudrate,
-                            rtscts=True)
+        # create a coordinator for each port and provide a callback for
+        # handling frames
+        for port in self.__serial_ports:
+            ser = serial.Serial(port = port,
+                                baudrate = self.__baudrate,
+                                rtscts=True)
+            
+            self.coordinators.append(Coordinator(
+                os.path.basename(port),
+                ser,
+                self.__dispatch_xb_frame,
+                escaped = self.__escaped,
+                lazy_frames = True,
+                rate = self.TX_RATE,
+                burst = self.TX_BURST,
+                request_timeout = self.REQUEST_TIMEOUT
+            ))
+        
+        self.__router = CoordinatorRouter(self.coordinators)
         
         # set up connection/channel for sending received XBee packets to the
         # broker
         self._xb_rx_conn = pika.BlockingConnection(self.__connection_params)
         self._xb_rx_chan = self._xb_rx_conn.channel()
         
-        # ok, RX channel is created, so we can safely fire up the XBee thread
-        self.xbee = xbee.XBee(ser,
-                              shorthand = True,
-                              callback = self.__dispatch_xb_frame)
+        # ok, RX channel is created, so we can safely fire up the publisher
+        # and then the coordinators' reader threads, which block on the
+        # serial ports instead of polling them, and TX threads, which send
+        # requests consumed from xbee_tx
+        self.__publisher.start()
+        
+        for coordinator in self.coordinators:
+            coordinator.start()
+        
+        self.__metrics_thread = threading.Thread(target = self.__metrics_loop, name = "metrics")
+        self.__metrics_thread.daemon = True
+        self.__metrics_thread.start()
+        
+        if self.__metrics_address is not None:
+            self.__metrics_server = serve_metrics(self.metrics, self.__metrics_address)
         
         # set up connection/channel for receiving frames to be sent to 
         # XBee devices
@@ -277,9 +581,26 @@ class XBeeDispatcher(object):
             # perform shutdown operations
             self._xb_tx_chan.stop_consuming()
             
-            ## close down XBee comm thread
-            self.xbee.halt()
-            ser.close()
+            ## stop sending, then close down XBee comm threads
+            self.__stop.set()
+            
+            for coordinator in self.coordinators:
+                coordinator.stop(5)
+                coordinator.device.close()
+            
+            if self.__metrics_server is not None:
+                self.__metrics_server.shutdown()
+            
+            # publish whatever's left before the connection goes away
+            self.__publisher.stop(5)
+            self._logger.info("publisher stats: %r", self.__publisher.stats())
+            self._logger.info("TX stats: %r", self.tx_stats())
+            self._logger.info("metrics: %r", self.metrics.snapshot())
+            
+            # anything left is replayed on the next start
+            if self.__spool is not None:
+                self._logger.info("spool stats: %r", self.__spool.stats())
+                self.__spool.close()
             
             # self._xb_tx_chan.close()
             self._xb_tx_conn.close()
@@ -295,9 +616,10 @@ class XBeeDispatcher(object):
         if self._xb_tx_conn.is_open:
             self._xb_tx_chan.stop_consuming()
         
-        # wait for XBee thread to die
-        if self.xbee != None:
-            self.xbee.join()
+        # wait for XBee threads to die
+        for coordinator in self.coordinators:
+            if coordinator.xbee != None:
+                coordinator.xbee.join()
         
         # wait for connections to close
         while self._xb_rx_conn.is_open or self._xb_tx_conn.is_open:
@@ -319,10 +641,29 @@ def main():
     
     # log_config.init_logging_stdout()
     
+    # usage: xbee_gateway.py <serial port>[,<serial port>...] <baud rate> [<API mode (AP), 1 or 2>]
+    api_mode = 1
+    if len(sys.argv) > 3:
+        api_mode = int(sys.argv[3])
+    
+    try:
+        metrics_address = config.xbee_gateway.metrics_address
+    except KeyError:
+        metrics_address = None
+    
+    try:
+        dedup_window = config.xbee_gateway.dedup_window
+    except KeyError:
+        dedup_window = None
+    
     dispatcher = XBeeDispatcher(
         broker_host = config.message_broker.host,
-        serial_port = sys.argv[1],
-        baudrate = int(sys.argv[2])
+        serial_ports = sys.argv[1].split(','),
+        baudrate = int(sys.argv[2]),
+        escaped = (api_mode == 2),
+        metrics_address = metrics_address,
+        spool_path = basedir + "/logs/dispatcher.spool",
+        dedup_window = dedup_window
     )
     
     # The signals SIGKILL and SIGSTOP cannot be caught, blocked, or ignored.
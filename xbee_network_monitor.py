@@ -11,6 +11,7 @@ import sys, os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import consumer
+from support import xbee_addr
 import threading
 
 import logging
@@ -149,9 +150,7 @@ class XBeeNetworkMonitor(consumer.BaseConsumer):
     # }}}
     
     # {{{ format_addr
-    @staticmethod
-    def format_addr(bytes):
-        return ":".join(['%02x' % ord(y) for y in bytes])
+    format_addr = staticmethod(xbee_addr.format_addr)
     
     # }}}
     
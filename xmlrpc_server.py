@@ -38,7 +38,7 @@ class RequestTimedOutException(Exception):
         
 class RPCRequest(object):
     """docstring for RPCRequest"""
-    def __init__(self, queue, command, args):
+    def __init__(self, queue, command, args, timeout):
         super(RPCRequest, self).__init__()
         self.ticket = str(uuid.uuid4())
         self.event = threading.Event()
@@ -47,6 +47,10 @@ class RPCRequest(object):
         self.command = command
         self.args = args
         
+        # sent with the request, so it isn't run once we've stopped waiting
+        self.timeout = timeout
+        self.deadline = time.time() + timeout
+        
         self.exception = None
     
     
@@ -58,6 +62,9 @@ class RPCRequest(object):
 class BrokerWorker(threading.Thread):
     """docstring for BrokerWorker"""
     
+    # seconds to wait for a reply
+    REQUEST_TIMEOUT = 30
+    
     # {{{ __init__
     def __init__(self, host):
         super(BrokerWorker, self).__init__(
@@ -175,7 +182,11 @@ class BrokerWorker(threading.Thread):
                 properties = pika.BasicProperties(
                     reply_to = self.__private_queue_name,
                     correlation_id = request.ticket,
-                    content_type = _CONTENT_TYPE
+                    content_type = _CONTENT_TYPE,
+                    headers = {
+                        # milliseconds since the epoch
+                        'deadline' : long(request.deadline * 1000),
+                    }
                 ),
                 body = serializer_utils.serialize(
                     {
@@ -226,7 +237,7 @@ class BrokerWorker(threading.Thread):
     
     # {{{ rpc_command
     def rpc_command(self, queue, command, args):
-        request = RPCRequest(queue, command, args)
+        request = RPCRequest(queue, command, args, self.REQUEST_TIMEOUT)
         
         self._logger.debug("processing request %s", request)
         
@@ -234,7 +245,7 @@ class BrokerWorker(threading.Thread):
             self.__pending_requests[request.ticket] = request
             
         self.__rpc_queue.put(request.ticket)
-        request.event.wait(30)
+        request.event.wait(request.timeout)
         
         if not request.event.is_set():
             raise RequestTimedOutException("not even a rejection?")